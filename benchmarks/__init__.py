@@ -0,0 +1,21 @@
+"""
+Benchmarks for the catw application.
+
+datagen: generate a deterministic timesheet dataset in a scratch SQLite database.
+run: time the db_model functions and the routes for a number of dataset sizes, write the result as JSON.
+compare: compare two JSON result files and flag the regressions.
+concurrency: measure read and write throughput with concurrent readers and a writer, with and without the SQLite
+profile.
+analytics: check the NumPy analytics engine against the SQL reports and time both (NumPy required).
+compression: bytes on the wire and time to last byte of the project day report, without compression and with gzip and
+deflate.
+grid: time the time entry grid for a growing number of open projects, and the template load with the bytecode cache.
+
+Usage:
+    python -m benchmarks.run --sizes small,medium --output bench_new.json
+    python -m benchmarks.compare bench_old.json bench_new.json
+    python -m benchmarks.concurrency --size medium --readers 4 --seconds 20
+    python -m benchmarks.analytics --size medium
+    python -m benchmarks.compression --size large --mbit 10
+    python -m benchmarks.grid --projects 10,50,200
+"""
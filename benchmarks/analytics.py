@@ -0,0 +1,142 @@
+"""
+This script checks the analytics engine against the SQL report functions and times both. A dataset is generated, every
+report is calculated with ANALYTICS_ENGINE sql and numpy and the results are compared. The comparison is done again
+after writes with update_time_batch, so that the deltas added to the snapshot are checked as well. Time is booked on a
+project ID without a row in projects too, in a year without other time, as the SQL join leaves it out of the project
+reports. NumPy is required. The exit code is 1 if a report is different.
+"""
+
+import argparse
+import datetime
+import json
+import random
+import sys
+from catw import db, readonly
+from catw.analytics import np
+import catw.db_model as dbm
+from benchmarks import datagen
+from benchmarks.run import QueryCounter, measure
+
+
+def project_totals(rows):
+    # The SQL order of projects with the same total time is not defined.
+    return sorted((row.project.project_id, row.total_time) for row in rows)
+
+
+def billable(report):
+    return report.oldest_booking, report.hpd, [tuple(row) for row in report.years]
+
+
+def year_over_year(result):
+    years, rows = result
+    return years, sorted((row.project.project_id, row.years) for row in rows)
+
+
+def report_cases(args, project_ids):
+    """
+    :param args: Dictionary with the year for the year reports.
+
+    :param project_ids: List of project IDs.
+
+    :return: Dictionary with report name and tuple (function without arguments, function to normalize the result).
+    """
+    same = list
+    cases = dict(
+        billable_report=(lambda: dbm.billable_report(), billable),
+        overview_all_rows=(lambda: dbm.overview_all_rows(), project_totals),
+        overview_all_total_time=(lambda: dbm.overview_all_total_time(), int),
+        overview_year_rows=(lambda: dbm.overview_year_rows(args['year']), project_totals),
+        overview_year_total_time=(lambda: dbm.overview_year_total_time(args['year']), int),
+        project_month_rows=(lambda: [dbm.project_month_rows(pid) for pid in project_ids],
+                            lambda res: [[tuple(row) for row in rows] for rows in res]),
+        project_total=(lambda: [dbm.project_total(pid) for pid in project_ids], same),
+        year_over_year=(lambda: dbm.year_over_year(), year_over_year),
+        years_available=(lambda: dbm.years_available(), same)
+    )
+    return cases
+
+
+def parity(app, cases):
+    """
+    :param app: Application
+
+    :param cases: Report cases from report_cases().
+
+    :return: List with the names of the reports that are different.
+    """
+    different = []
+    for name in sorted(cases):
+        func, normalize = cases[name]
+        results = []
+        for engine in ('sql', 'numpy'):
+            app.config['ANALYTICS_ENGINE'] = engine
+            results.append(normalize(func()))
+        if results[0] != results[1]:
+            different.append(name)
+            print("Different: {n}\n  sql   {s}\n  numpy {p}".format(n=name, s=results[0], p=results[1]),
+                  file=sys.stderr)
+    return different
+
+
+def write(week, project_ids, rnd, count):
+    """
+    Change the hours of random days of a week with update_time_batch, 0 hours deletes the entry.
+    """
+    changes = [dict(date=rnd.choice(week).strftime('%Y-%m-%d'), project_id=rnd.choice(project_ids),
+                    hours=rnd.choice((0, 1, 2, 4, 8))) for _ in range(count)]
+    dbm.update_time_batch(changes)
+    return
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the analytics engine with the SQL reports.")
+    parser.add_argument('--size', default='small', help="Dataset size: " + ", ".join(sorted(datagen.SIZES)))
+    parser.add_argument('--repeat', type=int, default=20, help="Number of timed runs per report.")
+    parser.add_argument('--writes', type=int, default=20, help="Number of write batches before the second check.")
+    parser.add_argument('--seed', type=int, default=1, help="Seed for the data generator.")
+    parser.add_argument('--output', help="JSON file for the timings.")
+    args = parser.parse_args()
+    if np is None:
+        sys.exit("NumPy is required for the analytics engine.")
+    app, dbfile = datagen.scratch_app("analytics_{s}".format(s=args.size))
+    rnd = random.Random(args.seed)
+    with app.app_context():
+        datagen.generate(seed=args.seed, **datagen.SIZES[args.size])
+        project_ids = [project.project_id for project in dbm.projects_all_rows()]
+        first_day = dbm.get_oldest_booking()
+        # Time on a project that is not in the projects table, before the first year of the dataset.
+        unknown_id = max(project_ids) + 1000
+        dbm.update_time_batch([dict(date=(first_day - datetime.timedelta(days=400)).strftime('%Y-%m-%d'),
+                                    project_id=unknown_id, hours=8)])
+        db.session.remove()
+        counter = QueryCounter(db.engine, readonly.get_engine(app))
+        cases = report_cases(dict(year=dbm.years_available()[0]), project_ids)
+        different = parity(app, cases)
+        timings = {}
+        for name in sorted(cases):
+            timings[name] = {}
+            for engine in ('sql', 'numpy'):
+                app.config['ANALYTICS_ENGINE'] = engine
+                timings[name][engine] = measure(cases[name][0], counter, args.repeat)
+            print("{n:26} sql {s:9.3f} ms  numpy {p:9.3f} ms".format(n=name, s=timings[name]['sql']['median_ms'],
+                                                                     p=timings[name]['numpy']['median_ms']))
+        app.config['ANALYTICS_ENGINE'] = 'numpy'
+        dbm.overview_all_total_time()
+        loads = app.extensions['analytics'].loads
+        week = [first_day + datetime.timedelta(days=cnt) for cnt in range(7)]
+        for _ in range(args.writes):
+            write(week, project_ids + [unknown_id], rnd, 5)
+            db.session.remove()
+            dbm.overview_all_total_time()
+        print("{w} write batches, snapshot loads during the writes: {l}"
+              .format(w=args.writes, l=app.extensions['analytics'].loads - loads))
+        different += ["{n} after writes".format(n=name) for name in parity(app, cases)]
+    if args.output:
+        with open(args.output, 'w') as fh:
+            fh.write(json.dumps(dict(timings=timings, different=different), indent=2, sort_keys=True))
+    print("{d} reports different.".format(d=len(different)))
+    sys.exit(1 if different else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+This script compares two benchmark result files from benchmarks.run. A case is flagged as a regression if the median
+latency has increased more than the threshold, or if the number of SQL statements has increased.
+The exit code is 1 if there are regressions, so the script can be used in a build.
+"""
+
+import argparse
+import json
+import sys
+
+
+def compare(base, new, threshold=0.2, min_ms=0.05):
+    """
+    Compare two benchmark results.
+
+    :param base: Benchmark result (dictionary) of the reference run.
+
+    :param new: Benchmark result (dictionary) of the new run.
+
+    :param threshold: Relative increase of the median latency that is a regression (0.2 is 20 %).
+
+    :param min_ms: Latency differences below this number of milliseconds are ignored, they are noise.
+
+    :return: Tuple (list of report lines, number of regressions).
+    """
+    lines = []
+    regressions = 0
+    for size in sorted(set(base['sizes']) & set(new['sizes'])):
+        for kind in ('functions', 'routes'):
+            base_cases = base['sizes'][size][kind]
+            new_cases = new['sizes'][size][kind]
+            for case in sorted(set(base_cases) | set(new_cases)):
+                if case not in new_cases:
+                    lines.append("{s:8} {c:40} removed".format(s=size, c=case))
+                    continue
+                if case not in base_cases:
+                    lines.append("{s:8} {c:40} new      {m:10.3f} ms".format(s=size, c=case,
+                                                                           m=new_cases[case]['median_ms']))
+                    continue
+                old_ms = base_cases[case]['median_ms']
+                new_ms = new_cases[case]['median_ms']
+                change = (new_ms - old_ms) / old_ms if old_ms else 0
+                flags = []
+                if change > threshold and new_ms - old_ms > min_ms:
+                    flags.append('SLOWER')
+                if new_cases[case]['queries'] > base_cases[case]['queries']:
+                    flags.append('MORE QUERIES')
+                regressions += 1 if flags else 0
+                # Result files of older runs have no allocations.
+                alloc = ''
+                if 'alloc_kib' in base_cases[case] and 'alloc_kib' in new_cases[case]:
+                    alloc = "  alloc {ao:g} -> {an:g} KiB".format(ao=base_cases[case]['alloc_kib'],
+                                                                  an=new_cases[case]['alloc_kib'])
+                lines.append("{s:8} {c:40} {o:10.3f} -> {n:10.3f} ms {p:+7.1f} %  queries {qo:g} -> {qn:g}{a} {f}"
+                             .format(s=size, c=case, o=old_ms, n=new_ms, p=change * 100,
+                                     qo=base_cases[case]['queries'], qn=new_cases[case]['queries'], a=alloc,
+                                     f=' '.join(flags)))
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two catw benchmark result files.")
+    parser.add_argument('base', help="Result file of the reference run.")
+    parser.add_argument('new', help="Result file of the new run.")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="Relative increase of the median latency that is a regression, default 0.2.")
+    args = parser.parse_args()
+    with open(args.base) as fh:
+        base = json.load(fh)
+    with open(args.new) as fh:
+        new = json.load(fh)
+    print("Base {b}, new {n}".format(b=base['meta']['commit'], n=new['meta']['commit']))
+    lines, regressions = compare(base, new, args.threshold)
+    for line in lines:
+        print(line)
+    print("{r} regressions.".format(r=regressions))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
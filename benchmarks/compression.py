@@ -0,0 +1,146 @@
+"""
+This script measures the response compression on the day report of the project with most bookings, the page of
+REPORT_PAGE_SIZE days and the streamed page with all days. The application runs in a waitress server on a free port,
+pages are requested over HTTP without compression and with gzip and deflate at a number of levels. For every case the
+body bytes on the wire, the time to the first byte and the time to the last byte are reported, and the time to the last
+byte estimated for a link of --mbit Mbit/s.
+"""
+
+import argparse
+import http.client
+import json
+import threading
+import time
+import zlib
+from waitress import create_server
+from catw.compress import CompressMiddleware
+from benchmarks import datagen
+from benchmarks.run import percentile, sample
+
+# Case name: Accept-Encoding and compression level.
+CASES = (
+    ('identity', 'identity', None),
+    ('gzip-1', 'gzip', 1),
+    ('gzip-6', 'gzip', 6),
+    ('gzip-9', 'gzip', 9),
+    ('deflate-6', 'deflate', 6)
+)
+
+
+def fetch(port, host, url, headers):
+    """
+    :param port: Port of the server on 127.0.0.1.
+
+    :param host: Host header.
+
+    :param url: URL to get.
+
+    :param headers: Dictionary with request headers.
+
+    :return: Tuple (response, body, seconds to first byte, seconds to last byte).
+    """
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    start = time.perf_counter()
+    conn.request('GET', url, headers=dict(headers, Host=host))
+    response = conn.getresponse()
+    first = time.perf_counter() - start
+    body = response.read()
+    last = time.perf_counter() - start
+    conn.close()
+    return response, body, first, last
+
+
+def login(port, host):
+    """
+    :return: Cookie header of the session of the benchmark user.
+    """
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    data = "username={u}&password={p}".format(u=datagen.USERNAME, p=datagen.PASSWORD)
+    conn.request('POST', '/login', body=data,
+                 headers={'Host': host, 'Content-Type': 'application/x-www-form-urlencoded'})
+    response = conn.getresponse()
+    response.read()
+    cookie = response.getheader('Set-Cookie').split(';', 1)[0]
+    conn.close()
+    return cookie
+
+
+def decode(body, encoding):
+    if encoding == 'gzip':
+        return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        return zlib.decompress(body)
+    return body
+
+
+def run_page(app, port, host, cookie, url, repeat, mbit):
+    """
+    :return: Dictionary with case name and result.
+    """
+    middleware = app.wsgi_app
+    result = {}
+    plain = None
+    for name, encoding, level in CASES:
+        if level:
+            middleware.level = level
+        headers = {'Cookie': cookie, 'Accept-Encoding': encoding}
+        fetch(port, host, url, headers)
+        firsts = []
+        lasts = []
+        for _ in range(repeat):
+            response, body, first, last = fetch(port, host, url, headers)
+            firsts.append(first * 1000)
+            lasts.append(last * 1000)
+        content = decode(body, response.getheader('Content-Encoding'))
+        if plain is None:
+            plain = content
+        elif content != plain:
+            print("Warning: {n} differs from the uncompressed page".format(n=name))
+        transfer_ms = len(body) * 8 / (mbit * 1000.0)
+        result[name] = dict(bytes=len(body), ratio=round(len(plain) / float(len(body)), 2),
+                            encoding=response.getheader('Content-Encoding'),
+                            ttfb_median_ms=round(percentile(firsts, 50), 3),
+                            ttlb_median_ms=round(percentile(lasts, 50), 3), ttlb_p95_ms=round(percentile(lasts, 95), 3),
+                            ttlb_link_ms=round(percentile(lasts, 50) + transfer_ms, 3))
+        res = result[name]
+        print("  {n:10} {b:9} bytes  x{r:<6} ttfb {f:8.3f} ms  ttlb {l:8.3f} ms  p95 {p:8.3f} ms  "
+              "at {m} Mbit/s {k:9.3f} ms".format(n=name, b=res['bytes'], r=res['ratio'], f=res['ttfb_median_ms'],
+                                                 l=res['ttlb_median_ms'], p=res['ttlb_p95_ms'], m=mbit,
+                                                 k=res['ttlb_link_ms']))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the response compression on the project day report.")
+    parser.add_argument('--size', default='medium', help="Dataset size: " + ", ".join(sorted(datagen.SIZES)))
+    parser.add_argument('--repeat', type=int, default=20, help="Number of timed requests per case.")
+    parser.add_argument('--mbit', type=float, default=10, help="Link speed in Mbit/s for the estimated time.")
+    parser.add_argument('--seed', type=int, default=1, help="Seed for the data generator.")
+    parser.add_argument('--output', help="JSON file for the result.")
+    args = parser.parse_args()
+    app, dbfile = datagen.scratch_app("compression_{s}".format(s=args.size))
+    if not isinstance(app.wsgi_app, CompressMiddleware):
+        app.wsgi_app = CompressMiddleware(app.wsgi_app)
+    with app.app_context():
+        info = datagen.generate(seed=args.seed, **datagen.SIZES[args.size])
+        project_id = sample(info)['project_id']
+    server = create_server(app, host='127.0.0.1', port=0, threads=4)
+    thread = threading.Thread(target=server.run)
+    thread.daemon = True
+    thread.start()
+    port = server.effective_port
+    host = app.config.get('SERVER_NAME') or '127.0.0.1:{p}'.format(p=port)
+    cookie = login(port, host)
+    result = dict(dataset=dict(info, size=args.size, project_id=project_id), mbit=args.mbit, pages={})
+    for page, url in (('page', '/report/project/{p}/day'.format(p=project_id)),
+                      ('stream', '/report/project/{p}/day?stream=1'.format(p=project_id))):
+        print("{p}: {u}".format(p=page, u=url))
+        result['pages'][page] = run_page(app, port, host, cookie, url, args.repeat, args.mbit)
+    server.close()
+    if args.output:
+        with open(args.output, 'w') as fh:
+            fh.write(json.dumps(result, indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
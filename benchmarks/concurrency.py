@@ -0,0 +1,154 @@
+"""
+This script measures the read and write throughput on a SQLite database while reports are read and time is entered
+at the same time. Reader threads call report functions, a writer thread enters time with update_time_batch. The run is
+done without the SQLite profile (SQLite defaults) and with the SQLITE_PRAGMAS profile from the configuration, so the
+effect of the profile is shown.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from catw import db
+import catw.db_model as dbm
+from benchmarks import datagen
+from benchmarks.run import percentile, sample, consume
+
+
+def read_cases(args):
+    """
+    :param args: Sample arguments from run.sample().
+
+    :return: List of functions without arguments that read a report.
+    """
+    return [
+        lambda: dbm.overview_all(),
+        lambda: dbm.overview_year(args['year']),
+        lambda: dbm.billable_report(),
+        lambda: dbm.project_day(args['project_id']),
+        lambda: dbm.project_time(args['week'][0], args['week'][6]),
+        lambda: dbm.timesheet_export(from_date=args['week'][0], to_date=args['week'][6])
+    ]
+
+
+def reader(app, cases, stop, result, seed):
+    """
+    Call random report functions until stop is set. Every call is done on a new session, as in a request.
+    """
+    rnd = random.Random(seed)
+    with app.app_context():
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                consume(rnd.choice(cases)())
+            except Exception:
+                result['errors'] += 1
+            else:
+                result['latency'].append((time.perf_counter() - start) * 1000)
+            finally:
+                db.session.remove()
+    return
+
+
+def writer(app, args, stop, result, interval):
+    """
+    Enter time for a week with update_time_batch until stop is set. Hours are toggled, so the dataset remains the same.
+    """
+    batch = [dict(date=dt.strftime('%Y-%m-%d'), project_id=args['project_id'], hours=2) for dt in args['week'][:5]]
+    with app.app_context():
+        while not stop.is_set():
+            for change in batch:
+                change['hours'] = 2 if change['hours'] != 2 else 3
+            start = time.perf_counter()
+            try:
+                dbm.update_time_batch(batch)
+            except Exception:
+                result['errors'] += 1
+                db.session.rollback()
+            else:
+                result['latency'].append((time.perf_counter() - start) * 1000)
+            finally:
+                db.session.remove()
+            time.sleep(interval)
+    return
+
+
+def summary(result, seconds):
+    latency = result['latency']
+    return dict(count=len(latency), per_second=round(len(latency) / seconds, 1), errors=result['errors'],
+                median_ms=round(percentile(latency, 50), 3) if latency else None,
+                p95_ms=round(percentile(latency, 95), 3) if latency else None,
+                max_ms=round(max(latency), 3) if latency else None)
+
+
+def run_profile(name, tuned, size, readers, seconds, interval, seed):
+    """
+    Generate a dataset and run readers and the writer for a number of seconds.
+
+    :param name: Name of the run.
+
+    :param tuned: True to use the SQLite profile from the configuration, False for the SQLite defaults.
+
+    :param size: Dataset size from datagen.SIZES.
+
+    :param readers: Number of reader threads.
+
+    :param seconds: Duration of the run.
+
+    :param interval: Seconds between two writes.
+
+    :param seed: Seed for the data generator.
+
+    :return: Dictionary with the summary for reads and writes.
+    """
+    app, dbfile = datagen.scratch_app("concurrency_{n}".format(n=name))
+    if not tuned:
+        app.config['SQLITE_PRAGMAS'] = None
+    with app.app_context():
+        info = datagen.generate(seed=seed, **datagen.SIZES[size])
+        args = sample(info)
+        db.session.remove()
+    cases = read_cases(args)
+    stop = threading.Event()
+    reads = [dict(latency=[], errors=0) for _ in range(readers)]
+    writes = dict(latency=[], errors=0)
+    threads = [threading.Thread(target=reader, args=(app, cases, stop, reads[cnt], seed + cnt))
+               for cnt in range(readers)]
+    threads.append(threading.Thread(target=writer, args=(app, args, stop, writes, interval)))
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    all_reads = dict(latency=[value for res in reads for value in res['latency']],
+                     errors=sum(res['errors'] for res in reads))
+    return dict(reads=summary(all_reads, seconds), writes=summary(writes, seconds))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure concurrent read and write throughput on SQLite, with and "
+                                                 "without the SQLite profile.")
+    parser.add_argument('--size', default='small', help="Dataset size: " + ", ".join(sorted(datagen.SIZES)))
+    parser.add_argument('--readers', type=int, default=4, help="Number of reader threads.")
+    parser.add_argument('--seconds', type=float, default=10, help="Duration of each run in seconds.")
+    parser.add_argument('--interval', type=float, default=0.0, help="Seconds between two writes.")
+    parser.add_argument('--seed', type=int, default=1, help="Seed for the data generator.")
+    parser.add_argument('--output', help="JSON file for the result.")
+    args = parser.parse_args()
+    result = {}
+    for name, tuned in (('defaults', False), ('profile', True)):
+        result[name] = run_profile(name, tuned, args.size, args.readers, args.seconds, args.interval, args.seed)
+        for kind in ('reads', 'writes'):
+            res = result[name][kind]
+            print("{n:8} {k:6} {c:7} {s:8.1f}/s  median {m} ms  p95 {p} ms  max {x} ms  errors {e}"
+                  .format(n=name, k=kind, c=res['count'], s=res['per_second'], m=res['median_ms'], p=res['p95_ms'],
+                          x=res['max_ms'], e=res['errors']))
+    if args.output:
+        with open(args.output, 'w') as fh:
+            fh.write(json.dumps(result, indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
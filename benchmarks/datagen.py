@@ -0,0 +1,106 @@
+"""
+This module generates a realistic timesheet dataset. The dataset is deterministic for a given seed: projects with a
+start and end date, about 8 hours booked per working day over a number of projects, and holidays booked on the
+'Not Available' project.
+"""
+
+import datetime
+import os
+import random
+import tempfile
+from catw import create_app, db
+import catw.db_model as dbm
+
+# Dataset sizes: number of projects, number of years and number of bookings per working day.
+SIZES = {
+    'small': dict(projects=10, years=2, per_day=3),
+    'medium': dict(projects=40, years=5, per_day=4),
+    'large': dict(projects=120, years=10, per_day=6)
+}
+
+HOURS_PER_DAY = 8
+# Last year with bookings, fixed so that a dataset doesn't depend on the date of the run.
+END_YEAR = 2016
+USERNAME = 'bench'
+PASSWORD = 'bench-password'
+
+
+def scratch_app(name):
+    """
+    This method will create an application on a new scratch SQLite database.
+
+    :param name: Name for the database file.
+
+    :return: Tuple (application, database file name).
+    """
+    dbfile = os.path.join(tempfile.gettempdir(), "catw_bench_{n}.db".format(n=name))
+    if os.path.exists(dbfile):
+        os.remove(dbfile)
+    app = create_app('benchmark')
+    app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:///" + dbfile
+    return app, dbfile
+
+
+def generate(projects=10, years=2, per_day=3, seed=1, end_year=END_YEAR):
+    """
+    This method will fill the database of the current application with a generated dataset. Projects are added with
+    the Project model, bookings are written through timesheet_bulk one month at a time, so the rollup tables are
+    maintained in the same way as for the application.
+
+    :param projects: Number of projects, including the 'Not Available' project for the holidays.
+
+    :param years: Number of years with bookings.
+
+    :param per_day: Number of projects with a booking per working day.
+
+    :param seed: Seed for the random generator.
+
+    :param end_year: Last year with bookings.
+
+    :return: Dictionary with the number of projects and bookings, first and last date.
+    """
+    rnd = random.Random(seed)
+    first_day = datetime.date(end_year - years + 1, 1, 1)
+    last_day = datetime.date(end_year, 12, 31)
+    dbm.migrate()
+    dbm.User.register(USERNAME, PASSWORD)
+    db.session.add(dbm.Parameter(parameter='hoursPerDay', value=str(HOURS_PER_DAY)))
+    # Projects, every project is active for a period. The last projects are still open.
+    project_list = [dbm.Project(name=dbm.HOLIDAYS, wbs='NA', status='open', billable='not', start=first_day)]
+    span = (last_day - first_day).days
+    for cnt in range(1, projects):
+        start = first_day + datetime.timedelta(days=rnd.randint(0, max(span - 60, 0)))
+        end = min(start + datetime.timedelta(days=rnd.randint(60, 720)), last_day)
+        project_list.append(dbm.Project(name="Project {cnt:04d}".format(cnt=cnt),
+                                        wbs="WBS.{a:03d}.{b:02d}".format(a=rnd.randint(1, 999), b=cnt % 100),
+                                        status='open' if end >= last_day else 'closed',
+                                        billable='customer' if rnd.random() < 0.7 else 'not',
+                                        start=start, end=end, info="Generated project {cnt}".format(cnt=cnt)))
+    db.session.add_all(project_list)
+    db.session.commit()
+    holiday_id = project_list[0].project_id
+    periods = [(rec.project_id, rec.start, rec.end) for rec in project_list[1:]]
+    bookings = 0
+    day = first_day
+    rows = []
+    while day <= last_day:
+        if day.isoweekday() < 6:
+            if rnd.random() < 0.1:
+                rows.append((day, holiday_id, HOURS_PER_DAY))
+            else:
+                active = [pid for pid, start, end in periods if start <= day <= end] or [pid for pid, _, _ in periods]
+                chosen = rnd.sample(active, min(per_day, len(active)))
+                remaining = HOURS_PER_DAY
+                for pos, pid in enumerate(chosen):
+                    hours = remaining if pos == len(chosen) - 1 else rnd.randint(1, max(remaining - 1, 1))
+                    if hours > 0:
+                        rows.append((day, pid, hours))
+                    remaining -= hours
+        next_day = day + datetime.timedelta(days=1)
+        if next_day.month != day.month or next_day > last_day:
+            dbm.timesheet_bulk(rows)
+            db.session.commit()
+            bookings += len(rows)
+            rows = []
+        day = next_day
+    return dict(projects=projects, bookings=bookings, first_day=first_day.isoformat(), last_day=last_day.isoformat())
@@ -0,0 +1,120 @@
+"""
+This script measures the time entry grid (enter_sheet) as the number of open projects grows. Open projects with
+bookings in the week are added to a small dataset, and for every number of projects the grid preparation
+(project_time and cell_rows), the template rendering and the complete request are timed. The loading of the template
+is timed without and with the Jinja bytecode cache.
+"""
+
+import argparse
+import datetime
+import json
+import shutil
+import tempfile
+import time
+from flask import render_template
+from jinja2 import FileSystemBytecodeCache
+from catw import db, readonly
+import catw.db_model as dbm
+from benchmarks import datagen
+from benchmarks.run import QueryCounter, measure, percentile, sample
+
+
+def add_projects(count, week, start):
+    """
+    Add open projects with bookings on the working days of the week.
+
+    :param count: Number of projects to add.
+
+    :param week: List with the days of the week.
+
+    :param start: Number of the first project, for the name.
+
+    :return:
+    """
+    projects = [dbm.Project(name="Grid project {cnt:04d}".format(cnt=cnt), wbs="GRID.{cnt:04d}".format(cnt=cnt),
+                            status='open', billable='customer', start=week[0] - datetime.timedelta(days=30))
+                for cnt in range(start, start + count)]
+    db.session.add_all(projects)
+    db.session.commit()
+    dbm.timesheet_bulk([(day, project.project_id, 1 + (project.project_id + pos) % 4)
+                        for project in projects for pos, day in enumerate(week[:5])])
+    db.session.commit()
+    return
+
+
+def template_load(app, repeat):
+    """
+    :return: Dictionary with the median time in ms to load enter_sheet.html, compiled and from the bytecode cache.
+    """
+    env = app.jinja_env
+    saved = env.bytecode_cache
+    directory = tempfile.mkdtemp(prefix='catw_bench_jinja')
+    result = {}
+    try:
+        for name, cache in (('compile_ms', None), ('bytecode_cache_ms', FileSystemBytecodeCache(directory))):
+            env.bytecode_cache = cache
+            env.get_template('enter_sheet.html')
+            timings = []
+            for _ in range(repeat):
+                env.cache.clear()
+                start = time.perf_counter()
+                env.get_template('enter_sheet.html')
+                timings.append((time.perf_counter() - start) * 1000)
+            result[name] = round(percentile(timings, 50), 3)
+    finally:
+        env.bytecode_cache = saved
+        env.cache.clear()
+        shutil.rmtree(directory)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the time entry grid for a growing number of open projects.")
+    parser.add_argument('--projects', default='10,25,50,100,200', help="Comma separated numbers of open projects.")
+    parser.add_argument('--repeat', type=int, default=20, help="Number of timed runs per case.")
+    parser.add_argument('--seed', type=int, default=1, help="Seed for the data generator.")
+    parser.add_argument('--output', help="JSON file for the result.")
+    args = parser.parse_args()
+    app, dbfile = datagen.scratch_app('grid')
+    client = app.test_client()
+    result = dict(grids={})
+    with app.app_context():
+        info = datagen.generate(seed=args.seed, **datagen.SIZES['small'])
+        week = sample(info)['week']
+        date = week[0].strftime('%Y-%m-%d')
+        counter = QueryCounter(db.engine, readonly.get_engine(app))
+        result['template'] = template_load(app, args.repeat)
+        print("enter_sheet.html: compile {c} ms, from the bytecode cache {b} ms"
+              .format(c=result['template']['compile_ms'], b=result['template']['bytecode_cache_ms']))
+        client.post('/login', data=dict(username=datagen.USERNAME, password=datagen.PASSWORD))
+        added = 0
+        for count in sorted(int(value) for value in args.projects.split(',')):
+            open_projects = len(dbm.openprojectlist_rows())
+            if count > open_projects:
+                add_projects(count - open_projects, week, added)
+                added += count - open_projects
+            db.session.remove()
+            projects = dbm.openprojectlist_rows()
+            grid = dbm.project_time(week[0], week[6])
+
+            def render():
+                with app.test_request_context():
+                    return render_template('enter_sheet.html', columns=grid.columns(),
+                                           rows=grid.cell_rows(projects), total=grid.total)
+
+            res = dict(
+                prepare=measure(lambda: dbm.project_time(week[0], week[6]).cell_rows(projects), counter, args.repeat),
+                render=measure(render, counter, args.repeat),
+                request=measure(lambda: client.get('/entertime/{d}'.format(d=date)), counter, args.repeat)
+            )
+            result['grids'][len(projects)] = res
+            print("{p:5} projects  prepare {a:8.3f} ms  render {r:8.3f} ms  request {q:8.3f} ms"
+                  .format(p=len(projects), a=res['prepare']['median_ms'], r=res['render']['median_ms'],
+                          q=res['request']['median_ms']))
+    if args.output:
+        with open(args.output, 'w') as fh:
+            fh.write(json.dumps(result, indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""
+This script times every public function in catw.db_model and every route in catw.main.routes on generated datasets of
+several sizes. For each case the median and 95th percentile latency, the number of SQL statements and the peak memory
+allocated during a call are reported.
+The result is written as JSON, use benchmarks.compare to compare two runs.
+"""
+
+import argparse
+import datetime
+import inspect
+import json
+import math
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from sqlalchemy import event
+from catw import db, readonly
+import catw.db_model as dbm
+from benchmarks import datagen
+from lib import my_env
+
+# db_model functions that are not timed: they change the schema, rebuild data or need a login.
+SKIP_FUNCTIONS = ('changelog_add', 'changelog_compact', 'load_user', 'migrate', 'rollup_apply', 'rollup_rebuild',
+                  'rollup_reclassify', 'timesheet_bulk')
+# Routes that are not timed: they end the session.
+SKIP_ROUTES = ('main.logout',)
+
+
+class QueryCounter:
+    """
+    This class counts the SQL statements executed on the engines. Pass the write engine and the read-only engine of the
+    reports, so that statements on both are counted.
+    """
+
+    def __init__(self, *engines):
+        self.count = 0
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+def consume(res):
+    """
+    Make sure that the result of a function is fetched completely.
+
+    :param res: Result of the function.
+
+    :return: (nothing)
+    """
+    if hasattr(res, '__iter__') and not isinstance(res, (str, bytes, dict)):
+        for _ in res:
+            pass
+    return
+
+
+def percentile(values, pct):
+    """
+    :param values: List of values.
+
+    :param pct: Percentile (0 - 100).
+
+    :return: The value at the percentile of the sorted values.
+    """
+    ordered = sorted(values)
+    pos = max(int(math.ceil(pct * len(ordered) / 100.0)) - 1, 0)
+    return ordered[pos]
+
+
+def measure(func, counter, repeat):
+    """
+    Run a function repeat times after a warm up run.
+
+    :param func: Function without arguments.
+
+    :param counter: QueryCounter for the database engine.
+
+    :param repeat: Number of timed runs.
+
+    :return: Dictionary with median_ms, p95_ms, queries (SQL statements per run) and alloc_kib (peak memory allocated
+    during a run in KiB).
+    """
+    consume(func())
+    timings = []
+    counter.count = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        consume(func())
+        timings.append((time.perf_counter() - start) * 1000)
+    queries = counter.count / float(repeat)
+    # The allocations are measured in a separate run, tracing slows down the calls.
+    tracemalloc.start()
+    consume(func())
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return dict(median_ms=round(percentile(timings, 50), 3), p95_ms=round(percentile(timings, 95), 3),
+                queries=queries, alloc_kib=round(peak / 1024.0, 1))
+
+
+def sample(info):
+    """
+    This method will collect the arguments to use for the benchmark cases: the project with most bookings, a year, a
+    week in the middle of the dataset.
+
+    :param info: Dataset information from datagen.generate.
+
+    :return: Dictionary with project_id, year, date (datetime.date) and week (list of dates).
+    """
+    project_id = dbm.overview_all()[0][0].project_id
+    year = dbm.years_available()[0]
+    last_day = datetime.datetime.strptime(info['last_day'], '%Y-%m-%d').date()
+    date = last_day - datetime.timedelta(days=180)
+    return dict(project_id=project_id, year=year, date=date, week=my_env.date2week(date))
+
+
+def function_cases(args):
+    """
+    :param args: Sample arguments from sample().
+
+    :return: Dictionary with function name and a function without arguments to call it.
+    """
+    week = args['week']
+    batch = [dict(date=dt.strftime('%Y-%m-%d'), project_id=args['project_id'], hours=2) for dt in week[:5]]
+    dbid = "{d}.{p}".format(d=week[5].strftime('%Y-%m-%d'), p=args['project_id'])
+    # Write cases toggle a value, so the dataset remains the same.
+    toggle = {'ts': 0}
+
+    def update_time():
+        toggle['ts'] = 3 - toggle['ts']
+        dbm.update_time(dbid=dbid, ts=str(toggle['ts']))
+
+    def update_time_batch():
+        for change in batch:
+            change['hours'] = 2 if change['hours'] != 2 else 3
+        dbm.update_time_batch(batch)
+
+    cases = dict(
+        billable_all_total_time=lambda: dbm.billable_all_total_time(),
+        billable_per_year=lambda: dbm.billable_per_year(),
+        billable_report=lambda: dbm.billable_report(),
+        changelog_horizon=lambda: dbm.changelog_horizon(),
+        changes_since=lambda: dbm.changes_since(0),
+        changes_version=lambda: dbm.changes_version(),
+        data_version_sync=lambda: dbm.data_version_sync(),
+        get_oldest_booking=lambda: dbm.get_oldest_booking(),
+        get_param_value=lambda: dbm.get_param_value(),
+        holidays_all_total_time=lambda: dbm.holidays_all_total_time(),
+        is_billable=lambda: dbm.is_billable('customer'),
+        is_holiday=lambda: dbm.is_holiday('Not Available'),
+        openprojectlist=lambda: dbm.openprojectlist(),
+        openprojectlist_rows=lambda: dbm.openprojectlist_rows(),
+        overview_all=lambda: dbm.overview_all(),
+        overview_all_rows=lambda: dbm.overview_all_rows(),
+        overview_all_total_time=lambda: dbm.overview_all_total_time(),
+        overview_year=lambda: dbm.overview_year(args['year']),
+        overview_year_rows=lambda: dbm.overview_year_rows(args['year']),
+        overview_year_total_time=lambda: dbm.overview_year_total_time(args['year']),
+        project=lambda: dbm.project(args['project_id']),
+        project_day=lambda: dbm.project_day(args['project_id']),
+        project_day_rows=lambda: dbm.project_day_rows(args['project_id']),
+        project_day_stream=lambda: dbm.project_day_stream(args['project_id']),
+        project_month=lambda: dbm.project_month(args['project_id']),
+        project_month_rows=lambda: dbm.project_month_rows(args['project_id']),
+        project_time=lambda: dbm.project_time(week[0], week[6]),
+        project_total=lambda: dbm.project_total(args['project_id']),
+        projectlist=lambda: dbm.projectlist([args['project_id']]),
+        projectlist_rows=lambda: dbm.projectlist_rows([args['project_id']]),
+        projects_all=lambda: dbm.projects_all(),
+        projects_all_rows=lambda: dbm.projects_all_rows(),
+        rollup_needs_rebuild=lambda: dbm.rollup_needs_rebuild(),
+        rollup_verify=lambda: dbm.rollup_verify(args['year']),
+        table_rows=lambda: dbm.table_rows(),
+        timesheet_export=lambda: dbm.timesheet_export(),
+        total_time_eh_year=lambda: dbm.total_time_eh_year(),
+        total_time_per_year=lambda: dbm.total_time_per_year(),
+        update_time=update_time,
+        update_time_batch=update_time_batch,
+        year_over_year=lambda: dbm.year_over_year(),
+        years_available=lambda: dbm.years_available()
+    )
+    return cases
+
+
+def route_cases(args, metrics_token):
+    """
+    :param args: Sample arguments from sample().
+
+    :param metrics_token: METRICS_TOKEN of the application.
+
+    :return: Dictionary with endpoint and tuple (method, url, data) for the request. Data is the body of a POST and
+    the headers of a GET.
+    """
+    date = args['date'].strftime('%Y-%m-%d')
+    dbid = "{d}.{p}".format(d=args['week'][6].strftime('%Y-%m-%d'), p=args['project_id'])
+    batch = json.dumps([dict(date=dt.strftime('%Y-%m-%d'), project_id=args['project_id'], hours=1)
+                        for dt in args['week'][:5]])
+    pid = args['project_id']
+    cases = {
+        'main.enter_sheet': ('GET', '/entertime/{d}'.format(d=date), None),
+        'main.enter_range': ('GET', '/entertime/range/month/{d}'.format(d=date), None),
+        'main.enter_time': ('GET', '/entertime', None),
+        'main.enter_week': ('GET', '/entertime/week/{d}'.format(d=date), None),
+        'main.export_timesheet': ('GET', '/export/timesheet', None),
+        'main.index': ('GET', '/', None),
+        'main.login': ('GET', '/login', None),
+        'main.project_add': ('GET', '/project/add', None),
+        'main.project_edit': ('GET', '/project/edit/{p}'.format(p=pid), None),
+        'main.pwd_update': ('GET', '/pwdupdate', None),
+        'main.report_all': ('GET', '/report/all', None),
+        'main.report_billable': ('GET', '/report/billable', None),
+        'main.report_project_day': ('GET', '/report/project/{p}/day'.format(p=pid), None),
+        'main.report_project_month': ('GET', '/report/project/{p}/month'.format(p=pid), None),
+        'main.report_project_select': ('GET', '/report/project/select', None),
+        'main.report_week': ('GET', '/report/week', None),
+        'main.report_week_date': ('GET', '/report/week/{d}'.format(d=date), None),
+        'main.report_year': ('GET', '/report/years/{y}'.format(y=args['year']), None),
+        'main.status': ('GET', '/status', None),
+        'main.api_changes': ('GET', '/api/changes', None),
+        'main.prometheus_metrics': ('GET', '/metrics', {'Authorization': 'Bearer ' + metrics_token}),
+        'main.update_time': ('GET', '/updatetime?dbid={i}&ts=2'.format(i=dbid), None),
+        'main.update_time_batch': ('POST', '/updatetime/batch', batch)
+    }
+    return cases
+
+
+def check_coverage(app, functions, routes):
+    """
+    Warn for public db_model functions and routes that don't have a benchmark case.
+    """
+    for name, obj in inspect.getmembers(dbm, inspect.isfunction):
+        if obj.__module__ == dbm.__name__ and not name.startswith('_') and name not in functions \
+                and name not in SKIP_FUNCTIONS:
+            print("Warning: no benchmark case for function {n}".format(n=name), file=sys.stderr)
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint.startswith('main.') and rule.endpoint not in routes and rule.endpoint not in SKIP_ROUTES:
+            print("Warning: no benchmark case for route {n}".format(n=rule.endpoint), file=sys.stderr)
+    return
+
+
+def run_size(name, params, repeat, seed):
+    """
+    Generate the dataset for a size and time all cases.
+
+    :param name: Name of the size.
+
+    :param params: Dictionary with projects, years and per_day.
+
+    :param repeat: Number of timed runs per case.
+
+    :param seed: Seed for the data generator.
+
+    :return: Dictionary with dataset info, function results and route results.
+    """
+    app, dbfile = datagen.scratch_app(name)
+    with app.app_context():
+        start = time.perf_counter()
+        info = datagen.generate(seed=seed, **params)
+        info['generate_s'] = round(time.perf_counter() - start, 2)
+        print("{n}: {b} bookings generated in {s} seconds".format(n=name, b=info['bookings'], s=info['generate_s']))
+        counter = QueryCounter(db.engine, readonly.get_engine(app))
+        args = sample(info)
+        functions = function_cases(args)
+        routes = route_cases(args, app.config['METRICS_TOKEN'])
+        check_coverage(app, functions, routes)
+        function_results = {}
+        for case in sorted(functions):
+            function_results[case] = measure(functions[case], counter, repeat)
+            # Start every case from a clean session, as a request does.
+            db.session.remove()
+    route_results = {}
+    client = app.test_client()
+    client.post('/login', data=dict(username=datagen.USERNAME, password=datagen.PASSWORD))
+    for case in sorted(routes):
+        method, url, data = routes[case]
+        if method == 'POST':
+            request = lambda: client.post(url, data=data, content_type='application/json')
+        else:
+            request = lambda: client.get(url, headers=data)
+        route_results[case] = measure(request, counter, repeat)
+        status = request().status_code
+        if status >= 400:
+            print("Warning: route {c} returns status {s}".format(c=case, s=status), file=sys.stderr)
+    return dict(dataset=dict(info, **params), functions=function_results, routes=route_results)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL)\
+            .decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the catw db_model functions and routes.")
+    parser.add_argument('--sizes', default='small,medium', help="Comma separated dataset sizes: " +
+                                                                  ", ".join(sorted(datagen.SIZES)))
+    parser.add_argument('--repeat', type=int, default=20, help="Number of timed runs per case.")
+    parser.add_argument('--seed', type=int, default=1, help="Seed for the data generator.")
+    parser.add_argument('--output', help="JSON file for the result, default standard output.")
+    args = parser.parse_args()
+    result = dict(meta=dict(commit=git_commit(), python=platform.python_version(), repeat=args.repeat,
+                            seed=args.seed, timestamp=datetime.datetime.now().isoformat()),
+                  sizes={})
+    for name in args.sizes.split(','):
+        result['sizes'][name] = run_size(name, datagen.SIZES[name], args.repeat, args.seed)
+    output = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            fh.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
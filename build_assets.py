@@ -0,0 +1,21 @@
+"""
+This script will build the static asset bundles: the JavaScript and CSS files are concatenated, minified and written in
+catw/static/dist with a content hash in the file name and a gzip variant. Run it after a change of a static file and
+restart the application, the manifest is read at start.
+"""
+import platform
+from catw import create_app
+from catw.assets import build, rcssmin, rjsmin
+
+
+if __name__ == "__main__":
+    if platform.node() == "zeegeus":
+        app = create_app('production')
+    else:
+        app = create_app('development')
+
+    manifest = build(app)
+    for name, filename in sorted(manifest.items()):
+        print("{n}: {f}".format(n=name, f=filename))
+    if rjsmin is None or rcssmin is None:
+        print("rjsmin or rcssmin is not installed, the bundles are not minified (python_modules.txt).")
@@ -1,23 +1,184 @@
-import platform
+"""
+This script runs the application.
+The configuration is taken from the CATW_CONFIG environment variable, or from the host name: production on zeegeus,
+development elsewhere. With a debug configuration the Flask development server is used, otherwise waitress.
+The waitress server is tuned with the SERVER_* settings of the configuration. An environment variable CATW_<NAME>
+overrides the setting SERVER_<NAME>:
+    LISTEN: host:port to listen on.
+    THREADS: number of threads per process that handle requests.
+    CONNECTION_LIMIT: maximum number of open connections per process.
+    CHANNEL_TIMEOUT: seconds of inactivity after which a connection is closed.
+    BACKLOG: length of the queue of connections waiting to be accepted.
+    WORKERS: number of processes. With more than 1 worker the listening socket is opened in the parent process and
+    shared by forked worker processes, so that report rendering can use more than one CPU core (POSIX only).
+The database migration and the default user check are done once, in the parent process.
+"""
+import logging
 import os
-from catw import create_app, db
+import platform
+import signal
+import socket
+import time
+from catw import create_app, db, metrics, readonly, warmer
+from catw.cache import data_version
 from catw.db_model import User
-from waitress import serve
+import catw.db_model as dbm
+from waitress import create_server
 
+SERVER_SETTINGS = (('LISTEN', str), ('THREADS', int), ('CONNECTION_LIMIT', int), ('CHANNEL_TIMEOUT', int),
+                   ('BACKLOG', int), ('WORKERS', int))
 
-# Run Application
-if __name__ == "__main__":
-    if platform.node() == "zeegeus":
-        app = create_app('production')
+
+def config_name():
+    if os.environ.get('CATW_CONFIG'):
+        return os.environ['CATW_CONFIG']
+    elif platform.node() == "zeegeus":
+        return 'production'
     else:
-        app = create_app('development')
+        return 'development'
+
+
+def server_settings(app):
+    """
+    :param app: Application
+
+    :return: Dictionary with the server settings, lower case names without SERVER_.
+    """
+    settings = {}
+    for name, convert in SERVER_SETTINGS:
+        settings[name.lower()] = convert(os.environ.get('CATW_' + name, app.config.get('SERVER_' + name)))
+    return settings
+
 
+def prepare(app):
+    """
+    Bring the database up to date and make sure the default user exists. The templates are compiled (or loaded from
+    the bytecode cache), so that forked workers don't compile them again.
+    """
     with app.app_context():
-        db.create_all()
+        for action in dbm.migrate():
+            logging.info(action)
         if User.query.filter_by(username='dirk').first() is None:
             User.register('dirk', 'olse')
-        if platform.node() == "zeegeus":
-            serve(app, listen='127.0.0.1:8001')
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(name)
+    return
+
+
+def waitress_options(settings):
+    return dict(threads=settings['threads'], connection_limit=settings['connection_limit'],
+                channel_timeout=settings['channel_timeout'], backlog=settings['backlog'])
+
+
+def serve(app, **kwargs):
+    """
+    Run the waitress server. The server is given to the metrics, for the waitress task queue.
+
+    :param app: Application
+
+    :param kwargs: waitress options.
+
+    :return:
+    """
+    server = create_server(app, **kwargs)
+    metrics.set_server(server)
+    server.print_listen('Serving on http://{}:{}')
+    server.run()
+    return
+
+
+def listen_socket(listen, backlog):
+    """
+    :param listen: host:port, an IPv6 host is between brackets.
+
+    :param backlog: Length of the queue of connections waiting to be accepted.
+
+    :return: Socket listening on host:port.
+    """
+    host, port = listen.rsplit(':', 1)
+    host = host.strip('[]')
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, int(port)))
+    sock.listen(backlog)
+    return sock
+
+
+def worker(app, sock, settings):
+    """
+    Serve requests on the shared socket, in a forked process.
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    # Connections and threads of the parent process can't be used after the fork.
+    with app.app_context():
+        db.engine.dispose()
+    readonly.dispose(app)
+    warmer.start()
+    serve(app, sockets=[sock], **waitress_options(settings))
+    return
+
+
+def prefork(app, settings):
+    """
+    Open the listening socket and fork the worker processes. A worker that stops is replaced, until the parent process
+    gets SIGTERM or SIGINT. Then the workers are stopped.
+    """
+    sock = listen_socket(settings['listen'], settings['backlog'])
+    # A write in one worker must invalidate the cached pages in all workers.
+    data_version.share()
+    warmer.stop()
+    workers = {}
+    stopping = []
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                worker(app, sock, settings)
+            finally:
+                os._exit(0)
+        workers[pid] = time.time()
+        logging.info("Worker {pid} started".format(pid=pid))
+
+    def terminate(signum, frame):
+        stopping.append(signum)
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGINT, terminate)
+    for _ in range(settings['workers']):
+        spawn()
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = workers.pop(pid, time.time())
+        if not stopping:
+            logging.warning("Worker {pid} stopped with status {s}, starting a new worker".format(pid=pid, s=status))
+            # Don't restart in a tight loop if workers fail at start.
+            if time.time() - started < 1:
+                time.sleep(1)
+            spawn()
+    sock.close()
+    return
+
+
+# Run Application
+if __name__ == "__main__":
+    app = create_app(config_name())
+    prepare(app)
+    if app.debug:
+        # app.run(host="0.0.0.0", port=5012, debug=True)
+        app.run()
+    else:
+        settings = server_settings(app)
+        if settings['workers'] > 1 and hasattr(os, 'fork'):
+            prefork(app, settings)
         else:
-            # app.run(host="0.0.0.0", port=5012, debug=True)
-            app.run()
+            serve(app, listen=settings['listen'], **waitress_options(settings))
@@ -4,11 +4,31 @@ from flask import Flask
 from flask_bootstrap import Bootstrap
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
+from jinja2 import FileSystemBytecodeCache
 from lib import my_env
+from .cache import ReportCache
+from .sqltiming import SqlTiming
+from .sqlitetuning import SqliteTuning
+from .readonly import ReadOnlyDatabase
+from .warmer import ReportWarmer
+from .metrics import Metrics
+from .analytics import AnalyticsEngine
+from .changefeed import ChangeFeed
+from .assets import Assets
+from .compress import CompressMiddleware
 
 bootstrap = Bootstrap()
 db = SQLAlchemy()
+readonly = ReadOnlyDatabase(db)
+analytics = AnalyticsEngine(db, readonly)
 lm = LoginManager()
+cache = ReportCache()
+sql_timing = SqlTiming()
+sqlite_tuning = SqliteTuning()
+warmer = ReportWarmer()
+metrics = Metrics()
+change_feed = ChangeFeed()
+assets = Assets()
 lm.login_view = 'main.login'
 
 
@@ -27,14 +47,33 @@ def create_app(config_name):
     # Configure Logger
     my_env.init_loghandler(__name__, app.config.get('LOGDIR'), app.config.get('LOGLEVEL'))
 
+    # Compiled templates from earlier starts are loaded from the bytecode cache.
+    # Without a directory Jinja uses a private directory of the user in the temp directory.
+    if app.config.get('JINJA_BYTECODE_CACHE'):
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
+
     # initialize extensions
     bootstrap.init_app(app)
     db.init_app(app)
+    readonly.init_app(app)
+    analytics.init_app(app)
     lm.init_app(app)
+    cache.init_app(app)
+    sql_timing.init_app(app)
+    metrics.init_app(app)
+    sqlite_tuning.init_app(app)
+    change_feed.init_app(app)
+    assets.init_app(app)
 
     # import blueprints
     from .main import main as main_blueprint
     app.register_blueprint(main_blueprint)
+    # The warmer renders the report pages, start it when the routes are known.
+    warmer.init_app(app)
+    # Compress the responses, outside of the application so that streamed pages are compressed while they stream.
+    if app.config.get('COMPRESS_LEVEL'):
+        app.wsgi_app = CompressMiddleware(app.wsgi_app, level=app.config['COMPRESS_LEVEL'],
+                                          min_size=app.config.get('COMPRESS_MIN_SIZE', 1024))
     # configure production logging of errors
     """
     try:
@@ -0,0 +1,448 @@
+"""
+This module has the optional analytics engine. The timesheet table is loaded in compact NumPy arrays (project ID, day
+ordinal and hours) with a project attribute table, and the report aggregates are calculated with vectorized grouping
+(numpy.bincount) on project, year, month, billable and holiday instead of SQL. Set ANALYTICS_ENGINE = 'numpy' to use
+it for the reports, NumPy is required then. The default 'sql' uses the database.
+The snapshot is kept current with the deltas of the writes: rollup_apply records the deltas on the session and they
+are added to the arrays when the transaction commits. A change that the snapshot doesn't know, like a write in another
+worker process or a project that is added or edited, is detected with the data version and the snapshot is loaded
+again on the next report.
+"""
+
+import logging
+import threading
+from datetime import date
+from flask import current_app
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event
+from .cache import data_version
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Ordinal of 1970-01-01, day 0 for numpy.datetime64.
+EPOCH = date(1970, 1, 1).toordinal()
+# Rows fetched per batch when the snapshot is loaded.
+LOAD_BATCH = 10000
+
+
+def months(day):
+    """
+    :param day: numpy array with date ordinals.
+
+    :return: numpy int32 array with the months since 1970-01 of the days. Year is month // 12 + 1970, month number is
+    month % 12 + 1.
+    """
+    return (day - EPOCH).astype('datetime64[D]').astype('datetime64[M]').astype(np.int32)
+
+
+class TimesheetColumns:
+    """
+    This class holds the timesheet as arrays, one element per timesheet row or per delta that has been added since
+    the load. The arrays are not changed, extend and compact return a new object.
+    """
+
+    def __init__(self, project_id, day, hours, projects, month=None):
+        """
+        :param project_id: numpy int32 array with the project IDs.
+
+        :param day: numpy int32 array with the date ordinals.
+
+        :param hours: numpy int16 array with the hours.
+
+        :param projects: Dictionary with project ID as key and ProjectRow as value.
+
+        :param month: numpy int32 array with the months of the days, or None to calculate them.
+        """
+        self.project_id = project_id
+        self.day = day
+        self.hours = hours
+        self.projects = projects
+        self.month = months(day) if month is None else month
+        self.year = self.month // 12 + 1970
+        size = max([int(project_id.max()) if len(project_id) else 0] + list(projects)) + 1
+        self.billable = np.zeros(size, dtype=bool)
+        self.holiday = np.zeros(size, dtype=bool)
+        # Project IDs with a row in projects. Time on other IDs is not in the project reports, as the SQL join.
+        self.known = np.zeros(size, dtype=bool)
+        self.size = size
+        # Import here, db_model imports this module.
+        import catw.db_model as dbm
+        for project_id, project in projects.items():
+            self.known[project_id] = True
+            self.billable[project_id] = dbm.is_billable(project.billable)
+            self.holiday[project_id] = dbm.is_holiday(project.name)
+
+    def extend(self, deltas):
+        """
+        :param deltas: List of tuples (project_id, date, delta).
+
+        :return: TimesheetColumns with the deltas added as rows.
+        """
+        day = np.array([delta[1].toordinal() for delta in deltas], dtype=np.int32)
+        return TimesheetColumns(np.concatenate((self.project_id,
+                                                np.array([delta[0] for delta in deltas], dtype=np.int32))),
+                                np.concatenate((self.day, day)),
+                                np.concatenate((self.hours, np.array([delta[2] for delta in deltas], dtype=np.int16))),
+                                self.projects, np.concatenate((self.month, months(day))))
+
+    def compact(self):
+        """
+        :return: TimesheetColumns with one row per project and day, rows with 0 hours are removed.
+        """
+        keys = (self.project_id.astype(np.int64) << 32) | self.day.astype(np.int64)
+        unique, inverse = np.unique(keys, return_inverse=True)
+        hours = np.bincount(inverse, weights=self.hours, minlength=len(unique)).astype(np.int16)
+        keep = hours != 0
+        return TimesheetColumns((unique[keep] >> 32).astype(np.int32), (unique[keep] & 0xffffffff).astype(np.int32),
+                                hours[keep], self.projects)
+
+    def sum_by(self, index, weights=None, mask=None, minlength=0):
+        """
+        Sum the hours per group.
+
+        :param index: numpy array with the non-negative group number of every row.
+
+        :param weights: numpy array to multiply the hours with, for example billable per row, or None.
+
+        :param mask: numpy bool array with the rows to use, or None for all rows.
+
+        :param minlength: Minimum number of groups.
+
+        :return: numpy int64 array with the sum per group number.
+        """
+        hours = self.hours if weights is None else self.hours * weights
+        if mask is not None:
+            index = index[mask]
+            hours = hours[mask]
+        return np.bincount(index, weights=hours, minlength=minlength).astype(np.int64)
+
+
+class TimesheetSnapshot:
+    """
+    This class keeps the TimesheetColumns of an application current. The columns are loaded on the first report and
+    loaded again when the data version shows a change that has not been added as a delta.
+    """
+
+    def __init__(self, readonly):
+        """
+        :param readonly: ReadOnlyDatabase, the snapshot is loaded with its session.
+        """
+        self.readonly = readonly
+        self.lock = threading.Lock()
+        # Only one thread loads the snapshot.
+        self.load_lock = threading.Lock()
+        self.columns = None
+        # Number of rows after the last load or compact.
+        self.compact_rows = 0
+        # Deltas of committed writes, not yet in the columns.
+        self.pending = []
+        # Data version of the columns with the pending deltas, None if a reload is required.
+        self.version = None
+        # Transactions with deltas that are not committed yet.
+        self.writing = 0
+        self.loading = False
+        self.missed = False
+        self.loads = 0
+
+    def record(self, session, deltas):
+        """
+        Remember the deltas of a write on the session, they are added when the transaction commits.
+
+        :param session: Session of the write.
+
+        :param deltas: Iterable of tuples (project_id, date, delta).
+
+        :return:
+        """
+        pending = session.info.get('analytics')
+        if pending is None:
+            with self.lock:
+                self.writing += 1
+            pending = session.info['analytics'] = (self, [])
+        pending[1].extend((int(project_id), dt, int(delta)) for project_id, dt, delta in deltas if delta)
+        return
+
+    def committed(self, deltas):
+        with self.lock:
+            self.writing -= 1
+            if self.loading:
+                # The load may or may not see this write, load again on the next report.
+                self.missed = True
+            elif self.version is not None:
+                self.pending.extend(deltas)
+                # The write bumps the data version after the commit.
+                self.version += 1
+
+    def discarded(self):
+        with self.lock:
+            self.writing -= 1
+
+    def current(self):
+        """
+        :return: TimesheetColumns for the current data version.
+        """
+        with self.load_lock:
+            with self.lock:
+                if self.version is not None and self.version == data_version.value:
+                    if self.pending:
+                        columns = self.columns.extend(self.pending)
+                        # Merge the deltas in the rows when they are more than a tenth of the snapshot.
+                        if len(columns.hours) > self.compact_rows * 1.1:
+                            columns = columns.compact()
+                            self.compact_rows = len(columns.hours)
+                        self.columns = columns
+                        self.pending = []
+                    return self.columns
+            self.load()
+            return self.columns
+
+    def load(self):
+        with self.lock:
+            self.loading = True
+            self.missed = self.writing > 0
+            version = data_version.value
+        try:
+            columns = self.read()
+        finally:
+            with self.lock:
+                self.loading = False
+        with self.lock:
+            self.columns = columns
+            self.compact_rows = len(columns.hours)
+            self.pending = []
+            self.version = None if self.missed else version
+            self.loads += 1
+        logging.debug("Analytics snapshot loaded: {r} rows".format(r=len(columns.hours)))
+        return
+
+    def read(self):
+        """
+        :return: TimesheetColumns with all timesheet rows and projects.
+        """
+        import catw.db_model as dbm
+        session = self.readonly.session
+        projects = dict((row[0], dbm.ProjectRow(*row))
+                        for row in session.execute(dbm.db.select(dbm.PROJECT_ROW_COLUMNS)))
+        table = dbm.Timesheet.__table__
+        result = session.execute(dbm.db.select([table.c.project_id, table.c.datestring, table.c.timestring]))
+        parts = ([], [], [])
+        while True:
+            rows = result.fetchmany(LOAD_BATCH)
+            if not rows:
+                break
+            parts[0].append(np.fromiter((row[0] for row in rows), np.int32, len(rows)))
+            parts[1].append(np.fromiter((row[1].toordinal() for row in rows), np.int32, len(rows)))
+            parts[2].append(np.fromiter((row[2] for row in rows), np.int16, len(rows)))
+        arrays = [np.concatenate(part) if part else np.zeros(0, dtype=dtype)
+                  for part, dtype in zip(parts, (np.int32, np.int32, np.int16))]
+        return TimesheetColumns(arrays[0], arrays[1], arrays[2], projects)
+
+
+def after_commit(session):
+    pending = session.info.pop('analytics', None)
+    if pending is not None:
+        snapshot, deltas = pending
+        snapshot.committed(deltas)
+
+
+def after_transaction_end(session, transaction):
+    if transaction.parent is not None:
+        return
+    pending = session.info.pop('analytics', None)
+    if pending is not None:
+        snapshot, _ = pending
+        snapshot.discarded()
+
+
+class AnalyticsEngine:
+    """
+    Flask extension for the analytics engine. The report functions return the same values as the SQL report functions
+    in db_model.
+    """
+
+    def __init__(self, db, readonly, app=None):
+        """
+        :param db: Flask-SQLAlchemy object of the application, the deltas are recorded on db.session.
+
+        :param readonly: ReadOnlyDatabase to load the snapshot.
+        """
+        self.db = db
+        self.readonly = readonly
+        self.listening = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['analytics'] = TimesheetSnapshot(self.readonly)
+        if app.config.get('ANALYTICS_ENGINE', 'sql') == 'numpy' and np is None:
+            logging.error("ANALYTICS_ENGINE numpy requires NumPy, the reports use SQL")
+        if not self.listening:
+            # The sessions of db.session, the read-only sessions don't write.
+            event.listen(SignallingSession, 'after_commit', after_commit)
+            event.listen(SignallingSession, 'after_transaction_end', after_transaction_end)
+            self.listening = True
+
+    @staticmethod
+    def enabled():
+        """
+        :return: True if the reports of the current application use the analytics engine.
+        """
+        return np is not None and current_app.config.get('ANALYTICS_ENGINE') == 'numpy'
+
+    def record(self, deltas):
+        """
+        Record the deltas of a timesheet write on db.session, for the snapshot of the current application.
+
+        :param deltas: Iterable of tuples (project_id, date, delta).
+
+        :return:
+        """
+        if self.enabled():
+            current_app.extensions['analytics'].record(self.db.session(), deltas)
+        return
+
+    @staticmethod
+    def columns():
+        return current_app.extensions['analytics'].current()
+
+    def status(self):
+        """
+        :return: Dictionary with the engine, the number of snapshot loads and rows, and the data version.
+        """
+        snapshot = current_app.extensions['analytics']
+        columns = snapshot.columns
+        return dict(engine='numpy' if self.enabled() else 'sql', loads=snapshot.loads,
+                    rows=len(columns.hours) if columns is not None else None, version=snapshot.version)
+
+    def overview_all(self):
+        """
+        :return: List of ProjectTotal tuples, as db_model.overview_all_rows.
+        """
+        columns = self.columns()
+        return self.project_totals(columns, columns.sum_by(columns.project_id, minlength=columns.size))
+
+    def overview_all_total_time(self):
+        return int(self.columns().hours.sum())
+
+    def overview_year(self, year):
+        """
+        :param year: The year (string or integer).
+
+        :return: List of ProjectTotal tuples, as db_model.overview_year_rows.
+        """
+        columns = self.columns()
+        totals = columns.sum_by(columns.project_id, mask=columns.year == int(year), minlength=columns.size)
+        return self.project_totals(columns, totals)
+
+    def overview_year_total_time(self, year):
+        columns = self.columns()
+        return int(columns.hours[columns.year == int(year)].sum())
+
+    @staticmethod
+    def project_totals(columns, totals):
+        """
+        :param columns: TimesheetColumns
+
+        :param totals: numpy array with the total time per project ID.
+
+        :return: List of ProjectTotal tuples for the known projects with time, ordered by total time descending.
+        """
+        import catw.db_model as dbm
+        project_ids = np.nonzero((totals > 0) & columns.known)[0]
+        project_ids = project_ids[np.lexsort((project_ids, -totals[project_ids]))]
+        return [dbm.ProjectTotal(columns.projects[project_id], int(totals[project_id]))
+                for project_id in project_ids.tolist()]
+
+    def year_totals(self, columns):
+        """
+        :param columns: TimesheetColumns
+
+        :return: Tuple of lists years, total time, billable time, holiday time and netto time (known projects without
+        holidays) for the years with time, ordered by year descending.
+        """
+        if not len(columns.hours):
+            return [], [], [], [], []
+        first = int(columns.year.min())
+        index = columns.year - first
+        total = columns.sum_by(index)
+        billable = columns.sum_by(index, weights=columns.billable[columns.project_id])
+        holiday = columns.sum_by(index, weights=columns.holiday[columns.project_id])
+        netto = columns.sum_by(index, weights=(columns.known & ~columns.holiday)[columns.project_id])
+        positions = np.nonzero(total > 0)[0][::-1]
+        return ((positions + first).tolist(), total[positions].tolist(), billable[positions].tolist(),
+                holiday[positions].tolist(), netto[positions].tolist())
+
+    def billable_report(self, hpd):
+        """
+        :param hpd: Hours per day, or False if the parameter is not available.
+
+        :return: BillableReport object, as db_model.billable_report.
+        """
+        import catw.db_model as dbm
+        columns = self.columns()
+        years = [dbm.BillableYear(str(year), total, billable, holiday, netto)
+                 for year, total, billable, holiday, netto in zip(*self.year_totals(columns))]
+        # As in the SQL report, hours per day comes with the year rows.
+        return dbm.BillableReport(self.oldest_booking(columns), hpd if years else False, years)
+
+    @staticmethod
+    def oldest_booking(columns):
+        if not len(columns.hours):
+            return None
+        first = int(columns.day.min())
+        # Deltas can't make the time on a day negative, so a day with time has a positive sum.
+        days = np.nonzero(columns.sum_by(columns.day - first) > 0)[0]
+        return date.fromordinal(int(days[0]) + first) if len(days) else None
+
+    def years_available(self):
+        """
+        :return: List of years (string) with time, ordered descending.
+        """
+        return [str(year) for year in self.year_totals(self.columns())[0]]
+
+    def project_month(self, project_id):
+        """
+        :param project_id: Project ID
+
+        :return: List of MonthTotal tuples, as db_model.project_month_rows.
+        """
+        import catw.db_model as dbm
+        columns = self.columns()
+        mask = columns.project_id == int(project_id)
+        if not mask.any():
+            return []
+        first = int(columns.month[mask].min())
+        totals = columns.sum_by(columns.month - first, mask=mask)
+        positions = np.nonzero(totals > 0)[0][::-1]
+        return [dbm.MonthTotal((position + first) // 12 + 1970, (position + first) % 12 + 1, total)
+                for position, total in zip(positions.tolist(), totals[positions].tolist())]
+
+    def project_total(self, project_id):
+        columns = self.columns()
+        return int(columns.hours[columns.project_id == int(project_id)].sum())
+
+    def year_over_year(self):
+        """
+        :return: Tuple (years, rows) as db_model.year_over_year.
+        """
+        import catw.db_model as dbm
+        columns = self.columns()
+        if not len(columns.hours):
+            return [], []
+        first = int(columns.year.min())
+        count = int(columns.year.max()) - first + 1
+        # One group per project and year.
+        totals = columns.sum_by(columns.project_id * count + (columns.year - first), minlength=columns.size * count)
+        totals = totals.reshape(columns.size, count)
+        totals[~columns.known] = 0
+        year_positions = np.nonzero((totals > 0).any(axis=0))[0]
+        totals = totals[:, year_positions]
+        project_totals = totals.sum(axis=1)
+        project_ids = np.nonzero((totals > 0).any(axis=1))[0]
+        project_ids = project_ids[np.lexsort((project_ids, -project_totals[project_ids]))]
+        rows = [dbm.ProjectYears(columns.projects[project_id], totals[project_id].tolist())
+                for project_id in project_ids.tolist()]
+        return (year_positions + first).tolist(), rows
@@ -0,0 +1,187 @@
+"""
+This module has the static asset pipeline. build_assets.py concatenates and minifies the JavaScript and CSS files of
+BUNDLES, and writes every bundle in static/dist with a content hash in the file name, next to a gzip variant. The
+manifest static/dist/manifest.json maps the bundle name on the file name. jQuery is taken from the Flask-Bootstrap
+package, so no file is loaded from the internet.
+Templates get the URLs of a bundle with asset_urls(name): the hashed bundle if it has been built, the source files
+otherwise (development). Hashed files are served with far-future immutable caching, the gzip variant is sent to clients
+that accept gzip. The bundles are minified with rjsmin and rcssmin (python_modules.txt), without them the files are only
+concatenated.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+from flask import current_app, request, send_from_directory, url_for
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+# Bundle name and source files. A source is a file in the static folder, or a tuple (blueprint, file) for a file in
+# the static folder of a blueprint.
+BUNDLES = {
+    'entry.js': [('bootstrap', 'jquery.min.js'), 'mindmup-editable.js', 'numeric-input.js', 'range-input.js'],
+    'style.css': ['style.css']
+}
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def source_path(app, source):
+    """
+    :param app: Application
+
+    :param source: Source from BUNDLES.
+
+    :return: Path of the source file.
+    """
+    if isinstance(source, tuple):
+        blueprint, filename = source
+        return os.path.join(app.blueprints[blueprint].static_folder, filename)
+    return os.path.join(app.static_folder, source)
+
+
+def source_url(source):
+    if isinstance(source, tuple):
+        blueprint, filename = source
+        return url_for(blueprint + '.static', filename=filename)
+    return url_for('static', filename=source)
+
+
+def minify(name, text):
+    """
+    :param name: File name of the source.
+
+    :param text: Content of the source.
+
+    :return: Minified content. Files that are minified already (.min.) and files without the minifier are not changed.
+    """
+    if '.min.' in name:
+        return text
+    if name.endswith('.js'):
+        return rjsmin.jsmin(text) if rjsmin else text
+    return rcssmin.cssmin(text) if rcssmin else text
+
+
+def build(app):
+    """
+    Build the bundles in static/dist and write the manifest. Files of older builds are removed, except the files of the
+    previous manifest, that can still be requested by pages that have been rendered before.
+
+    :param app: Application
+
+    :return: Manifest, dictionary with bundle name and file name.
+    """
+    dist = os.path.join(app.static_folder, DIST)
+    if not os.path.isdir(dist):
+        os.makedirs(dist)
+    previous = read_manifest(app)
+    manifest = {}
+    for name, sources in sorted(BUNDLES.items()):
+        parts = []
+        for source in sources:
+            path = source_path(app, source)
+            with open(path, encoding='utf-8') as fh:
+                parts.append(minify(os.path.basename(path), fh.read()))
+        # A statement can't continue in the next file.
+        content = (';\n' if name.endswith('.js') else '\n').join(parts).encode('utf-8')
+        base, ext = os.path.splitext(name)
+        filename = "{b}.{h}{e}".format(b=base, h=hashlib.sha256(content).hexdigest()[:12], e=ext)
+        with open(os.path.join(dist, filename), 'wb') as fh:
+            fh.write(content)
+        # mtime 0, so that the same content gives the same file.
+        with open(os.path.join(dist, filename + '.gz'), 'wb') as fh:
+            with gzip.GzipFile(filename=filename, mode='wb', compresslevel=9, fileobj=fh, mtime=0) as gz:
+                gz.write(content)
+        manifest[name] = filename
+        logging.info("{n}: {f}, {s} bytes".format(n=name, f=filename, s=len(content)))
+    keep = set(manifest.values()) | set(previous.values())
+    for filename in os.listdir(dist):
+        stem = filename[:-3] if filename.endswith('.gz') else filename
+        if filename != MANIFEST and stem not in keep:
+            os.remove(os.path.join(dist, filename))
+    with open(os.path.join(dist, MANIFEST), 'w') as fh:
+        fh.write(json.dumps(manifest, indent=2, sort_keys=True))
+    app.extensions['assets'] = manifest
+    return manifest
+
+
+def read_manifest(app):
+    """
+    :param app: Application
+
+    :return: Manifest of the last build, empty dictionary if the bundles have not been built.
+    """
+    try:
+        with open(os.path.join(app.static_folder, DIST, MANIFEST)) as fh:
+            return json.load(fh)
+    except (IOError, ValueError):
+        return {}
+
+
+class Assets:
+    """
+    Flask extension for the asset bundles. It adds asset_urls to the templates and serves the static files.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['assets'] = read_manifest(app)
+        app.add_template_global(self.asset_urls, 'asset_urls')
+        app.view_functions['static'] = self.send_static
+        app.after_request(self.cache_headers)
+
+    @staticmethod
+    def asset_urls(name):
+        """
+        :param name: Bundle name from BUNDLES.
+
+        :return: List of URLs to load the bundle.
+        """
+        manifest = current_app.extensions['assets']
+        if name in manifest:
+            return [url_for('static', filename=DIST + '/' + manifest[name])]
+        return [source_url(source) for source in BUNDLES[name]]
+
+    @staticmethod
+    def send_static(filename):
+        """
+        Static file view. For a bundle the gzip variant is sent if the client accepts gzip.
+        """
+        if not filename.startswith(DIST + '/'):
+            return current_app.send_static_file(filename)
+        if request.accept_encodings['gzip'] and \
+                os.path.isfile(os.path.join(current_app.static_folder, filename + '.gz')):
+            response = send_from_directory(current_app.static_folder, filename + '.gz',
+                                           mimetype=mimetypes.guess_type(filename)[0])
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = current_app.send_static_file(filename)
+        response.vary.add('Accept-Encoding')
+        return response
+
+    @staticmethod
+    def cache_headers(response):
+        """
+        Far-future caching for the hashed bundles and for the Flask-Bootstrap files, their URL has the version.
+        """
+        if request.endpoint == 'static':
+            immutable = (request.view_args or {}).get('filename', '').startswith(DIST + '/')
+        else:
+            immutable = request.endpoint == 'bootstrap.static' and 'bootstrap' in request.args
+        if immutable and response.status_code in (200, 304):
+            response.headers['Cache-Control'] = IMMUTABLE
+        return response
@@ -0,0 +1,392 @@
+"""
+This module has the report cache. Rendered report pages and aggregate results are kept in memory, keyed by route and
+arguments. The write functions in db_model bump the data version. Writes of other processes, like import_timesheet.py,
+rollup.py --rebuild or a second server on the same database, are found with the version of the database before every
+request (db_model.data_version_sync). The data version is part of the cache key, so values stored before a write are
+not used anymore and will be removed from the cache as least recently used entries.
+The data version is also used for the ETag and Last-Modified headers of the report pages, so that a conditional GET can
+be answered with 304 Not Modified before the view runs, with the one query for the database version.
+"""
+
+import datetime
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+from flask import request, session, make_response
+from flask_login import current_user
+from functools import wraps
+
+
+class DataVersion:
+    """
+    This class handles the data version counter. The counter is incremented on every write to the timesheet or the
+    projects table. For every project the version and time of the last write for the project is remembered.
+    Changes from before the start of the process are unknown, so the start time is used as the initial modification
+    time and is part of the ETag.
+    The project versions are kept in SLOTS slots, projects with IDs that differ by a multiple of SLOTS share a slot. A
+    write for one of them changes the version of the other ones too, this costs a cache miss, never a stale page.
+    The database version is the version of the last change in the change log and the rollup version. The writes of
+    this process are remembered with observe, sync bumps the data version for the other changes of the database.
+    """
+
+    SLOTS = 1024
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        # Version and time of the last write, version and time of the last write for all projects, and the database
+        # version (change log version and rollup version) that is known, -1 before the first sync.
+        self.state = [0, self.started, 0, self.started, -1, -1]
+        # Version and time of the last write per project slot.
+        self.project_versions = [0] * self.SLOTS
+        self.project_modified = [self.started] * self.SLOTS
+
+    def share(self):
+        """
+        Move the data version to shared memory. Processes that are forked after this call share the data version, so
+        a write in one process invalidates the cached pages and ETags in all processes.
+
+        :return:
+        """
+        self.lock = multiprocessing.Lock()
+        self.state = multiprocessing.Array('d', self.state, lock=False)
+        self.project_versions = multiprocessing.Array('q', self.project_versions, lock=False)
+        self.project_modified = multiprocessing.Array('d', self.project_modified, lock=False)
+        return
+
+    def bump(self, project_ids=None):
+        """
+        Increment the data version.
+
+        :param project_ids: Iterable with the project IDs of the write, or None if the write impacts all projects.
+
+        :return: the new data version.
+        """
+        with self.lock:
+            return self._bump(project_ids)
+
+    def _bump(self, project_ids):
+        version = int(self.state[0]) + 1
+        modified = time.time()
+        self.state[0] = version
+        self.state[1] = modified
+        if project_ids is None:
+            self.state[2] = version
+            self.state[3] = modified
+        else:
+            for project_id in project_ids:
+                slot = int(project_id) % self.SLOTS
+                self.project_versions[slot] = version
+                self.project_modified[slot] = modified
+        return version
+
+    def observe(self, first, last):
+        """
+        Remember the change log versions of a write of this process, the write bumps the data version itself. The known
+        database version only moves on if no other process has written since, else sync handles both writes.
+
+        :param first: Change log version of the first change of the write.
+
+        :param last: Change log version of the last change of the write.
+
+        :return:
+        """
+        with self.lock:
+            if int(self.state[4]) == first - 1:
+                self.state[4] = last
+        return
+
+    def sync(self, database, changed_projects):
+        """
+        Bump the data version if the database version is different from the known database version. The first call
+        only remembers the database version, there is nothing in the cache from before the start.
+
+        :param database: Tuple (change log version, rollup version) of the database.
+
+        :param changed_projects: Function that returns the IDs of the projects that have changed after a change log
+        version, or None if they are not known.
+
+        :return:
+        """
+        known = (int(self.state[4]), int(self.state[5]))
+        if known == database or (database[0] < known[0] and database[1] == known[1]):
+            # Unchanged, or a read replica that has not seen the last write of this process yet.
+            return
+        project_ids = None
+        if known[0] >= 0 and database[1] == known[1]:
+            project_ids = changed_projects(known[0]) or None
+        with self.lock:
+            # Another thread may have done this already.
+            if (int(self.state[4]), int(self.state[5])) == known:
+                self.state[4], self.state[5] = database
+                if known[0] >= 0:
+                    self._bump(project_ids)
+        return
+
+    @property
+    def value(self):
+        return int(self.state[0])
+
+    @property
+    def modified(self):
+        return self.state[1]
+
+    def project(self, project_id):
+        """
+        Get version and modification time for the project.
+
+        :param project_id: Project ID
+
+        :return: Tuple (version, modification time as timestamp) of the last write for the project.
+        """
+        slot = int(project_id) % self.SLOTS
+        version = self.project_versions[slot]
+        if int(self.state[2]) > version:
+            return int(self.state[2]), self.state[3]
+        return version, self.project_modified[slot]
+
+
+class NullCache:
+    """
+    Cache backend that doesn't store anything. Use this to switch off the report cache.
+    """
+
+    def __init__(self, maxsize=None, ttl=None):
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        self.misses += 1
+        return None
+
+    def set(self, key, entry):
+        return
+
+    def clear(self):
+        return
+
+    def __len__(self):
+        return 0
+
+
+class LRUCache:
+    """
+    In-process cache backend. The least recently used entry is removed when the cache has maxsize entries, entries
+    expire ttl seconds after they have been stored.
+    """
+
+    def __init__(self, maxsize=256, ttl=3600):
+        """
+        :param maxsize: Maximum number of entries in the cache.
+
+        :param ttl: Time to live for an entry in seconds.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Get the entry for the key.
+
+        :param key: Cache key
+
+        :return: The entry, or None if the key is not in cache or if the entry has expired.
+        """
+        with self.lock:
+            try:
+                expires, entry = self.entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            if expires < time.time():
+                self.misses += 1
+                return None
+            # Move the entry to the end of the dictionary, this is the most recently used entry now.
+            self.entries[key] = (expires, entry)
+            self.hits += 1
+            return entry
+
+    def set(self, key, entry):
+        """
+        Store the entry for the key.
+
+        :param key: Cache key
+
+        :param entry: Entry to store
+
+        :return:
+        """
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time() + self.ttl, entry)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        return
+
+    def __len__(self):
+        return len(self.entries)
+
+
+backends = {
+    'null': NullCache,
+    'simple': LRUCache
+}
+
+# The data version is shared by all report caches in the process.
+data_version = DataVersion()
+
+
+class ReportCache:
+    """
+    Flask extension for the report cache. The backend is selected with REPORT_CACHE_TYPE (simple or null) and bound by
+    REPORT_CACHE_SIZE entries and REPORT_CACHE_TTL seconds.
+    """
+
+    def __init__(self, app=None):
+        self.backend = NullCache()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = backends[app.config.get('REPORT_CACHE_TYPE', 'simple')]
+        self.backend = backend(maxsize=app.config.get('REPORT_CACHE_SIZE', 256),
+                               ttl=app.config.get('REPORT_CACHE_TTL', 3600))
+        app.extensions['report_cache'] = self
+        app.before_request(self.sync)
+
+    @staticmethod
+    def sync():
+        """
+        Before a request, bump the data version for the writes of other processes. Static files don't need it.
+        """
+        if request.endpoint is None or request.endpoint == 'static' or request.endpoint.endswith('.static'):
+            return
+        # Import here, db_model imports this module.
+        import catw.db_model as dbm
+        dbm.data_version_sync()
+
+    def get(self, version, key):
+        """
+        Get the cached value for the key, if it has been stored for the data version.
+
+        :param version: Data version, read before the value is computed.
+
+        :param key: Cache key
+
+        :return: Tuple (found, value).
+        """
+        entry = self.backend.get((version, key))
+        if entry is None:
+            return False, None
+        return True, entry[0]
+
+    def set(self, version, key, value):
+        """
+        Store the value for the key with the data version. This must be the version from before the value has been
+        computed: if a write commits in the meantime, the value is stored under the old version and is not used.
+
+        :param version: Data version, read before the value is computed.
+
+        :param key: Cache key
+
+        :param value: Value to store
+
+        :return:
+        """
+        self.backend.set((version, key), (value,))
+        return
+
+    def stats(self):
+        """
+        :return: Dictionary with hits, misses and size of the cache.
+        """
+        return dict(hits=self.backend.hits, misses=self.backend.misses, size=len(self.backend))
+
+    def memoize(self, f):
+        """
+        Decorator to cache the result of a function, keyed by function name and arguments. Use this for functions that
+        return plain values, not for functions that return ORM objects.
+        """
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            key = ('func', f.__name__, args, tuple(sorted(kwargs.items())))
+            version = data_version.value
+            found, value = self.get(version, key)
+            if not found:
+                value = f(*args, **kwargs)
+                self.set(version, key, value)
+            return value
+        return decorated
+
+    def cached_view(self, f):
+        """
+        Decorator to cache the rendered page of a view, keyed by endpoint, path and query string. Pages are not cached
+        when there are flashed messages waiting to be shown.
+        """
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if request.method != 'GET' or '_flashes' in session:
+                return f(*args, **kwargs)
+            key = ('view', request.endpoint, request.full_path, current_user.is_authenticated)
+            version = data_version.value
+            found, value = self.get(version, key)
+            if not found:
+                value = f(*args, **kwargs)
+                if isinstance(value, str):
+                    self.set(version, key, value)
+            return value
+        return decorated
+
+
+def conditional_view(project_arg=None):
+    """
+    Decorator to add a strong ETag and a Last-Modified header to the page of a view, and to answer a conditional GET
+    with 304 Not Modified before the view is called. The ETag is derived from the global data version, or from the
+    project version if project_arg is the name of the view argument with the project ID.
+    Pages with flashed messages waiting to be shown are not handled.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if request.method != 'GET' or '_flashes' in session:
+                return f(*args, **kwargs)
+            if project_arg:
+                try:
+                    version, modified = data_version.project(kwargs[project_arg])
+                except ValueError:
+                    return f(*args, **kwargs)
+                scope = 'p'
+            else:
+                version, modified = data_version.value, data_version.modified
+                scope = 'g'
+            # The page depends on the user being logged in or not.
+            user = current_user.get_id() if current_user.is_authenticated else 'anon'
+            etag = "{started:x}-{scope}{version}-{user}".format(started=int(data_version.started), scope=scope,
+                                                               version=version, user=user)
+            last_modified = datetime.datetime.utcfromtimestamp(int(modified))
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains(etag)
+            else:
+                not_modified = request.if_modified_since is not None and last_modified <= request.if_modified_since
+            if not_modified:
+                response = make_response('', 304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.cache_control.no_cache = True
+            return response
+        return decorated
+    return decorator
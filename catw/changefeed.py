@@ -0,0 +1,50 @@
+"""
+This module keeps the change log of the change feed bounded. Every CHANGE_LOG_COMPACT_INTERVAL seconds the change log
+is compacted after a request: rows that have a newer row for the same entry are removed, and rows older than
+CHANGE_LOG_RETENTION_DAYS days. Clients that asked for changes since a version that has been removed get status 410 on
+/api/changes and have to download everything again.
+"""
+
+import logging
+import threading
+import time
+
+
+class ChangeFeed:
+    """
+    Flask extension for the compaction of the change log. Set CHANGE_LOG_COMPACT_INTERVAL to 0 to switch it off.
+    """
+
+    def __init__(self, app=None):
+        self.retention_days = 30
+        self.compact_interval = 0
+        self.last_compact = time.time()
+        self.last_result = None
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.retention_days = app.config.get('CHANGE_LOG_RETENTION_DAYS', 30)
+        self.compact_interval = app.config.get('CHANGE_LOG_COMPACT_INTERVAL', 0)
+        if self.compact_interval:
+            app.after_request(self.compact)
+
+    def compact(self, response):
+        """
+        Compact the change log if the interval has passed. Only one request runs it, other requests don't wait.
+        """
+        if time.time() - self.last_compact < self.compact_interval or not self.lock.acquire(False):
+            return response
+        # Import here, db_model imports the catw package.
+        import catw.db_model as dbm
+        try:
+            self.last_compact = time.time()
+            self.last_result = dbm.changelog_compact(self.retention_days)
+            logging.debug("Change log compacted: {r}".format(r=self.last_result))
+        except Exception as e:
+            dbm.db.session.rollback()
+            logging.warning("Change log compaction failed: {e}".format(e=e))
+        finally:
+            self.lock.release()
+        return response
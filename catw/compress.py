@@ -0,0 +1,196 @@
+"""
+This module has the WSGI middleware that compresses the responses. Responses of MIME_TYPES of at least min_size bytes
+are compressed with gzip or deflate, as accepted by the client in Accept-Encoding. Responses that have a
+Content-Encoding already, like the precompressed asset bundles, are sent as they are.
+Streamed responses are compressed while they are streamed: the size is not known, so the first chunks are read until
+min_size bytes are available, and every chunk is flushed so that the client gets it when it is written.
+The ETag of a compressed response is made weak. If-None-Match tags are compared without the W/ prefix, so that the
+application recognizes the tags it has sent.
+"""
+
+import itertools
+import zlib
+from werkzeug.http import parse_accept_header
+from werkzeug.wsgi import ClosingIterator
+
+# wbits for zlib: with a gzip header, or the zlib format that HTTP calls deflate.
+WBITS = {'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+MIME_TYPES = ('application/javascript', 'application/json', 'application/x-ndjson', 'image/svg+xml', 'text/css',
+              'text/csv', 'text/html', 'text/javascript', 'text/plain')
+
+
+class CompressMiddleware:
+    """
+    WSGI middleware for gzip and deflate compression.
+
+    :param app: WSGI application.
+
+    :param level: zlib compression level, 1 (fast) to 9 (small).
+
+    :param min_size: Minimum response size in bytes to compress.
+
+    :param mime_types: MIME types to compress.
+    """
+
+    def __init__(self, app, level=6, min_size=1024, mime_types=MIME_TYPES):
+        self.app = app
+        self.level = level
+        self.min_size = min_size
+        self.mime_types = frozenset(mime_types)
+
+    def __call__(self, environ, start_response):
+        if 'W/' in environ.get('HTTP_IF_NONE_MATCH', ''):
+            environ['HTTP_IF_NONE_MATCH'] = environ['HTTP_IF_NONE_MATCH'].replace('W/', '')
+        encoding = self.encoding(environ)
+        if encoding is None:
+            return self.app(environ, start_response)
+        response = []
+        # Data written with the write callable comes before the data of the iterable.
+        body = []
+
+        def capture(status, headers, exc_info=None):
+            response[:] = [status, headers, exc_info]
+            return body.append
+
+        app_iter = self.app(environ, capture)
+        close = getattr(app_iter, 'close', None)
+        try:
+            chunks = None
+            done = False
+            # An application can call start_response when the first chunk is asked.
+            if not response:
+                chunks = iter(app_iter)
+                while not response and not done:
+                    done = not self.read(chunks, body)
+            status, headers, exc_info = response
+            length = None
+            for name, value in headers:
+                if name.lower() == 'content-length':
+                    length = int(value)
+            compress = self.compressible(status, headers)
+            if compress and length is None:
+                # Streamed response, read until it is large enough.
+                if chunks is None:
+                    chunks = iter(app_iter)
+                while not done and sum(len(chunk) for chunk in body) < self.min_size:
+                    done = not self.read(chunks, body)
+            if compress:
+                compress = (sum(len(chunk) for chunk in body) if length is None else length) >= self.min_size
+        except Exception:
+            if close is not None:
+                close()
+            raise
+        if not compress and chunks is None and not body:
+            # Not touched, a file wrapper of the server remains in use.
+            start_response(status, headers, exc_info)
+            return app_iter
+        if done:
+            rest = ()
+        elif chunks is None:
+            rest = app_iter
+        else:
+            rest = chunks
+        if not compress:
+            start_response(status, headers, exc_info)
+            return ClosingIterator(itertools.chain(body, rest), close)
+        start_response(status, self.compressed_headers(headers, encoding), exc_info)
+        # A streamed response is flushed per chunk, a response with a length is sent when it is compressed.
+        return ClosingIterator(self.compress(itertools.chain(body, rest), encoding, length is None), close)
+
+    @staticmethod
+    def encoding(environ):
+        """
+        :param environ: WSGI environment.
+
+        :return: gzip or deflate, None if the client doesn't accept them or for a HEAD request.
+        """
+        if environ.get('REQUEST_METHOD') == 'HEAD':
+            return None
+        accept = parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        gzip, deflate = accept['gzip'], accept['deflate']
+        if not (gzip or deflate):
+            return None
+        return 'gzip' if gzip >= deflate else 'deflate'
+
+    def compressible(self, status, headers):
+        """
+        :param status: WSGI status line.
+
+        :param headers: List of response headers.
+
+        :return: True if the response can be compressed: status with a body, MIME type in the list, not encoded
+        already, not a range and no Cache-Control no-transform.
+        """
+        code = int(status.split(None, 1)[0])
+        if code < 200 or code in (204, 206, 304):
+            return False
+        mimetype = None
+        for name, value in headers:
+            name = name.lower()
+            if name in ('content-encoding', 'content-range'):
+                return False
+            if name == 'cache-control' and 'no-transform' in value.lower():
+                return False
+            if name == 'content-type':
+                mimetype = value.split(';', 1)[0].strip().lower()
+        return mimetype in self.mime_types
+
+    @staticmethod
+    def compressed_headers(headers, encoding):
+        """
+        :param headers: List of response headers.
+
+        :param encoding: gzip or deflate.
+
+        :return: Headers for the compressed response: without Content-Length, with Content-Encoding, Vary on
+        Accept-Encoding and a weak ETag.
+        """
+        result = [('Content-Encoding', encoding)]
+        vary = []
+        for name, value in headers:
+            name_lower = name.lower()
+            if name_lower == 'content-length':
+                continue
+            if name_lower == 'vary':
+                vary.extend(item.strip() for item in value.split(',') if item.strip())
+                continue
+            if name_lower == 'etag' and not value.startswith('W/'):
+                value = 'W/' + value
+            result.append((name, value))
+        if 'accept-encoding' not in (item.lower() for item in vary):
+            vary.append('Accept-Encoding')
+        result.append(('Vary', ', '.join(vary)))
+        return result
+
+    @staticmethod
+    def read(chunks, body):
+        """
+        Add the next chunk of the response to body.
+
+        :return: False at the end of the response.
+        """
+        for chunk in chunks:
+            body.append(chunk)
+            return True
+        return False
+
+    def compress(self, chunks, encoding, flush):
+        """
+        :param chunks: Chunks of the response.
+
+        :param encoding: gzip or deflate.
+
+        :param flush: True to flush the compressed data after every chunk.
+
+        :return: Generator with the compressed response.
+        """
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, WBITS[encoding])
+        for chunk in chunks:
+            if not chunk:
+                continue
+            data = compressor.compress(chunk)
+            if flush:
+                data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
@@ -1,9 +1,19 @@
-from . import db, lm
-from datetime import datetime
+from . import db, lm, cache, readonly, analytics
+from .cache import data_version
+from datetime import datetime, timedelta
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
+from collections import namedtuple
+from flask_sqlalchemy import SignallingSession
+from lib import my_env
+from sqlalchemy import event
 from sqlalchemy.orm.exc import NoResultFound
 
+# Project billable value for billable projects
+BILLABLE = 'customer'
+# Project name for the holidays
+HOLIDAYS = 'Not Available'
+
 
 class User(UserMixin, db.Model):
     __tablename__ = "users"
@@ -58,22 +68,32 @@ class Project(db.Model):
 
         :param params:
 
-        :return: True if project has been added, False otherwise
+        :return: Project ID of the new project.
         """
         project_inst = Project(**params)
         db.session.add(project_inst)
+        # Flush to get the project ID for the change log.
+        db.session.flush()
+        changelog_add('project', [(project_inst.project_id, None)])
         db.session.commit()
-        return True
+        data_version.bump([project_inst.project_id])
+        return project_inst.project_id
 
     @staticmethod
     def edit(**params):
         project_obj = db.session.query(Project).filter_by(project_id=params['project_id']).first()
+        old_billable = is_billable(project_obj.billable)
+        old_holiday = is_holiday(project_obj.name)
         project_obj.name = params['name']
         project_obj.wbs = params['wbs']
         project_obj.status = params['status']
         project_obj.info = params['info']
         project_obj.billable = params['billable']
+        rollup_reclassify(project_obj.project_id, old_billable, old_holiday,
+                          is_billable(project_obj.billable), is_holiday(project_obj.name))
+        changelog_add('project', [(project_obj.project_id, None)])
         db.session.commit()
+        data_version.bump([project_obj.project_id])
         return
 
 
@@ -83,6 +103,8 @@ class Timesheet(db.Model):
     datestring = db.Column(db.Date(), primary_key=True)
     timestring = db.Column(db.Integer)
     project = db.relationship('Project', back_populates='cats')
+    # The primary key index starts with project_id, this index is for date range queries over all projects.
+    __table_args__ = (db.Index('ix_timesheet_datestring_project_id', 'datestring', 'project_id'),)
 
     def __repr__(self):
         return "<Time Entry: Project ID {p} - Date {d} - Worked {w}>".format(p=self.project_id,
@@ -101,6 +123,8 @@ class Timesheet(db.Model):
         """
         timesheet_inst = Timesheet(**params)
         db.session.add(timesheet_inst)
+        rollup_apply([(timesheet_inst.project_id, timesheet_inst.datestring, timesheet_inst.timestring)])
+        changelog_add('timesheet', [(timesheet_inst.project_id, timesheet_inst.datestring)])
         db.session.commit()
         return True
 
@@ -114,9 +138,12 @@ class Timesheet(db.Model):
 
         :return: True if timesheet record has been merged, False otherwise
         """
-        timesheet_inst = Timesheet.query.filter_by(datestring=params['datestring'],
-                                                   project_id=params['project_id']).one()
+        timesheet_inst = _write_lock(Timesheet.query.filter_by(datestring=params['datestring'],
+                                                               project_id=params['project_id'])).one()
+        delta = int(params['timestring']) - timesheet_inst.timestring
         timesheet_inst.timestring = params['timestring']
+        rollup_apply([(timesheet_inst.project_id, timesheet_inst.datestring, delta)])
+        changelog_add('timesheet', [(timesheet_inst.project_id, timesheet_inst.datestring)])
         db.session.commit()
         return True
 
@@ -130,12 +157,79 @@ class Timesheet(db.Model):
         :return: True if timesheet record has been deleted, False otherwise
         """
         # timesheet_inst = Timesheet(**params)
-        timesheet_inst = Timesheet.query.filter_by(**params).one()
+        timesheet_inst = _write_lock(Timesheet.query.filter_by(**params)).one()
+        rollup_apply([(timesheet_inst.project_id, timesheet_inst.datestring, -timesheet_inst.timestring)])
+        changelog_add('timesheet', [(timesheet_inst.project_id, timesheet_inst.datestring)])
         db.session.delete(timesheet_inst)
         db.session.commit()
         return True
 
 
+class ProjectMonth(db.Model):
+    """
+    Rollup table with the total time booked per project per month. The table is maintained by rollup_apply in the
+    same transaction as the timesheet change, and can be recalculated with rollup_rebuild.
+    """
+    __tablename__ = "project_month"
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.project_id'), primary_key=True)
+    year = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.Integer, primary_key=True)
+    total_time = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return "<Project Month: Project ID {p} - {y}/{m} - Worked {w}>".format(p=self.project_id, y=self.year,
+                                                                              m=self.month, w=self.total_time)
+
+
+class ProjectYear(db.Model):
+    """
+    Rollup table with the total time booked per project per year.
+    """
+    __tablename__ = "project_year"
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.project_id'), primary_key=True)
+    year = db.Column(db.Integer, primary_key=True, index=True)
+    total_time = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return "<Project Year: Project ID {p} - {y} - Worked {w}>".format(p=self.project_id, y=self.year,
+                                                                         w=self.total_time)
+
+
+class YearTotal(db.Model):
+    """
+    Rollup table with the total time, the billable time and the holiday time per year.
+    """
+    __tablename__ = "year_total"
+    year = db.Column(db.Integer, primary_key=True)
+    total_time = db.Column(db.Integer, nullable=False, default=0)
+    billable_time = db.Column(db.Integer, nullable=False, default=0)
+    holiday_time = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return "<Year Total: {y} - Worked {w}>".format(y=self.year, w=self.total_time)
+
+
+class ChangeLog(db.Model):
+    """
+    Append-only log of the writes, for the change feed. Every write of a timesheet entry or a project adds a row with
+    a new version. The version is never reused (AUTOINCREMENT), so it only increases. changelog_compact removes the
+    rows that have a newer row for the same entry and the rows older than the retention.
+    """
+    __tablename__ = "change_log"
+    version = db.Column(db.Integer, primary_key=True)
+    # timesheet or project
+    kind = db.Column(db.String(16), nullable=False)
+    project_id = db.Column(db.Integer, nullable=False)
+    # Day of the timesheet entry, None for a project.
+    datestring = db.Column(db.Date)
+    changed = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    __table_args__ = (db.Index('ix_change_log_entry', 'kind', 'project_id', 'datestring'),
+                      {'sqlite_autoincrement': True})
+
+    def __repr__(self):
+        return "<Change: {v} {k} {p} {d}>".format(v=self.version, k=self.kind, p=self.project_id, d=self.datestring)
+
+
 class Parameter(db.Model):
     __tablename__ = 'parameters'
     parameter = db.Column(db.String(255), nullable=False, primary_key=True)
@@ -145,6 +239,180 @@ class Parameter(db.Model):
         return "<{key}: {value}>".format(key=self.parameter, value=self.value)
 
 
+# Figures for one year in the billable report. netto_time is the time on the projects in the projects table, without
+# the holidays.
+BillableYear = namedtuple('BillableYear', ['year', 'total_time', 'billable_time', 'holiday_time', 'netto_time'])
+# Rows of the Core report functions (the *_rows functions). They are built from the selected columns only, without the
+# identity map and the relationship state of ORM objects.
+ProjectTotal = namedtuple('ProjectTotal', ['project', 'total_time'])
+MonthTotal = namedtuple('MonthTotal', ['year', 'month', 'total_time'])
+DayTotal = namedtuple('DayTotal', ['ds', 'ts'])
+ProjectYears = namedtuple('ProjectYears', ['project', 'years'])
+# Precomputed time entry grid (PeriodGrid.columns and PeriodGrid.cell_rows), so that the template only writes values.
+GridColumn = namedtuple('GridColumn', ['key', 'label', 'total'])
+GridCell = namedtuple('GridCell', ['dbid', 'hours'])
+GridRow = namedtuple('GridRow', ['project', 'cells', 'total'])
+
+
+class ProjectRow:
+    """
+    This class holds the project attributes that the reports show. It can be used in the templates instead of a
+    Project object.
+    """
+
+    __slots__ = ('project_id', 'wbs', 'name', 'billable', 'status', 'info')
+
+    def __init__(self, project_id, wbs, name, billable, status, info=None):
+        self.project_id = project_id
+        self.wbs = wbs
+        self.name = name
+        self.billable = billable
+        self.status = status
+        self.info = info
+
+    def __repr__(self):
+        return "<Project Row: {name}>".format(name=self.name)
+
+
+# Columns for a ProjectRow, in the order of the ProjectRow arguments.
+PROJECT_ROW_COLUMNS = [Project.project_id, Project.wbs, Project.name, Project.billable, Project.status]
+
+
+class BillableReport:
+    """
+    This class holds all figures for the Overview Billable report, as collected by billable_report.
+    """
+
+    def __init__(self, oldest_booking, hpd, years):
+        """
+        :param oldest_booking: Date of the oldest booking.
+
+        :param hpd: Hours per day, or False if the parameter is not available.
+
+        :param years: List of BillableYear tuples, ordered by year descending.
+        """
+        self.oldest_booking = oldest_booking
+        self.hpd = hpd
+        self.years = years
+        self.total_time = sum(row.total_time for row in years)
+        self.total_billable = sum(row.billable_time for row in years)
+        self.total_holidays = sum(row.holiday_time for row in years)
+
+    @property
+    def billable_per_year(self):
+        """
+        :return: BillableYear tuples for the years with billable time, ordered by year descending.
+        """
+        return [row for row in self.years if row.billable_time > 0]
+
+    @property
+    def time_per_year(self):
+        """
+        :return: Dictionary with year as key and total time as value.
+        """
+        return dict((row.year, row.total_time) for row in self.years)
+
+    @property
+    def time_per_year_eh(self):
+        """
+        :return: Dictionary with year as key and total time excluding holidays as value.
+        """
+        return dict((row.year, row.netto_time) for row in self.years if row.netto_time > 0)
+
+
+class PeriodGrid:
+    """
+    This class holds the booked time for a period of consecutive days. For every project with bookings in the period
+    there is a row with the hours for each day of the period. Row totals (per project), column totals (per day) and
+    the grand total are calculated when the hours are added.
+    """
+
+    def __init__(self, from_date, to_date):
+        """
+        :param from_date: First day of the period (datetime.date).
+
+        :param to_date: Last day (inclusive) of the period (datetime.date).
+        """
+        self.days = [from_date + timedelta(days=cnt) for cnt in range((to_date - from_date).days + 1)]
+        # Datestring %Y-%m-%d for every day, for use in the timesheet dbid.
+        self.day_keys = [day.strftime('%Y-%m-%d') for day in self.days]
+        # Column header for every day.
+        self.day_labels = [day.strftime('%a %d/%m') for day in self.days]
+        self.day_index = dict((day, pos) for pos, day in enumerate(self.days))
+        self.rows = {}
+        self.row_totals = {}
+        self.column_totals = [0] * len(self.days)
+        self.total = 0
+        self.project_ids = set()
+
+    def add(self, project_id, day, hours):
+        """
+        Add booked hours for a project on a day of the period.
+
+        :param project_id: Project ID
+
+        :param day: datetime.date in the period.
+
+        :param hours: Number of hours booked.
+
+        :return:
+        """
+        pos = self.day_index[day]
+        row = self.rows.get(project_id)
+        if row is None:
+            row = self.rows[project_id] = [0] * len(self.days)
+            self.row_totals[project_id] = 0
+            self.project_ids.add(project_id)
+        row[pos] += hours
+        self.row_totals[project_id] += hours
+        self.column_totals[pos] += hours
+        self.total += hours
+        return
+
+    def row(self, project_id):
+        """
+        :param project_id: Project ID
+
+        :return: List with the hours for each day of the period for the project.
+        """
+        return self.rows.get(project_id) or [0] * len(self.days)
+
+    def hours(self, project_id, day):
+        """
+        :param project_id: Project ID
+
+        :param day: datetime.date in the period.
+
+        :return: Hours booked for the project on the day.
+        """
+        return self.row(project_id)[self.day_index[day]]
+
+    def columns(self):
+        """
+        :return: List of GridColumn (key %Y-%m-%d, header label, total hours) for every day of the period.
+        """
+        return [GridColumn(key, label, total) for key, label, total in zip(self.day_keys, self.day_labels,
+                                                                           self.column_totals)]
+
+    def cell_rows(self, projects):
+        """
+        This method will prepare the rows of the time entry grid: for every project the cells with the timesheet dbid
+        (datestring.project_id) and the hours per day, and the project total for the period.
+
+        :param projects: List of projects with attribute project_id, in the order of the rows.
+
+        :return: List of GridRow (project, list of GridCell, total hours).
+        """
+        empty = [0] * len(self.days)
+        rows = []
+        for project in projects:
+            pid = project.project_id
+            suffix = '.{pid}'.format(pid=pid)
+            cells = [GridCell(key + suffix, hours) for key, hours in zip(self.day_keys, self.rows.get(pid, empty))]
+            rows.append(GridRow(project, cells, self.row_totals.get(pid, 0)))
+        return rows
+
+
 @lm.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
@@ -155,24 +423,205 @@ def billable_all_total_time():
     This method will get the total time for the all billable projects.
     :return: Total time  over all billable projects(int).
     """
-    total_time_query = db.func.sum(Timesheet.timestring).label('total_time')
-    total_query = db.session.query(Project, total_time_query).filter_by(billable='customer').join(Project.cats)
-    total_time_value = total_query.one().total_time
-    return int(total_time_value)
+    return billable_report().total_billable
 
 
 def billable_per_year():
     """
     This method will get the total time for the all billable projects grouped per year.
-    :return: SQLAclchemy Query object, allowing to access total time over all billable projects per year ordered by
-    year descending. Query object can be iterated, where each row in iteration has attributes year and billable_time.
+    :return: List of rows with the total time over all billable projects per year ordered by year descending. Each row
+    has attributes year (string) and billable_time.
+    """
+    return billable_report().billable_per_year
+
+
+@cache.memoize
+def billable_report():
+    """
+    This method will collect all figures for the Overview Billable report in one database round trip. The conditional
+    sums for total, billable and holiday time per year are kept in the year_total rollup table, oldest booking and
+    hours per day are added as scalar subqueries. The netto time per year is summed from the project_year rollup table,
+    joined with the projects so that time on a project ID without a project is left out.
+
+    :return: BillableReport object.
+    """
+    if analytics.enabled():
+        return analytics.billable_report(get_param_value())
+    oldest = readonly.session.query(db.func.min(Timesheet.datestring)).as_scalar()
+    hpd = readonly.session.query(Parameter.value).filter(Parameter.parameter == 'hoursPerDay').as_scalar()
+    netto_time = db.func.sum(ProjectYear.total_time).label('netto_time')
+    netto = readonly.session.query(ProjectYear.year, netto_time)\
+        .join(Project, Project.project_id == ProjectYear.project_id).filter(Project.name != HOLIDAYS)\
+        .group_by(ProjectYear.year).subquery()
+    query = readonly.session.query(YearTotal.year, YearTotal.total_time, YearTotal.billable_time,
+                                   YearTotal.holiday_time, db.func.coalesce(netto.c.netto_time, 0).label('netto_time'),
+                                   oldest.label('oldest'), hpd.label('hpd'))\
+        .outerjoin(netto, netto.c.year == YearTotal.year).order_by(YearTotal.year.desc())
+    res = query.all()
+    if res:
+        oldest_booking = res[0].oldest
+        hpd_value = int(res[0].hpd) if res[0].hpd is not None else False
+    else:
+        oldest_booking = None
+        hpd_value = False
+    years = [BillableYear(str(rec.year), rec.total_time, rec.billable_time, rec.holiday_time, int(rec.netto_time))
+             for rec in res]
+    return BillableReport(oldest_booking, hpd_value, years)
+
+
+def changelog_add(kind, keys):
+    """
+    This method will add rows to the change log. The session is not committed, so the change log is written in the
+    same transaction as the change. The versions of the rows are remembered on the session, when the transaction
+    commits they are given to data_version.observe, so that data_version_sync doesn't see this write as a write of
+    another process.
+
+    :param kind: timesheet or project
+
+    :param keys: Iterable of tuples (project_id, date), date is None for a project.
+
+    :return: (nothing)
+    """
+    changed = datetime.utcnow()
+    rows = [dict(kind=kind, project_id=int(project_id), datestring=dt, changed=changed) for project_id, dt in keys]
+    if rows:
+        db.session.execute(ChangeLog.__table__.insert(), rows)
+        # The transaction holds the write lock, the rows have the last versions.
+        last = db.session.query(db.func.max(ChangeLog.version)).scalar()
+        db.session.info.setdefault('change_log', []).append((last - len(rows) + 1, last))
+    return
+
+
+def _changelog_committed(session):
+    for first, last in session.info.pop('change_log', []):
+        data_version.observe(first, last)
+
+
+def _changelog_transaction_end(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('change_log', None)
+
+
+event.listen(SignallingSession, 'after_commit', _changelog_committed)
+event.listen(SignallingSession, 'after_transaction_end', _changelog_transaction_end)
+
+
+def changelog_compact(retention_days):
+    """
+    This method will keep the change log bounded. Rows that have a newer row for the same timesheet entry or project
+    are removed, the change feed only returns the latest version of an entry anyway. Rows older than the retention are
+    removed as well, the highest version removed is remembered as the horizon in parameter changeLogHorizon. A client
+    that asks for the changes since a version before the horizon has to download everything again.
+
+    :param retention_days: Number of days to keep a change.
+
+    :return: Dictionary with the number of superseded and expired rows removed and the horizon.
+    """
+    table = ChangeLog.__table__
+    latest = db.select([db.func.max(table.c.version).label('version')])\
+        .group_by(table.c.kind, table.c.project_id, table.c.datestring).alias('latest')
+    # The derived table is required for MySQL, it can't select from the table of the delete in a subquery.
+    superseded = db.session.execute(table.delete().where(~table.c.version.in_(db.select([latest.c.version]))))
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    expired_version = db.session.query(db.func.max(ChangeLog.version)).filter(ChangeLog.changed < cutoff).scalar()
+    horizon = changelog_horizon()
+    expired = 0
+    if expired_version is not None:
+        expired = db.session.execute(table.delete().where(table.c.version <= expired_version)).rowcount
+        if expired_version > horizon:
+            horizon = expired_version
+            db.session.merge(Parameter(parameter='changeLogHorizon', value=str(horizon)))
+    db.session.commit()
+    return dict(superseded=superseded.rowcount, expired=expired, horizon=horizon)
+
+
+def changelog_horizon():
+    """
+    :return: Highest version that has been removed from the change log because of the retention, 0 if none.
+    """
+    value = db.session.query(Parameter.value).filter(Parameter.parameter == 'changeLogHorizon').scalar()
+    return int(value) if value else 0
+
+
+def changes_since(since, limit=500):
+    """
+    This method will return the changes after a version, compacted: a timesheet entry or project that has been written
+    more than once is returned once, with its current value and the version of its last write. The changes are ordered
+    by this version, so the version of the last change can be used as since for the next batch.
+
+    :param since: Version of the last change that the client has.
+
+    :param limit: Maximum number of changes to return.
+
+    :return: Tuple (changes, more). Changes is a list of dictionaries with version, type (timesheet or project) and
+    project_id. A timesheet change has date (%Y-%m-%d) and hours (0 if the entry has been removed), a project change
+    has name, wbs, status and billable (None if the project has been removed). More is True if there are more changes.
     """
-    year_time = db.func.strftime('%Y', Timesheet.datestring).label('year')
-    total_time_query = db.func.sum(Timesheet.timestring).label('billable_time')
-    total_query = db.session.query(Project, total_time_query, year_time).filter_by(billable='customer')\
-        .join(Project.cats)
-    total_per_year = total_query.group_by(year_time).order_by(year_time.desc())
-    return total_per_year
+    version = db.func.max(ChangeLog.version).label('version')
+    query = readonly.session.query(version, ChangeLog.kind, ChangeLog.project_id, ChangeLog.datestring)\
+        .filter(ChangeLog.version > since)\
+        .group_by(ChangeLog.kind, ChangeLog.project_id, ChangeLog.datestring).order_by(version).limit(limit + 1)
+    rows = query.all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    entries = [row for row in rows if row.kind == 'timesheet']
+    hours = {}
+    if entries:
+        timesheet_query = readonly.session.query(Timesheet.project_id, Timesheet.datestring, Timesheet.timestring)\
+            .filter(Timesheet.project_id.in_(set(row.project_id for row in entries)))\
+            .filter(Timesheet.datestring >= min(row.datestring for row in entries))\
+            .filter(Timesheet.datestring <= max(row.datestring for row in entries))
+        hours = dict(((rec.project_id, rec.datestring), rec.timestring) for rec in timesheet_query)
+    project_ids = set(row.project_id for row in rows if row.kind == 'project')
+    projects = {}
+    if project_ids:
+        project_query = db.select(PROJECT_ROW_COLUMNS).where(Project.project_id.in_(project_ids))
+        projects = dict((row[0], ProjectRow(*row)) for row in readonly.session.execute(project_query))
+    changes = []
+    for row in rows:
+        change = dict(version=row.version, type=row.kind, project_id=row.project_id)
+        if row.kind == 'timesheet':
+            change['date'] = row.datestring.strftime('%Y-%m-%d')
+            change['hours'] = hours.get((row.project_id, row.datestring), 0)
+        else:
+            project_row = projects.get(row.project_id)
+            for attribute in ('name', 'wbs', 'status', 'billable'):
+                change[attribute] = getattr(project_row, attribute) if project_row else None
+        changes.append(change)
+    return changes, more
+
+
+def data_version_sync():
+    """
+    This method will bump the data version for the writes of other processes on the database: import_timesheet.py,
+    rollup.py --rebuild or a second server. The database version is the version of the last change in the change log
+    (or the horizon, if the change log has been emptied by the retention) and the rollupVersion parameter, they are
+    read in one query. The projects of the changes since the last known version get a new project version.
+
+    :return: (nothing)
+    """
+    horizon = readonly.session.query(Parameter.value).filter(Parameter.parameter == 'changeLogHorizon').as_scalar()
+    rollup = readonly.session.query(Parameter.value).filter(Parameter.parameter == 'rollupVersion').as_scalar()
+    res = readonly.session.query(db.func.max(ChangeLog.version).label('version'), horizon.label('horizon'),
+                                 rollup.label('rollup')).one()
+    horizon_version = int(res.horizon or 0)
+
+    def changed_projects(since):
+        if horizon_version > since:
+            # Changes have been removed from the change log.
+            return None
+        query = readonly.session.query(ChangeLog.project_id).filter(ChangeLog.version > since).distinct()
+        return set(row.project_id for row in query)
+
+    data_version.sync((max(res.version or 0, horizon_version), int(res.rollup or 0)), changed_projects)
+    return
+
+
+def changes_version():
+    """
+    :return: Version of the last change in the change log, 0 if the log is empty.
+    """
+    return readonly.session.query(db.func.max(ChangeLog.version)).scalar() or 0
 
 
 def get_oldest_booking():
@@ -180,10 +629,11 @@ def get_oldest_booking():
     This function will return the date of the oldest booking.
     :return:
     """
-    query = db.session.query(db.func.min(Timesheet.datestring).label('oldest')).one()
+    query = readonly.session.query(db.func.min(Timesheet.datestring).label('oldest')).one()
     return query.oldest
 
 
+@cache.memoize
 def get_param_value(parameter='hoursPerDay', to_int=True):
     """
     This method returns the value for the required parameter.
@@ -195,7 +645,7 @@ def get_param_value(parameter='hoursPerDay', to_int=True):
     :return: Value for the parameter, or False if no value is found for the parameter.
     """
     try:
-        value = Parameter.query.filter_by(parameter=parameter).one().value
+        value = readonly.session.query(Parameter).filter_by(parameter=parameter).one().value
         if to_int:
             value = int(value)
     except NoResultFound:
@@ -208,10 +658,29 @@ def holidays_all_total_time():
     This method will get the total time for the holidays.
     :return: Total time  of holidays.
     """
-    total_time_query = db.func.sum(Timesheet.timestring).label('total_time')
-    total_query = db.session.query(Project, total_time_query).filter_by(name='Not Available').join(Project.cats)
-    total_time_value = total_query.one().total_time
-    return int(total_time_value)
+    return billable_report().total_holidays
+
+
+def is_billable(billable):
+    """
+    This method checks if the billable attribute of a project is for a billable project.
+
+    :param billable: Value of the Project billable attribute.
+
+    :return: True if the project is billable, False otherwise.
+    """
+    return billable == BILLABLE
+
+
+def is_holiday(name):
+    """
+    This method checks if the name of a project is the holidays project.
+
+    :param name: Value of the Project name attribute.
+
+    :return: True if this is the holidays project, False otherwise.
+    """
+    return name == HOLIDAYS
 
 
 def overview_all():
@@ -220,12 +689,29 @@ def overview_all():
 
     :return: List of rows with tuples. Tuple content is Project object and attribute total_time.
     """
-    total_time = db.func.sum(Timesheet.timestring).label('total_time')
-    project_list = db.session.query(Project, total_time).join(Project.cats).group_by(Project.name)
+    total_time = db.func.sum(ProjectYear.total_time).label('total_time')
+    project_list = readonly.session.query(Project, total_time)\
+        .join(ProjectYear, ProjectYear.project_id == Project.project_id).group_by(Project.project_id)
     ordered_list = project_list.order_by(total_time.desc())
     return ordered_list.all()
 
 
+def overview_all_rows():
+    """
+    Core variant of overview_all, grouped by project ID.
+
+    :return: List of ProjectTotal tuples with a ProjectRow and total_time, ordered by total time descending.
+    """
+    if analytics.enabled():
+        return analytics.overview_all()
+    total_time = db.func.sum(ProjectYear.total_time).label('total_time')
+    query = db.select(PROJECT_ROW_COLUMNS + [total_time])\
+        .select_from(Project.__table__.join(ProjectYear.__table__))\
+        .group_by(Project.project_id).order_by(total_time.desc())
+    return _project_totals(query)
+
+
+@cache.memoize
 def overview_all_total_time():
     """
     This method will get the total time for the overview of all projects and the total amount of hours worked on the
@@ -233,9 +719,11 @@ def overview_all_total_time():
 
     :return: Total time (int).
     """
-    total_time_query = db.func.sum(Timesheet.timestring).label('total_time')
-    total_time_value = db.session.query(total_time_query).one().total_time
-    return int(total_time_value)
+    if analytics.enabled():
+        return analytics.overview_all_total_time()
+    total_time_query = db.func.sum(YearTotal.total_time).label('total_time')
+    total_time_value = readonly.session.query(total_time_query).one().total_time
+    return int(total_time_value or 0)
 
 
 def overview_year(year):
@@ -247,15 +735,30 @@ def overview_year(year):
 
     :return: List of rows with tuples. Tuple content is Project object and attribute total_time.
     """
-    total_time = db.func.sum(Timesheet.timestring).label('total_time')
-    year_time = db.func.strftime('%Y', Timesheet.datestring).label('year')
-    project_list = db.session.query(Project, total_time).join(Project.cats)
-    project_group = project_list.filter(year_time == year).group_by(Project.name)
-    ordered_list = project_group.order_by(total_time.desc())
-    # print("Query: {q}".format(q=str(ordered_list)))
+    total_time = ProjectYear.total_time.label('total_time')
+    project_list = readonly.session.query(Project, total_time)\
+        .join(ProjectYear, ProjectYear.project_id == Project.project_id)
+    ordered_list = project_list.filter(ProjectYear.year == int(year)).order_by(total_time.desc())
     return ordered_list.all()
 
 
+def overview_year_rows(year):
+    """
+    Core variant of overview_year.
+
+    :param year: The year for which the overview is required (needs to be a string!)
+
+    :return: List of ProjectTotal tuples with a ProjectRow and total_time, ordered by total time descending.
+    """
+    if analytics.enabled():
+        return analytics.overview_year(year)
+    query = db.select(PROJECT_ROW_COLUMNS + [ProjectYear.total_time])\
+        .select_from(Project.__table__.join(ProjectYear.__table__))\
+        .where(ProjectYear.year == int(year)).order_by(ProjectYear.total_time.desc())
+    return _project_totals(query)
+
+
+@cache.memoize
 def overview_year_total_time(year):
     """
     This method will get the total time over a specific year.
@@ -264,10 +767,11 @@ def overview_year_total_time(year):
 
     :return: Total time (int).
     """
-    total_time_query = db.func.sum(Timesheet.timestring).label('total_time')
-    year_time = db.func.strftime('%Y', Timesheet.datestring)
-    total_time_value = db.session.query(total_time_query).filter(year_time == year).one().total_time
-    return int(total_time_value)
+    if analytics.enabled():
+        return analytics.overview_year_total_time(year)
+    total_time_query = db.func.sum(YearTotal.total_time).label('total_time')
+    total_time_value = readonly.session.query(total_time_query).filter(YearTotal.year == int(year)).one().total_time
+    return int(total_time_value or 0)
 
 
 def project(project_id):
@@ -288,25 +792,76 @@ def projects_all():
 
     :return: List containing all Project objects, sorted by status, billable and name.
     """
-    projects = Project.query.order_by(Project.status.desc(), Project.billable, Project.name)
+    projects = readonly.session.query(Project).order_by(Project.status.desc(), Project.billable, Project.name)
     return projects.all()
 
 
-def project_day(project_id):
+def projects_all_rows():
+    """
+    Core variant of projects_all.
+
+    :return: List of ProjectRow objects, sorted by status, billable and name.
+    """
+    query = db.select(PROJECT_ROW_COLUMNS).order_by(Project.status.desc(), Project.billable, Project.name)
+    return [ProjectRow(*row) for row in readonly.session.execute(query)]
+
+
+def project_day(project_id, after=None, before=None, limit=None):
     """
-    This method will return the time worked on the project per day.
+    This method will return the time worked on the project per day, ordered by day. Use after or before with limit to
+    get a page of days (keyset pagination on the primary key of the timesheet table).
 
     :param project_id: Project ID for which total time is required
 
-    :return: List of tuples containing Project object, ds representing day as datestring and ts as timestring.
+    :param after: Only return days after this date (datetime.date).
+
+    :param before: Only return the days before this date (datetime.date). The last limit days before the date are
+    returned.
+
+    :param limit: Maximum number of days to return, or None for all days.
+
+    :return: List of tuples containing ds representing day as datestring and ts as timestring.
     """
-    total_time_query = db.func.sum(Timesheet.timestring).label('total_time')
-    year_time = db.func.strftime('%Y', Timesheet.datestring).label('year')
-    month_time = db.func.strftime('%M', Timesheet.datestring).label('month')
-    query = db.session.query(Project, Timesheet.datestring.label('ds'), Timesheet.timestring.label('ts'))\
-        .filter_by(project_id=project_id).join(Project.cats)
-    sorted_query = query.order_by(Timesheet.datestring.asc())
-    return sorted_query.all()
+    query = readonly.session.query(Timesheet.datestring.label('ds'), Timesheet.timestring.label('ts'))\
+        .filter(Timesheet.project_id == project_id)
+    if before is not None:
+        query = query.filter(Timesheet.datestring < before).order_by(Timesheet.datestring.desc()).limit(limit)
+        return list(reversed(query.all()))
+    if after is not None:
+        query = query.filter(Timesheet.datestring > after)
+    return query.order_by(Timesheet.datestring.asc()).limit(limit).all()
+
+
+def project_day_rows(project_id, after=None, before=None, limit=None):
+    """
+    Core variant of project_day, the arguments are the same.
+
+    :return: List of DayTotal tuples (ds, ts) ordered by day.
+    """
+    query = db.select([Timesheet.datestring, Timesheet.timestring]).where(Timesheet.project_id == project_id)
+    if before is not None:
+        query = query.where(Timesheet.datestring < before).order_by(Timesheet.datestring.desc()).limit(limit)
+        return [DayTotal(*row) for row in reversed(readonly.session.execute(query).fetchall())]
+    if after is not None:
+        query = query.where(Timesheet.datestring > after)
+    query = query.order_by(Timesheet.datestring.asc()).limit(limit)
+    return [DayTotal(*row) for row in readonly.session.execute(query)]
+
+
+def project_day_stream(project_id, batch=500):
+    """
+    This method will return the time worked on the project per day as an iterator. Rows are fetched from the database
+    in batches, so the full list is never in memory.
+
+    :param project_id: Project ID for which total time is required
+
+    :param batch: Number of rows to fetch per batch.
+
+    :return: Iterator over tuples containing ds representing day as datestring and ts as timestring.
+    """
+    query = readonly.session.query(Timesheet.datestring.label('ds'), Timesheet.timestring.label('ts'))\
+        .filter(Timesheet.project_id == project_id).order_by(Timesheet.datestring.asc())
+    return query.yield_per(batch)
 
 
 def project_month(project_id):
@@ -315,18 +870,33 @@ def project_month(project_id):
 
     :param project_id: Project ID for which total time is required
 
-    :return: List of tuples containing Project object, year as string, month number as string and total_time as string
-    ordered by year, month descending.
+    :return: List of tuples containing Project object, year, month number and total_time ordered by year, month
+    descending.
     """
-    total_time_query = db.func.sum(Timesheet.timestring).label('total_time')
-    year_time = db.func.strftime('%Y', Timesheet.datestring).label('year')
-    month_time = db.func.strftime('%m', Timesheet.datestring).label('month')
-    query = db.session.query(Project, year_time, month_time, total_time_query)\
-        .filter_by(project_id=project_id).join(Project.cats).group_by(year_time, month_time)
-    sorted_query = query.order_by(Timesheet.datestring.desc())
+    query = readonly.session.query(Project, ProjectMonth.year, ProjectMonth.month, ProjectMonth.total_time)\
+        .join(ProjectMonth, ProjectMonth.project_id == Project.project_id).filter(Project.project_id == project_id)
+    sorted_query = query.order_by(ProjectMonth.year.desc(), ProjectMonth.month.desc())
     return sorted_query.all()
 
 
+def project_month_rows(project_id):
+    """
+    Core variant of project_month, without the project. The month rollup table has the project ID, so the projects
+    table is not joined.
+
+    :param project_id: Project ID for which total time is required
+
+    :return: List of MonthTotal tuples (year, month, total_time) ordered by year, month descending.
+    """
+    if analytics.enabled():
+        return analytics.project_month(project_id)
+    query = db.select([ProjectMonth.year, ProjectMonth.month, ProjectMonth.total_time])\
+        .where(ProjectMonth.project_id == project_id)\
+        .order_by(ProjectMonth.year.desc(), ProjectMonth.month.desc())
+    return [MonthTotal(*row) for row in readonly.session.execute(query)]
+
+
+@cache.memoize
 def project_total(project_id):
     """
     This method will return the total time worked on the project.
@@ -335,10 +905,12 @@ def project_total(project_id):
 
     :return: Total time worked on the project (integer).
     """
-    total_time_query = db.func.sum(Timesheet.timestring).label('total_time')
-    query = db.session.query(Project, total_time_query).filter_by(project_id=project_id).join(Project.cats)
+    if analytics.enabled():
+        return analytics.project_total(project_id)
+    total_time_query = db.func.sum(ProjectYear.total_time).label('total_time')
+    query = readonly.session.query(total_time_query).filter(ProjectYear.project_id == project_id)
     res = query.one()
-    return int(res.total_time)
+    return int(res.total_time or 0)
 
 
 def openprojectlist():
@@ -347,10 +919,20 @@ def openprojectlist():
 
     :return: project objects for the open projects.
     """
-    project_query = db.session.query(Project).filter_by(status='open').order_by(Project.name)
+    project_query = readonly.session.query(Project).filter_by(status='open').order_by(Project.name)
     return project_query.all()
 
 
+def openprojectlist_rows():
+    """
+    Core variant of openprojectlist. The rows have the project info, for the time entry pages.
+
+    :return: List of ProjectRow objects for the open projects, sorted by name.
+    """
+    query = db.select(PROJECT_ROW_COLUMNS + [Project.info]).where(Project.status == 'open').order_by(Project.name)
+    return [ProjectRow(*row) for row in readonly.session.execute(query)]
+
+
 def projectlist(pid_array):
     """
     This method will return the projects for which the project id is in array.
@@ -359,30 +941,344 @@ def projectlist(pid_array):
 
     :return: project records for the projects.
     """
-    project_query = db.session.query(Project).filter(Project.project_id.in_(pid_array)).order_by(Project.name)
+    project_query = readonly.session.query(Project).filter(Project.project_id.in_(pid_array)).order_by(Project.name)
     return project_query.all()
 
 
+def projectlist_rows(pid_array):
+    """
+    Core variant of projectlist.
+
+    :param pid_array: Array of project IDs
+
+    :return: List of ProjectRow objects for the projects, sorted by name.
+    """
+    if not pid_array:
+        return []
+    query = db.select(PROJECT_ROW_COLUMNS).where(Project.project_id.in_(pid_array)).order_by(Project.name)
+    return [ProjectRow(*row) for row in readonly.session.execute(query)]
+
+
 def project_time(from_date, to_date):
     """
-    This method will return a dictionary documenting the booked time for a project on a specific date. Dictionary key
-    is Datestring and Project_id, Value is the time booked.
+    This method will return the booked time per project and per day for a period.
 
     :param from_date: First day of the interval as datetime
 
     :param to_date: Last day (inclusive) of the interval (datetime).
 
-    :return: Dictionary, key Date and Project (YYYY.MM.DD.Project_id), value is booked time
+    :return: PeriodGrid with the booked time.
+    """
+    if isinstance(from_date, datetime):
+        from_date = from_date.date()
+    if isinstance(to_date, datetime):
+        to_date = to_date.date()
+    timesheet_query = readonly.session.query(Timesheet.project_id, Timesheet.datestring, Timesheet.timestring)\
+        .filter(Timesheet.datestring >= from_date).filter(Timesheet.datestring <= to_date)
+    grid = PeriodGrid(from_date, to_date)
+    for project_id, datestring, timestring in timesheet_query:
+        grid.add(project_id, datestring, timestring)
+    return grid
+
+
+def _project_totals(query):
+    """
+    This method will run a Core query with the PROJECT_ROW_COLUMNS and a total time.
+
+    :param query: Select statement.
+
+    :return: List of ProjectTotal tuples.
+    """
+    return [ProjectTotal(ProjectRow(*row[:-1]), row[-1]) for row in readonly.session.execute(query)]
+
+
+def _rollup_add(model, keys, **deltas):
+    """
+    This method will add the deltas to the rollup record identified by keys. The record is created if it doesn't exist
+    and removed if no time remains booked on it.
+
+    :param model: Rollup model class (ProjectMonth, ProjectYear or YearTotal).
+
+    :param keys: Dictionary with primary key column names and values.
+
+    :param deltas: Column names and the value to add to the column.
+
+    :return: (nothing)
+    """
+    table = model.__table__
+    where = db.and_(*[table.c[col] == value for col, value in keys.items()])
+    values = dict((table.c[col], table.c[col] + delta) for col, delta in deltas.items())
+    res = db.session.execute(table.update().where(where).values(values))
+    if res.rowcount == 0:
+        params = dict(keys)
+        params.update(deltas)
+        db.session.execute(table.insert().values(**params))
+    if deltas.get('total_time', 0) < 0:
+        db.session.execute(table.delete().where(where).where(table.c.total_time <= 0))
+    return
+
+
+def _rollup_add_many(model, key_names, delta_names, rows):
+    """
+    This method will add the deltas to many rollup records, see _rollup_add. The existing records are collected in one
+    query, then updates, inserts and removals are each executed as one executemany. A few rows are handled with
+    _rollup_add, as the extra query doesn't pay off for them.
+
+    :param model: Rollup model class (ProjectMonth, ProjectYear or YearTotal).
+
+    :param key_names: Tuple with the primary key column names.
+
+    :param delta_names: Tuple with the names of the columns to add to.
+
+    :param rows: List of tuples (key values, delta values), with the values in the order of key_names and delta_names.
+
+    :return: (nothing)
+    """
+    if len(rows) <= 3:
+        for keys, deltas in rows:
+            _rollup_add(model, dict(zip(key_names, keys)), **dict(zip(delta_names, deltas)))
+        return
+    table = model.__table__
+    query = db.session.query(*[table.c[col] for col in key_names])
+    for pos, col in enumerate(key_names):
+        if col in ('project_id', 'year'):
+            query = query.filter(table.c[col].in_(set(keys[pos] for keys, _ in rows)))
+    existing = set(tuple(rec) for rec in query)
+    # Bind parameter names must differ from the column names for the where clause of an executemany update.
+    where = db.and_(*[table.c[col] == db.bindparam('b_' + col) for col in key_names])
+    updates = []
+    inserts = []
+    removes = []
+    for keys, deltas in rows:
+        params = dict(zip(['b_' + col for col in key_names], keys))
+        if keys in existing:
+            params.update(zip(['d_' + col for col in delta_names], deltas))
+            updates.append(params)
+        else:
+            inserts.append(dict(zip(key_names + delta_names, keys + deltas)))
+        if deltas[0] < 0:
+            removes.append(dict(zip(['b_' + col for col in key_names], keys)))
+    if updates:
+        values = dict((table.c[col], table.c[col] + db.bindparam('d_' + col)) for col in delta_names)
+        db.session.execute(table.update().where(where).values(values), updates)
+    if inserts:
+        db.session.execute(table.insert(), inserts)
+    if removes:
+        db.session.execute(table.delete().where(where).where(table.c.total_time <= 0), removes)
+    return
+
+
+def _rollup_expected(year=None):
+    """
+    This method will calculate the rollup table contents from scratch, using one aggregation over the timesheet table.
+
+    :param year: Year to calculate, or None for all years. A year only reads the timesheet rows for this year.
+
+    :return: Tuple of 3 dictionaries: key (project_id, year, month) with total time, key (project_id, year) with total
+    time and key year with list [total time, billable time, holiday time].
+    """
+    year_time = db.extract('year', Timesheet.datestring)
+    month_time = db.extract('month', Timesheet.datestring)
+    query = db.session.query(Timesheet.project_id, year_time.label('year'), month_time.label('month'),
+                             db.func.sum(Timesheet.timestring).label('total_time'))
+    if year is not None:
+        start, end = my_env.year_range(year)
+        query = query.filter(Timesheet.datestring >= start).filter(Timesheet.datestring < end)
+    query = query.group_by(Timesheet.project_id, year_time, month_time)
+    project_class = _project_class()
+    project_month_dict = {}
+    project_year_dict = {}
+    year_total_dict = {}
+    for rec in query:
+        if not rec.total_time:
+            continue
+        year = int(rec.year)
+        project_month_dict[(rec.project_id, year, int(rec.month))] = rec.total_time
+        project_year_dict[(rec.project_id, year)] = project_year_dict.get((rec.project_id, year), 0) + rec.total_time
+        billable, holiday = project_class.get(rec.project_id, (False, False))
+        totals = year_total_dict.setdefault(year, [0, 0, 0])
+        totals[0] += rec.total_time
+        totals[1] += rec.total_time if billable else 0
+        totals[2] += rec.total_time if holiday else 0
+    return project_month_dict, project_year_dict, year_total_dict
+
+
+def _project_class(pids=None):
+    """
+    This method will return billable and holiday classification for projects.
+
+    :param pids: Iterable with project IDs, or None for all projects.
+
+    :return: Dictionary with project_id as key and tuple (billable, holiday) as value.
+    """
+    query = db.session.query(Project.project_id, Project.billable, Project.name)
+    if pids is not None:
+        query = query.filter(Project.project_id.in_(list(pids)))
+    return dict((rec.project_id, (is_billable(rec.billable), is_holiday(rec.name))) for rec in query)
+
+
+def rollup_apply(deltas):
+    """
+    This method will add changes in booked time to the rollup tables. The session is not committed, so the rollup
+    tables are updated in the same transaction as the timesheet change.
+
+    :param deltas: Iterable of tuples (project_id, date, delta) where delta is the change in booked time.
+
+    :return: (nothing)
+    """
+    analytics.record(deltas)
+    month_delta = {}
+    for project_id, dt, delta in deltas:
+        if delta:
+            key = (int(project_id), dt.year, dt.month)
+            month_delta[key] = month_delta.get(key, 0) + int(delta)
+    month_delta = sorted((key, delta) for key, delta in month_delta.items() if delta)
+    if not month_delta:
+        return
+    _rollup_add_many(ProjectMonth, ('project_id', 'year', 'month'), ('total_time',),
+                     [(key, (delta,)) for key, delta in month_delta])
+    year_delta = {}
+    for (project_id, year, month), delta in month_delta:
+        year_delta[(project_id, year)] = year_delta.get((project_id, year), 0) + delta
+    year_delta = sorted((key, delta) for key, delta in year_delta.items() if delta)
+    if not year_delta:
+        return
+    _rollup_add_many(ProjectYear, ('project_id', 'year'), ('total_time',),
+                     [(key, (delta,)) for key, delta in year_delta])
+    project_class = _project_class(set(project_id for (project_id, year), _ in year_delta))
+    total_delta = {}
+    for (project_id, year), delta in year_delta:
+        billable, holiday = project_class.get(project_id, (False, False))
+        totals = total_delta.setdefault(year, [0, 0, 0])
+        totals[0] += delta
+        totals[1] += delta if billable else 0
+        totals[2] += delta if holiday else 0
+    _rollup_add_many(YearTotal, ('year',), ('total_time', 'billable_time', 'holiday_time'),
+                     [((year,), tuple(totals)) for year, totals in sorted(total_delta.items())])
+    return
+
+
+def migrate():
+    """
+    This method will bring an existing database up to date. Missing tables and indexes are created and the rollup
+    tables are populated if required.
+
+    :return: List of strings with the actions that have been done.
+    """
+    actions = []
+    db.create_all()
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = set(index['name'] for index in inspector.get_indexes(table.name))
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(db.engine)
+                actions.append("Index {i} created on {t}".format(i=index.name, t=table.name))
+    if rollup_needs_rebuild():
+        rollup_rebuild()
+        actions.append("Rollup tables populated")
+    return actions
+
+
+def rollup_needs_rebuild():
+    """
+    This method will check if the rollup tables need to be populated. This is the case on a database that has
+    timesheet records from before the rollup tables were introduced.
+
+    :return: True if rollup tables are empty while timesheet records are available, False otherwise.
     """
-    timesheet_query = db.session.query(Timesheet).filter(Timesheet.datestring >= from_date)\
-        .filter(Timesheet.datestring <= to_date)
-    res = timesheet_query.all()
-    project_time_dict = {}
-    for rec in res:
-        datestr = rec.datestring.strftime('%Y.%m.%d')
-        date_project = "{dt}.{pid}".format(dt=datestr, pid=rec.project_id)
-        project_time_dict[date_project] = rec.timestring
-    return project_time_dict
+    if db.session.query(YearTotal.year).first() is not None:
+        return False
+    return db.session.query(Timesheet.project_id).first() is not None
+
+
+def rollup_rebuild(year=None):
+    """
+    This method will recalculate the rollup tables from the timesheet table and commit the result. The rollupVersion
+    parameter is incremented, so that running servers drop their cached reports (data_version_sync).
+
+    :param year: Year to recalculate, or None for all years.
+
+    :return: (nothing)
+    """
+    project_month_dict, project_year_dict, year_total_dict = _rollup_expected(year)
+    for model in (ProjectMonth, ProjectYear, YearTotal):
+        delete = model.__table__.delete()
+        if year is not None:
+            delete = delete.where(model.__table__.c.year == int(year))
+        db.session.execute(delete)
+    if project_month_dict:
+        db.session.execute(ProjectMonth.__table__.insert(),
+                           [dict(project_id=pid, year=year, month=month, total_time=total_time)
+                            for (pid, year, month), total_time in project_month_dict.items()])
+        db.session.execute(ProjectYear.__table__.insert(),
+                           [dict(project_id=pid, year=year, total_time=total_time)
+                            for (pid, year), total_time in project_year_dict.items()])
+        db.session.execute(YearTotal.__table__.insert(),
+                           [dict(year=year, total_time=totals[0], billable_time=totals[1], holiday_time=totals[2])
+                            for year, totals in year_total_dict.items()])
+    rollup_version = db.session.query(Parameter.value).filter(Parameter.parameter == 'rollupVersion').scalar()
+    db.session.merge(Parameter(parameter='rollupVersion', value=str(int(rollup_version or 0) + 1)))
+    db.session.commit()
+    data_version.bump()
+    return
+
+
+def rollup_verify(year=None):
+    """
+    This method will compare the rollup tables with the values calculated from the timesheet table.
+
+    :param year: Year to verify, or None for all years.
+
+    :return: List of strings, one per rollup record that is different from the calculated value. Empty list if there
+    is no drift.
+    """
+    project_month_dict, project_year_dict, year_total_dict = _rollup_expected(year)
+    stored = []
+    for model in (ProjectMonth, ProjectYear, YearTotal):
+        query = db.session.query(model)
+        if year is not None:
+            query = query.filter(model.year == int(year))
+        stored.append(query.all())
+    stored_month = dict(((rec.project_id, rec.year, rec.month), rec.total_time) for rec in stored[0])
+    stored_year = dict(((rec.project_id, rec.year), rec.total_time) for rec in stored[1])
+    stored_total = dict((rec.year, [rec.total_time, rec.billable_time, rec.holiday_time]) for rec in stored[2])
+    drift = []
+    for name, expected, stored in (('project_month', project_month_dict, stored_month),
+                                   ('project_year', project_year_dict, stored_year),
+                                   ('year_total', year_total_dict, stored_total)):
+        for key in sorted(set(expected) | set(stored)):
+            if expected.get(key) != stored.get(key):
+                drift.append("{t} {k}: expected {e}, found {s}".format(t=name, k=key, e=expected.get(key),
+                                                                        s=stored.get(key)))
+    return drift
+
+
+def rollup_reclassify(project_id, old_billable, old_holiday, new_billable, new_holiday):
+    """
+    This method will move the project time between the billable and holiday totals per year when the project
+    classification changes. The session is not committed.
+
+    :param project_id: Project ID.
+
+    :param old_billable: True if the project was billable.
+
+    :param old_holiday: True if the project was the holidays project.
+
+    :param new_billable: True if the project is billable now.
+
+    :param new_holiday: True if the project is the holidays project now.
+
+    :return: (nothing)
+    """
+    if old_billable == new_billable and old_holiday == new_holiday:
+        return
+    query = db.session.query(ProjectYear.year, ProjectYear.total_time).filter(ProjectYear.project_id == project_id)
+    for rec in query.all():
+        _rollup_add(YearTotal, dict(year=rec.year),
+                    billable_time=(int(new_billable) - int(old_billable)) * rec.total_time,
+                    holiday_time=(int(new_holiday) - int(old_holiday)) * rec.total_time)
+    return
 
 
 def total_time_per_year():
@@ -391,13 +1287,7 @@ def total_time_per_year():
 
     :return: List of dictionaries with year as key and total time as value.
     """
-    total_time_query = db.func.sum(Timesheet.timestring)
-    year_time = db.func.strftime('%Y', Timesheet.datestring)
-    time_year = db.session.query(total_time_query.label('total_time'), year_time.label('year')).group_by(year_time)
-    time_year_dict = {}
-    for rec in time_year:
-        time_year_dict[rec.year] = rec.total_time
-    return time_year_dict
+    return billable_report().time_per_year
 
 
 def total_time_eh_year():
@@ -406,15 +1296,157 @@ def total_time_eh_year():
 
     :return: List of dictionaries with year as key and total time (excluding holidays) as value.
     """
-    total_time = db.func.sum(Timesheet.timestring).label('total_time')
-    year_time = db.func.strftime('%Y', Timesheet.datestring).label('year')
-    total_query = db.session.query(Project, total_time, year_time)\
-        .filter(Project.name != 'Not Available').join(Project.cats)
-    time_year = total_query.group_by(year_time)
-    time_year_dict = {}
-    for rec in time_year:
-        time_year_dict[rec.year] = rec.total_time
-    return time_year_dict
+    return billable_report().time_per_year_eh
+
+
+def table_rows():
+    """
+    This method will count the rows in the timesheet, the projects and the change log table.
+
+    :return: Dictionary with table name and number of rows.
+    """
+    return dict(timesheet=readonly.session.query(db.func.count()).select_from(Timesheet).scalar(),
+                projects=readonly.session.query(db.func.count(Project.project_id)).scalar(),
+                change_log=readonly.session.query(db.func.count(ChangeLog.version)).scalar())
+
+
+def timesheet_bulk(rows):
+    """
+    This method will write many timesheet entries without loading ORM objects. Entries with hours > 0 are upserted
+    (INSERT ... ON CONFLICT DO UPDATE on SQLite, INSERT ... ON DUPLICATE KEY UPDATE on MySQL), entries with hours 0 are
+    deleted. Both are executed as executemany. The current values are collected in one query under the write lock
+    (_write_lock), so that the rollup tables can be updated. The session is not committed, so all rows are written in
+    the caller's transaction.
+
+    :param rows: List of tuples (date, project_id, hours), with date a datetime.date object and hours an integer. If a
+    date and project ID occurs more than once, the last occurrence wins.
+
+    :return: List with the previous number of hours (None if there was no entry) for every row.
+    """
+    rows = [(dt, int(project_id), int(hours)) for dt, project_id, hours in rows]
+    if not rows:
+        return []
+    table = Timesheet.__table__
+    query = db.session.query(table.c.project_id, table.c.datestring, table.c.timestring)\
+        .filter(table.c.datestring >= min(dt for dt, _, _ in rows))\
+        .filter(table.c.datestring <= max(dt for dt, _, _ in rows))\
+        .filter(table.c.project_id.in_(set(project_id for _, project_id, _ in rows)))
+    query = _write_lock(query)
+    current = dict(((rec.project_id, rec.datestring), rec.timestring) for rec in query)
+    existing = set(current)
+    original = dict(current)
+    previous = []
+    deltas = []
+    for dt, project_id, hours in rows:
+        key = (project_id, dt)
+        old = current.get(key)
+        previous.append(old)
+        new = hours if hours > 0 else None
+        deltas.append((project_id, dt, (new or 0) - (old or 0)))
+        current[key] = new
+    upserts = []
+    inserts = []
+    deletes = []
+    for key in set((project_id, dt) for dt, project_id, _ in rows):
+        project_id, dt = key
+        if current[key] is not None:
+            params = dict(project_id=project_id, datestring=dt, timestring=current[key])
+            if key in existing:
+                upserts.append(params)
+            else:
+                inserts.append(params)
+        elif key in existing:
+            deletes.append(dict(b_project_id=project_id, b_datestring=dt))
+    upsert = _upsert_statement()
+    if upsert is not None:
+        if upserts or inserts:
+            db.session.execute(upsert, upserts + inserts)
+    else:
+        if inserts:
+            db.session.execute(table.insert(), inserts)
+        if upserts:
+            update = table.update()\
+                .where(db.and_(table.c.project_id == db.bindparam('b_project_id'),
+                               table.c.datestring == db.bindparam('b_datestring')))\
+                .values(timestring=db.bindparam('timestring'))
+            db.session.execute(update, [dict(b_project_id=params['project_id'], b_datestring=params['datestring'],
+                                             timestring=params['timestring']) for params in upserts])
+    if deletes:
+        delete = table.delete().where(db.and_(table.c.project_id == db.bindparam('b_project_id'),
+                                              table.c.datestring == db.bindparam('b_datestring')))
+        db.session.execute(delete, deletes)
+    rollup_apply(deltas)
+    changelog_add('timesheet', sorted(key for key in set((project_id, dt) for dt, project_id, _ in rows)
+                                      if current[key] != original.get(key)))
+    return previous
+
+
+def timesheet_export(from_date=None, to_date=None, project_id=None, batch=1000):
+    """
+    This method will return the timesheet records with their project as an iterator, ordered by date and project.
+    Rows are fetched from the database in batches on a server-side cursor, so the full table is never in memory.
+
+    :param from_date: First day (datetime.date) to export, or None to start at the oldest booking.
+
+    :param to_date: Last day (inclusive, datetime.date) to export, or None to end at the last booking.
+
+    :param project_id: Project ID to export, or None for all projects.
+
+    :param batch: Number of rows to fetch per batch.
+
+    :return: Iterator over tuples with datestring, project_id, wbs, name, billable, status and timestring.
+    """
+    query = readonly.session.query(Timesheet.datestring, Timesheet.project_id, Project.wbs, Project.name,
+                                   Project.billable, Project.status, Timesheet.timestring)\
+        .join(Project, Project.project_id == Timesheet.project_id)
+    if from_date:
+        query = query.filter(Timesheet.datestring >= from_date)
+    if to_date:
+        query = query.filter(Timesheet.datestring <= to_date)
+    if project_id:
+        query = query.filter(Timesheet.project_id == project_id)
+    query = query.order_by(Timesheet.datestring, Timesheet.project_id)
+    return query.yield_per(batch)
+
+
+def _write_lock(query):
+    """
+    This method will make sure that the current values of a timesheet write are read under the write lock, so that two
+    writes of the same entry can't both calculate their rollup delta from the same previous value. On SQLite the
+    transaction is started with BEGIN IMMEDIATE, unless it holds the lock already because it has written. On other
+    databases the rows are read with SELECT ... FOR UPDATE.
+
+    :param query: Query that reads the current values.
+
+    :return: Query to execute.
+    """
+    if db.session.get_bind(Timesheet.__mapper__).dialect.name != 'sqlite':
+        return query.with_for_update()
+    # The sqlite3 module only starts a transaction for a write, so a transaction holds the lock.
+    if not db.session.connection(mapper=Timesheet.__mapper__).connection.in_transaction:
+        db.session.execute(db.text("BEGIN IMMEDIATE"))
+    return query
+
+
+def _upsert_statement():
+    """
+    This method will return the native upsert statement for the timesheet table on the current database.
+
+    :return: Text statement with parameters project_id, datestring and timestring, or None if the database has no
+    native upsert.
+    """
+    dialect = db.session.get_bind(Timesheet.__mapper__).dialect
+    insert = "INSERT INTO timesheet (project_id, datestring, timestring) " \
+             "VALUES (:project_id, :datestring, :timestring) "
+    if dialect.name == 'sqlite' and dialect.dbapi.sqlite_version_info >= (3, 24, 0):
+        sql = insert + "ON CONFLICT (project_id, datestring) DO UPDATE SET timestring = excluded.timestring"
+    elif dialect.name == 'mysql':
+        sql = insert + "ON DUPLICATE KEY UPDATE timestring = VALUES(timestring)"
+    else:
+        return None
+    return db.text(sql).bindparams(db.bindparam('project_id', type_=db.Integer),
+                                   db.bindparam('datestring', type_=db.Date),
+                                   db.bindparam('timestring', type_=db.Integer))
 
 
 def update_time(dbid=None, ts=None):
@@ -423,8 +1455,6 @@ def update_time(dbid=None, ts=None):
     date and project ID will be update if it exists, created otherwise.
     If not a valid number, then the entry for this date and project ID will be removed.
     Logging is not done for now...
-    Note that for data insert, the date needs to be a (Python) datetime object, while for querying the
-    date needs to be a string.
 
     :param dbid: Datestring (%Y-%m-%d) and Project ID concatenated with .
 
@@ -433,43 +1463,86 @@ def update_time(dbid=None, ts=None):
     :return: (nothing)
     """
     datestring, project_id = dbid.split(".")
-    dt_obj = datetime.strptime(datestring, '%Y-%m-%d')
-    params = dict(datestring=datestring,
-                  project_id=project_id)
+    dt_obj = datetime.strptime(datestring, '%Y-%m-%d').date()
     try:
         ts = int(ts)
     except ValueError:
         # Not a valid number so ignore it...
         return
-    # I have a valid timestring, get current record
-    try:
-        # Timesheet.query.filter_by(datestring=datestring, project_id=project_id).one()
-        Timesheet.query.filter_by(**params).one()
-    except NoResultFound:
-        # This is a new record, add it if value integer and > 0
-        if ts > 0:
-            # Change datestring to datetime object
-            params['datestring'] = dt_obj
-            params['timestring'] = ts
-            Timesheet.add(**params)
-    else:
-        if ts > 0:
-            # Existing record, modify it
-            params['timestring'] = ts
-            Timesheet.edit(**params)
-        else:
-            # Existing record, delete it.
-            Timesheet.delete(**params)
+    timesheet_bulk([(dt_obj, project_id, ts)])
+    db.session.commit()
+    data_version.bump([project_id])
     return
 
 
+def update_time_batch(changes):
+    """
+    This method will apply a list of timesheet changes in one transaction. For each change with a valid date, project
+    ID and number of hours the timesheet entry is created, modified or removed (hours 0), in the same way as
+    update_time. Invalid changes are ignored.
+
+    :param changes: List of dictionaries with keys date (%Y-%m-%d), project_id and hours.
+
+    :return: List of dictionaries with date, project_id, hours and status for each change. Status is one of added,
+    updated, deleted, unchanged or invalid.
+    """
+    result = []
+    valid = []
+    rows = []
+    for change in changes:
+        res = dict(date=change.get('date'), project_id=change.get('project_id'), hours=change.get('hours'),
+                   status='invalid')
+        result.append(res)
+        try:
+            row = (datetime.strptime(res['date'], '%Y-%m-%d').date(), int(res['project_id']), int(res['hours']))
+        except (TypeError, ValueError):
+            continue
+        valid.append(res)
+        rows.append(row)
+    previous = timesheet_bulk(rows)
+    for res, (dt, project_id, hours), old in zip(valid, rows, previous):
+        if old is None:
+            res['status'] = 'added' if hours > 0 else 'unchanged'
+        else:
+            res['status'] = 'updated' if hours > 0 else 'deleted'
+    db.session.commit()
+    data_version.bump(set(project_id for _, project_id, _ in rows))
+    return result
+
+
+@cache.memoize
 def years_available():
     """
     This method will return the years available for selecting reports for a specific year.
     :return: List of years available.
     """
-
-    year_time = db.func.strftime('%Y', Timesheet.datestring)
-    year_list = db.session.query(db.distinct(year_time).label('year')).order_by(year_time.desc())
-    years = [rec.year for rec in year_list]
+    if analytics.enabled():
+        return analytics.years_available()
+    year_list = readonly.session.query(YearTotal.year).order_by(YearTotal.year.desc())
+    years = [str(rec.year) for rec in year_list]
     return years
+
+
+def year_over_year():
+    """
+    This method will return the total time per project per year, to compare the years.
+
+    :return: Tuple (years, rows): list of the years with time in ascending order, and list of ProjectYears tuples with
+    a ProjectRow and a list with the total time for each of the years. The rows are ordered by total time descending.
+    """
+    if analytics.enabled():
+        return analytics.year_over_year()
+    query = db.select(PROJECT_ROW_COLUMNS + [ProjectYear.year, ProjectYear.total_time])\
+        .select_from(Project.__table__.join(ProjectYear.__table__))
+    projects = {}
+    totals = {}
+    for row in readonly.session.execute(query):
+        project_id = row[0]
+        if project_id not in projects:
+            projects[project_id] = ProjectRow(*row[:-2])
+        totals[(project_id, row[-2])] = row[-1]
+    years = sorted(set(year for _, year in totals))
+    rows = [ProjectYears(project, [totals.get((project_id, year), 0) for year in years])
+            for project_id, project in projects.items()]
+    rows.sort(key=lambda row: (-sum(row.years), row.project.project_id))
+    return years, rows
@@ -0,0 +1,97 @@
+"""
+This module formats the timesheet export from db_model.timesheet_export as CSV or as NDJSON (one JSON object per line).
+The formatters are generators that yield a chunk of text for a number of rows, so the export can be sent or written
+while the rows are fetched from the database. Use gzip_stream to compress the chunks on the fly.
+"""
+
+import csv
+import io
+import json
+import zlib
+
+# Columns of the export, in the order of the db_model.timesheet_export rows.
+FIELDS = ('date', 'project_id', 'wbs', 'name', 'billable', 'status', 'hours')
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson'
+}
+
+
+def csv_stream(rows, chunk_rows=500):
+    """
+    Format export rows as CSV, with a header line.
+
+    :param rows: Iterator over export rows.
+
+    :param chunk_rows: Number of rows per yielded chunk.
+
+    :return: Generator of text chunks.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(FIELDS)
+    cnt = 0
+    for row in rows:
+        writer.writerow((row[0].isoformat(),) + tuple(row[1:]))
+        cnt += 1
+        if cnt >= chunk_rows:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            cnt = 0
+    yield buffer.getvalue()
+
+
+def ndjson_stream(rows, chunk_rows=500):
+    """
+    Format export rows as NDJSON: one JSON object per row, with the FIELDS as keys.
+
+    :param rows: Iterator over export rows.
+
+    :param chunk_rows: Number of rows per yielded chunk.
+
+    :return: Generator of text chunks.
+    """
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(FIELDS, (row[0].isoformat(),) + tuple(row[1:]))), sort_keys=True))
+        if len(lines) >= chunk_rows:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def export_stream(rows, fmt):
+    """
+    :param rows: Iterator over export rows.
+
+    :param fmt: 'csv' or 'ndjson'.
+
+    :return: Generator of text chunks in the format.
+    """
+    if fmt == 'csv':
+        return csv_stream(rows)
+    elif fmt == 'ndjson':
+        return ndjson_stream(rows)
+    raise ValueError("Unknown export format {fmt}".format(fmt=fmt))
+
+
+def gzip_stream(chunks, level=6):
+    """
+    Compress text chunks into a gzip file on the fly.
+
+    :param chunks: Iterator over text chunks.
+
+    :param level: Compression level 1 (fast) - 9 (small).
+
+    :return: Generator of gzip byte chunks.
+    """
+    # wbits 16 + MAX_WBITS writes the gzip header and trailer.
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
@@ -36,3 +36,10 @@ class ProjectAdd(Form):
 class SelectDate(Form):
     date = DateField('Select Week', validators=[wtv.InputRequired()], default=datetime.today)
     submit = SubmitField('OK')
+
+
+class SelectPeriod(Form):
+    date = DateField('Select Date', validators=[wtv.InputRequired()], default=datetime.today)
+    span = RadioField('Period', choices=[('week', 'Week'), ('4weeks', '4 Weeks'), ('month', 'Month')],
+                      default='week')
+    submit = SubmitField('OK')
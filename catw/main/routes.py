@@ -1,12 +1,48 @@
 # import logging
 import calendar
+import hmac
+from datetime import timedelta
 import catw.db_model as dbm
 from lib import my_env
-from flask import render_template, flash, redirect, url_for, request
+from flask import render_template, flash, redirect, url_for, request, jsonify, abort, current_app, Response
+from flask import stream_with_context
 from flask_login import login_required, login_user, logout_user, current_user
 from .forms import *
 from . import main
 from catw.db_model import User
+from catw import analytics, cache, export, metrics, warmer
+from catw.cache import conditional_view
+
+
+def stream_template(template_name, **context):
+    """
+    This function renders a template as a stream. Use this for long pages, so that the first part of the page can be
+    sent while the rest of the page is rendered.
+    :param template_name: Name of the template.
+    :param context: Variables for the template.
+    :return: Response streaming the page.
+    """
+    current_app.update_template_context(context)
+    template = current_app.jinja_env.get_template(template_name)
+    stream = template.stream(context)
+    # Send the page in chunks of 50 template parts instead of every part separately.
+    stream.enable_buffering(50)
+    return Response(stream_with_context(stream))
+
+
+def date_arg(name):
+    """
+    This function returns a date from the query string.
+    :param name: Name of the query string argument.
+    :return: datetime.date object, None if the argument is not available. Page not found if the date is not valid.
+    """
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return my_env.datestr2date(value)
+    except ValueError:
+        abort(404)
 
 
 @main.route('/login', methods=['GET', 'POST'])
@@ -51,24 +87,100 @@ def index():
     return redirect(url_for('main.report_all'))
 
 
+def week_of(date):
+    """
+    This function returns the week for a date from the URL.
+    :param date: Datestring %Y-%m-%d.
+    :return: List of the week's datetime day objects from Monday to Sunday. Page not found if date is not valid.
+    """
+    try:
+        return my_env.date2week(my_env.datestr2date(date))
+    except ValueError:
+        abort(404)
+
+
 @main.route('/entertime', methods=['GET', 'POST'])
 @login_required
 def enter_time():
-    form = SelectDate()
-    if request.method == 'POST':
-        weeklist = my_env.date2week(form.date.data)
-        # The project list is the list of all projects.
-        # This allows to modify time entries from the past.
-        # For now, project list will only have Open Projects
-        projectlist = dbm.openprojectlist()
-        # Time per Project is the booked time per project in the specified week.
-        # This is a dictionary with key YYYY.MM.DD.Project_id and value the number of hours booked for the project.
-        project_time = dbm.project_time(weeklist[0], weeklist[6])
-        return render_template('enter_sheet.html', weeklist=weeklist,
-                               projectlist=projectlist, project_time=project_time)
+    form = SelectPeriod()
+    if form.validate_on_submit():
+        date = form.date.data.strftime('%Y-%m-%d')
+        if form.span.data == 'week':
+            return redirect(url_for('main.enter_sheet', date=date))
+        return redirect(url_for('main.enter_range', span=form.span.data, date=date))
     return render_template('project_add.html', form=form, title='Kies periode')
 
 
+@main.route('/entertime/range/<span>/<date>')
+@login_required
+@conditional_view()
+def enter_range(span, date):
+    """
+    This function shows the timesheet for a number of weeks. The project rows are rendered once, the hours for each
+    week are fetched from enter_week when the week is scrolled into view.
+    :param span: 'week', '4weeks' or 'month'.
+    :param date: Datestring %Y-%m-%d in the period.
+    """
+    try:
+        dt = my_env.datestr2date(date)
+        weeks = my_env.period_weeks(dt, span)
+    except ValueError:
+        abort(404)
+    prev_date = my_env.period_shift(dt, span, -1)
+    next_date = my_env.period_shift(dt, span, 1)
+    params = dict(
+        span=span,
+        weeks=weeks,
+        projectlist=dbm.openprojectlist_rows(),
+        prev_url=url_for('main.enter_range', span=span, date=prev_date.strftime('%Y-%m-%d')),
+        next_url=url_for('main.enter_range', span=span, date=next_date.strftime('%Y-%m-%d')),
+        # Week before and after the period, to prefetch their hours.
+        prev_week=weeks[0][0] - timedelta(weeks=1),
+        next_week=weeks[-1][0] + timedelta(weeks=1)
+    )
+    return render_template('enter_range.html', **params)
+
+
+@main.route('/entertime/week/<date>')
+@login_required
+@conditional_view()
+def enter_week(date):
+    """
+    This function returns the booked hours for a week as JSON, for the weeks on the enter_range page.
+    :param date: Datestring %Y-%m-%d in the week.
+    :return: JSON object with days (%Y-%m-%d), hours (list of hours per day for every project ID with bookings),
+    project_totals (per project ID with bookings), totals (per day) and total.
+    """
+    weeklist = week_of(date)
+    grid = dbm.project_time(weeklist[0], weeklist[6])
+    return jsonify(days=grid.day_keys,
+                   hours=dict((str(pid), grid.row(pid)) for pid in grid.project_ids),
+                   project_totals=dict((str(pid), grid.row_totals[pid]) for pid in grid.project_ids),
+                   totals=grid.column_totals,
+                   total=grid.total)
+
+
+@main.route('/entertime/<date>')
+@login_required
+@conditional_view()
+def enter_sheet(date):
+    """
+    This function shows the timesheet for a week. The rows of the grid are prepared in the view: the dbid and the hours
+    for every cell, the project totals, and the day headers and totals.
+    :param date: Datestring %Y-%m-%d in the week.
+    """
+    weeklist = week_of(date)
+    # The project list is the list of all projects.
+    # This allows to modify time entries from the past.
+    # For now, project list will only have Open Projects
+    projectlist = dbm.openprojectlist_rows()
+    # Time per Project is the booked time per project in the specified week.
+    # This is a PeriodGrid with for every project the number of hours booked per day.
+    project_time = dbm.project_time(weeklist[0], weeklist[6])
+    return render_template('enter_sheet.html', columns=project_time.columns(),
+                           rows=project_time.cell_rows(projectlist), total=project_time.total)
+
+
 @main.route('/updatetime', methods=['GET', 'POST'])
 @login_required
 def update_time():
@@ -84,6 +196,28 @@ def update_time():
     return 'OK'
 
 
+@main.route('/updatetime/batch', methods=['POST'])
+@login_required
+def update_time_batch():
+    """
+    This function accepts a JSON array of timesheet changes {date, project_id, hours} and applies them in one
+    transaction. The response has the status per cell, and the project and day totals for the weeks of the changes.
+    :return: JSON object with keys cells, project_totals, day_totals and total.
+    """
+    changes = request.get_json(silent=True)
+    if not isinstance(changes, list) or not all(isinstance(change, dict) for change in changes):
+        abort(400)
+    cells = dbm.update_time_batch(changes)
+    dates = [my_env.datestr2date(cell['date']) for cell in cells if cell['status'] != 'invalid']
+    if not dates:
+        return jsonify(cells=cells, project_totals={}, day_totals={}, total=0)
+    grid = dbm.project_time(my_env.date2week(min(dates))[0], my_env.date2week(max(dates))[6])
+    return jsonify(cells=cells,
+                   project_totals=dict((str(pid), value) for pid, value in grid.row_totals.items()),
+                   day_totals=dict(zip(grid.day_keys, grid.column_totals)),
+                   total=grid.total)
+
+
 @main.route('/project/add', methods=['GET', 'POST'])
 @login_required
 def project_add(project_id=None):
@@ -127,57 +261,85 @@ def project_edit(project_id):
 
 
 @main.route('/report/project/<project_id>/month')
+@conditional_view(project_arg='project_id')
+@cache.cached_view
 def report_project_month(project_id):
     params = dict(
         month_name=calendar.month_name,
         project=dbm.project(project_id),
         project_total=dbm.project_total(project_id),
-        project_month=dbm.project_month(project_id),
+        project_month=dbm.project_month_rows(project_id),
         hpd=dbm.get_param_value()
     )
     return render_template('report_project_month.html', **params)
 
 
 @main.route('/report/project/<project_id>/day')
+@conditional_view(project_arg='project_id')
+@cache.cached_view
 def report_project_day(project_id):
+    """
+    Report of the hours per day for a project. The days are shown in pages of REPORT_PAGE_SIZE days, use query string
+    argument after or before to get the next or previous page. With argument stream all days are streamed.
+    """
     params = dict(
         project=dbm.project(project_id),
         project_total=dbm.project_total(project_id),
-        project_day=dbm.project_day(project_id),
-        hpd=dbm.get_param_value()
+        hpd=dbm.get_param_value(),
+        prev_before=None,
+        next_after=None
     )
+    if request.args.get('stream'):
+        params['project_day'] = dbm.project_day_stream(project_id)
+        return stream_template('report_project_day.html', **params)
+    page_size = current_app.config.get('REPORT_PAGE_SIZE', 100)
+    after = date_arg('after')
+    before = date_arg('before')
+    # Get one day more than the page size to know if there is a next (or previous) page.
+    project_day = dbm.project_day_rows(project_id, after=after, before=before, limit=page_size + 1)
+    if before:
+        if len(project_day) > page_size:
+            project_day = project_day[1:]
+            params['prev_before'] = project_day[0].ds
+        params['next_after'] = project_day[-1].ds if project_day else None
+    else:
+        if len(project_day) > page_size:
+            project_day = project_day[:page_size]
+            params['next_after'] = project_day[-1].ds
+        if after and project_day:
+            params['prev_before'] = project_day[0].ds
+    params['project_day'] = project_day
     return render_template('report_project_day.html', **params)
 
 
 @main.route('/report/project/select')
+@conditional_view()
+@cache.cached_view
 def report_project_select():
     params = dict(
-        project_list=dbm.projects_all()
+        project_list=dbm.projects_all_rows()
     )
     return render_template('report_project_select.html', **params)
 
 
 @main.route('/report/billable')
+@conditional_view()
+@cache.cached_view
 def report_billable():
     params = dict(
-        oldest_booking=dbm.get_oldest_booking(),
         report_header='Overview Billable',
-        total_time=dbm.overview_all_total_time(),
-        total_billable=dbm.billable_all_total_time(),
-        total_holidays=dbm.holidays_all_total_time(),
-        hpd=dbm.get_param_value(),
-        billable_per_year=dbm.billable_per_year(),
-        time_per_year=dbm.total_time_per_year(),
-        time_per_year_eh=dbm.total_time_eh_year()
+        report=dbm.billable_report()
     )
     return render_template('report_billable.html', **params)
 
 
 @main.route('/report/all')
+@conditional_view()
+@cache.cached_view
 def report_all():
     params = dict(
         report_header='Overview All Projects',
-        project_report=dbm.overview_all(),
+        project_report=dbm.overview_all_rows(),
         total_time=dbm.overview_all_total_time(),
         hpd=dbm.get_param_value(),
     )
@@ -187,26 +349,33 @@ def report_all():
 @main.route('/report/week', methods=['GET', 'POST'])
 def report_week():
     form = SelectDate()
-    if request.method == 'POST':
-        weeklist = my_env.date2week(form.date.data)
-        # The project list is the list of relevant projects for the week.
-        # Time per Project is the booked time per project in the specified week.
-        # This is a dictionary with key YYYY.MM.DD.Project_id and value the number of hours booked for the project.
-        project_time = dbm.project_time(weeklist[0], weeklist[6])
-        pids = my_env.get_pids_from_period(project_time.keys())
-        projectlist = dbm.projectlist(pids)
-        return render_template('report_week.html', weeklist=weeklist,
-                               projectlist=projectlist, project_time=project_time)
+    if form.validate_on_submit():
+        return redirect(url_for('main.report_week_date', date=form.date.data.strftime('%Y-%m-%d')))
     return render_template('project_add.html', form=form, title='Kies Periode')
 
 
+@main.route('/report/week/<date>')
+@conditional_view()
+def report_week_date(date):
+    weeklist = week_of(date)
+    # The project list is the list of relevant projects for the week.
+    # Time per Project is the booked time per project in the specified week.
+    # This is a PeriodGrid with for every project the number of hours booked per day.
+    project_time = dbm.project_time(weeklist[0], weeklist[6])
+    projectlist = dbm.projectlist_rows(project_time.project_ids)
+    return render_template('report_week.html', weeklist=weeklist,
+                           projectlist=projectlist, project_time=project_time)
+
+
 @main.route('/report/years')
 @main.route('/report/years/<year>')
+@conditional_view()
+@cache.cached_view
 def report_year(year=None):
     if year:
         params = dict(
             report_header='Overview All Projects {yr}'.format(yr=year),
-            project_report=dbm.overview_year(year=year),
+            project_report=dbm.overview_year_rows(year=year),
             total_time=dbm.overview_year_total_time(year=year),
             hpd=dbm.get_param_value()
         )
@@ -217,6 +386,83 @@ def report_year(year=None):
         return render_template('report_year_select.html', years=years)
 
 
+@main.route('/export/timesheet')
+@login_required
+def export_timesheet():
+    """
+    This function streams the timesheet records with their project as CSV or NDJSON. The rows are fetched in batches
+    and written while they are fetched, so the download starts immediately and memory use doesn't depend on the number
+    of records.
+    Query string arguments: format (csv or ndjson, default csv), from and to (%Y-%m-%d, to is inclusive), project_id
+    and gzip (1 to compress the file).
+    :return: Response streaming the export as a file download.
+    """
+    fmt = request.args.get('format', 'csv')
+    if fmt not in export.FORMATS:
+        abort(404)
+    project_id = request.args.get('project_id', type=int)
+    rows = dbm.timesheet_export(from_date=date_arg('from'), to_date=date_arg('to'), project_id=project_id)
+    stream = export.export_stream(rows, fmt)
+    filename = 'timesheet.{fmt}'.format(fmt=fmt)
+    mimetype = export.FORMATS[fmt]
+    if request.args.get('gzip'):
+        stream = export.gzip_stream(stream)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    response = Response(stream_with_context(stream), mimetype=mimetype)
+    response.headers['Content-Disposition'] = 'attachment; filename={fn}'.format(fn=filename)
+    return response
+
+
+@main.route('/status')
+@login_required
+def status():
+    """
+    This function shows the report cache statistics, the status of the report warmer and of the analytics engine.
+    :return: JSON object with keys cache, warmer and analytics.
+    """
+    return jsonify(cache=cache.stats(), warmer=warmer.status(), analytics=analytics.status())
+
+
+@main.route('/api/changes')
+@login_required
+def api_changes():
+    """
+    This function returns the changes after a version, for clients that keep a local copy. A timesheet entry or project
+    that has been written more than once since the version is returned once, with its current value.
+    Query string arguments: since (version of the last change the client has, default 0) and limit (maximum number of
+    changes, default and maximum CHANGE_FEED_BATCH).
+    :return: JSON object with since, version (use as since for the next call), latest (last version in the change log),
+    more (True if there are more changes) and changes. Status 410 if changes since the version have been removed from
+    the change log, the client needs to download everything again.
+    """
+    since = request.args.get('since', 0, type=int)
+    batch = current_app.config.get('CHANGE_FEED_BATCH', 500)
+    limit = min(max(request.args.get('limit', batch, type=int), 1), batch)
+    horizon = dbm.changelog_horizon()
+    if since < horizon:
+        response = jsonify(error='resync', horizon=horizon)
+        response.status_code = 410
+        return response
+    changes, more = dbm.changes_since(since, limit)
+    return jsonify(since=since, version=changes[-1]['version'] if changes else since,
+                   latest=dbm.changes_version(), more=more, changes=changes)
+
+
+@main.route('/metrics')
+def prometheus_metrics():
+    """
+    This function shows the request metrics in the Prometheus text format, for requests with the METRICS_TOKEN only.
+    :return: Metrics as text/plain.
+    """
+    token = current_app.config.get('METRICS_TOKEN')
+    if not (current_app.config.get('METRICS') and token and
+            hmac.compare_digest(request.headers.get('Authorization', '').encode(), ('Bearer ' + token).encode())):
+        abort(404)
+    text = metrics.render(cache_stats=cache.stats(), warmer_status=warmer.status(), table_rows=dbm.table_rows())
+    return Response(text, mimetype='text/plain; version=0.0.4')
+
+
 @main.errorhandler(404)
 def not_found(e):
-    return render_template("404.html", err=e)
+    return render_template("404.html", err=e), 404
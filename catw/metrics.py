@@ -0,0 +1,170 @@
+"""
+This module collects request metrics for the /metrics page in the Prometheus text format: number of requests and a
+latency histogram per endpoint, SQL statements and database time per endpoint. The page adds the report cache, the
+report warmer, the waitress task queue and the size of the timesheet, projects and change log tables.
+Collection takes one short lock per request. The metrics are kept per process: with more than one waitress worker
+process, every scrape shows the process that answers.
+Requests from the report warmer are not counted.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from flask import g, request
+from . import sqltiming
+
+# Upper bounds of the latency histogram buckets in seconds.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """
+    Latency histogram with the BUCKETS. Counts are per bucket, they are made cumulative for the output.
+    """
+
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+def labels(**kwargs):
+    return ','.join('{k}="{v}"'.format(k=k, v=str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                    for k, v in sorted(kwargs.items()))
+
+
+class Metrics:
+    """
+    Flask extension for the request metrics. Switch it on with METRICS = True in the configuration.
+    """
+
+    def __init__(self, app=None):
+        self.lock = threading.Lock()
+        # (endpoint, method, status): number of requests
+        self.requests = {}
+        # endpoint: Histogram
+        self.latency = {}
+        # endpoint: [statements, seconds]
+        self.database = {}
+        # waitress server, to report the task queue.
+        self.server = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config.get('METRICS'):
+            return
+        sqltiming.listen()
+        app.before_request(self.start_request)
+        app.after_request(self.end_request)
+        app.extensions['metrics'] = self
+
+    def set_server(self, server):
+        """
+        :param server: waitress server object from create_server.
+        """
+        self.server = server
+
+    @staticmethod
+    def start_request():
+        g.metrics_start = time.perf_counter()
+        if g.get('sql_stats') is None:
+            g.sql_stats = sqltiming.new_stats()
+
+    def end_request(self, response):
+        start = g.get('metrics_start')
+        if start is None or request.environ.get('catw.warmer'):
+            return response
+        duration = time.perf_counter() - start
+        endpoint = request.endpoint or 'none'
+        stats = g.get('sql_stats')
+        key = (endpoint, request.method, response.status_code)
+        with self.lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+            histogram = self.latency.get(endpoint)
+            if histogram is None:
+                histogram = self.latency[endpoint] = Histogram()
+            histogram.observe(duration)
+            if stats:
+                database = self.database.setdefault(endpoint, [0, 0.0])
+                database[0] += stats['statements']
+                database[1] += stats['time']
+        return response
+
+    def render(self, cache_stats=None, warmer_status=None, table_rows=None):
+        """
+        Format the metrics in the Prometheus text format.
+
+        :param cache_stats: Report cache statistics from ReportCache.stats().
+
+        :param warmer_status: Report warmer status from ReportWarmer.status().
+
+        :param table_rows: Dictionary with table name and number of rows.
+
+        :return: Text with the metrics.
+        """
+        with self.lock:
+            requests = dict(self.requests)
+            latency = dict((endpoint, (list(hist.counts), hist.total, hist.count))
+                           for endpoint, hist in self.latency.items())
+            database = dict((endpoint, tuple(values)) for endpoint, values in self.database.items())
+        lines = []
+
+        def metric(name, kind, text, samples):
+            lines.append("# HELP {n} {t}".format(n=name, t=text))
+            lines.append("# TYPE {n} {k}".format(n=name, k=kind))
+            for suffix, sample_labels, value in samples:
+                sample_labels = '{' + sample_labels + '}' if sample_labels else ''
+                lines.append("{n}{s}{l} {v}".format(n=name, s=suffix, l=sample_labels, v=value))
+
+        metric('catw_http_requests_total', 'counter', "Number of requests per endpoint, method and status.",
+               [('', labels(endpoint=endpoint, method=method, status=status), count)
+                for (endpoint, method, status), count in sorted(requests.items())])
+        samples = []
+        for endpoint, (counts, total, count) in sorted(latency.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS + ('+Inf',), counts):
+                cumulative += bucket_count
+                samples.append(('_bucket', labels(endpoint=endpoint, le=bound), cumulative))
+            samples.append(('_sum', labels(endpoint=endpoint), repr(total)))
+            samples.append(('_count', labels(endpoint=endpoint), count))
+        metric('catw_http_request_duration_seconds', 'histogram', "Request latency per endpoint.", samples)
+        metric('catw_db_statements_total', 'counter', "SQL statements per endpoint.",
+               [('', labels(endpoint=endpoint), values[0]) for endpoint, values in sorted(database.items())])
+        metric('catw_db_duration_seconds_total', 'counter', "Time spent in SQL statements per endpoint.",
+               [('', labels(endpoint=endpoint), repr(values[1])) for endpoint, values in sorted(database.items())])
+        if cache_stats is not None:
+            lookups = cache_stats['hits'] + cache_stats['misses']
+            metric('catw_report_cache_hits_total', 'counter', "Report cache hits.", [('', '', cache_stats['hits'])])
+            metric('catw_report_cache_misses_total', 'counter', "Report cache misses.",
+                   [('', '', cache_stats['misses'])])
+            metric('catw_report_cache_hit_ratio', 'gauge', "Report cache hits per lookup.",
+                   [('', '', repr(cache_stats['hits'] / float(lookups)) if lookups else 0)])
+            metric('catw_report_cache_entries', 'gauge', "Entries in the report cache.",
+                   [('', '', cache_stats['size'])])
+        if warmer_status is not None and warmer_status['enabled']:
+            metric('catw_report_warmer_runs_total', 'counter', "Report warmer runs.",
+                   [('', '', warmer_status['runs'])])
+            metric('catw_report_warmer_failures_total', 'counter', "Failed report warmer runs.",
+                   [('', '', warmer_status['failures'])])
+            if warmer_status['last_run'] is not None:
+                metric('catw_report_warmer_last_run_timestamp_seconds', 'gauge', "End of the last report warmer run.",
+                       [('', '', repr(warmer_status['last_run']))])
+                metric('catw_report_warmer_last_duration_seconds', 'gauge', "Duration of the last report warmer run.",
+                       [('', '', repr(warmer_status['last_duration']))])
+        if self.server is not None:
+            dispatcher = self.server.task_dispatcher
+            metric('catw_waitress_queue_depth', 'gauge', "Requests waiting for a waitress thread.",
+                   [('', '', dispatcher.queue.qsize())])
+            metric('catw_waitress_threads', 'gauge', "waitress threads.", [('', '', len(dispatcher.threads))])
+        if table_rows is not None:
+            metric('catw_table_rows', 'gauge', "Number of rows per table.",
+                   [('', labels(table=table), count) for table, count in sorted(table_rows.items())])
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,86 @@
+"""
+This module provides a session on a separate read-only engine for the report queries, so that long report
+aggregations don't hold a connection or a lock of the writer.
+If SQLALCHEMY_READ_URI is set, the read engine connects to this URI, for example a replica of a server database. A
+replica can lag behind the primary database. Otherwise a SQLite database file is opened read-only (mode=ro) with its
+own connection pool of SQLALCHEMY_READ_POOL_SIZE connections. In all other cases, like an in-memory SQLite database,
+the read session uses the primary engine.
+The db_model report functions use readonly.session, writes remain on db.session.
+"""
+
+import os
+import sqlite3
+from urllib.request import pathname2url
+from flask import current_app, _app_ctx_stack
+from sqlalchemy import create_engine, orm
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+
+class ReadOnlyDatabase:
+    """
+    Flask extension for the read-only session.
+    """
+
+    def __init__(self, db, app=None):
+        """
+        :param db: Flask-SQLAlchemy object of the application, for the primary engine.
+        """
+        self.db = db
+        # One session per application context, as for db.session.
+        self.session = orm.scoped_session(self.create_session, scopefunc=_app_ctx_stack.__ident_func__)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['readonly'] = {}
+        app.teardown_appcontext(self.shutdown_session)
+
+    def shutdown_session(self, response_or_exc):
+        self.session.remove()
+        return response_or_exc
+
+    def dispose(self, app):
+        """
+        Close the pooled connections of the read engines, a forked worker process must open its own connections.
+
+        :param app: Application
+
+        :return:
+        """
+        for engine in app.extensions['readonly'].values():
+            engine.dispose()
+        return
+
+    def create_session(self):
+        return orm.Session(bind=self.get_engine(current_app), autoflush=False, expire_on_commit=False)
+
+    def get_engine(self, app):
+        """
+        :param app: Application
+
+        :return: Read engine for the current database URI of the application.
+        """
+        engines = app.extensions['readonly']
+        key = (app.config['SQLALCHEMY_DATABASE_URI'], app.config.get('SQLALCHEMY_READ_URI'))
+        if key not in engines:
+            engines[key] = self.make_engine(app, *key)
+        return engines[key]
+
+    def make_engine(self, app, uri, read_uri):
+        if read_uri:
+            return create_engine(read_uri, pool_recycle=app.config.get('SQLALCHEMY_POOL_RECYCLE') or -1)
+        url = make_url(uri)
+        if url.get_backend_name() != 'sqlite' or not url.database or url.database == ':memory:':
+            return self.db.get_engine(app)
+        path = url.database
+        if not os.path.isabs(path):
+            # Flask-SQLAlchemy uses relative SQLite paths relative to the application root.
+            path = os.path.join(app.root_path, path)
+        ro_uri = "file:{p}?mode=ro".format(p=pathname2url(path))
+
+        def connect():
+            return sqlite3.connect(ro_uri, uri=True, check_same_thread=False)
+
+        return create_engine('sqlite://', creator=connect, poolclass=QueuePool,
+                             pool_size=app.config.get('SQLALCHEMY_READ_POOL_SIZE', 5))
@@ -0,0 +1,94 @@
+"""
+This module applies a performance profile to the SQLite connections of the application. The pragmas from the
+SQLITE_PRAGMAS configuration are set on every new connection, so WAL journal mode, synchronous, cache and mmap sizes,
+temp store and busy timeout hold for all connections in the pool. With WAL readers don't block the writer and the
+writer doesn't block readers, so report pages don't wait for time entries.
+Every SQLITE_OPTIMIZE_INTERVAL seconds PRAGMA optimize is run after a request, to keep the query planner statistics
+up to date.
+Connections to other databases are not changed.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from flask import current_app, has_app_context
+from sqlalchemy import event, text
+from sqlalchemy.pool import Pool
+
+# Pragmas that can only be set on a connection that can write to the database.
+WRITE_PRAGMAS = ('journal_mode',)
+
+
+def on_connect(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection) or not has_app_context():
+        return
+    pragmas = current_app.config.get('SQLITE_PRAGMAS')
+    if not pragmas:
+        return
+    apply_pragmas(dbapi_connection, pragmas)
+
+
+def apply_pragmas(dbapi_connection, pragmas):
+    """
+    Set the pragmas on a SQLite connection. Pragmas that fail, for example journal_mode on a read-only connection, are
+    logged and skipped.
+
+    :param dbapi_connection: sqlite3 connection.
+
+    :param pragmas: Dictionary with pragma name and value.
+
+    :return: (nothing)
+    """
+    cursor = dbapi_connection.cursor()
+    for name, value in sorted(pragmas.items()):
+        try:
+            cursor.execute("PRAGMA {n}={v}".format(n=name, v=value))
+        except sqlite3.DatabaseError as e:
+            logging.debug("PRAGMA {n}={v} not set: {e}".format(n=name, v=value, e=e))
+    cursor.close()
+    return
+
+
+class SqliteTuning:
+    """
+    Flask extension for the SQLite performance profile.
+    """
+
+    listening = False
+
+    def __init__(self, app=None):
+        self.optimize_interval = 0
+        self.last_optimize = time.time()
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config.get('SQLITE_PRAGMAS'):
+            return
+        # Listen on the Pool class: engines are created when they are first used and can change with the database URI.
+        if not SqliteTuning.listening:
+            event.listen(Pool, 'connect', on_connect)
+            SqliteTuning.listening = True
+        self.optimize_interval = app.config.get('SQLITE_OPTIMIZE_INTERVAL', 0)
+        if self.optimize_interval:
+            app.after_request(self.optimize)
+
+    def optimize(self, response):
+        """
+        Run PRAGMA optimize if the interval has passed. Only one request runs it, other requests don't wait.
+        """
+        if time.time() - self.last_optimize < self.optimize_interval or not self.lock.acquire(False):
+            return response
+        try:
+            self.last_optimize = time.time()
+            engine = current_app.extensions['sqlalchemy'].db.engine
+            if engine.dialect.name == 'sqlite':
+                with engine.connect() as conn:
+                    conn.execute(text("PRAGMA optimize"))
+        except Exception as e:
+            logging.warning("PRAGMA optimize failed: {e}".format(e=e))
+        finally:
+            self.lock.release()
+        return response
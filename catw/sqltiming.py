@@ -0,0 +1,92 @@
+"""
+This module collects SQL statistics per request: number of statements, time spent in the database and number of rows
+reported by the database driver. The statistics are sent in the Server-Timing header of the response, and are logged
+for requests that take longer than SQL_SLOW_REQUEST seconds, together with the slowest statement.
+Switch it on with SQL_TIMING = True in the configuration.
+Note that the SQLite driver only reports row counts for insert, update and delete statements.
+"""
+
+import logging
+import time
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and g.get('sql_stats') is not None:
+        conn.info.setdefault('sql_start', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if not has_request_context():
+        return
+    stats = g.get('sql_stats')
+    if stats is None or not conn.info.get('sql_start'):
+        return
+    duration = time.perf_counter() - conn.info['sql_start'].pop()
+    stats['statements'] += 1
+    stats['time'] += duration
+    if cursor.rowcount > 0:
+        stats['rows'] += cursor.rowcount
+    if duration > stats['slowest_time']:
+        stats['slowest_time'] = duration
+        stats['slowest'] = statement
+
+
+def listen():
+    """
+    Listen on the Engine class, so that all engines of the application are measured. Statements are only counted in
+    requests that have g.sql_stats.
+    """
+    if not SqlTiming.listening:
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+        SqlTiming.listening = True
+    return
+
+
+def new_stats():
+    return dict(statements=0, time=0.0, rows=0, slowest_time=0.0, slowest=None)
+
+
+class SqlTiming:
+    """
+    Flask extension for the SQL statistics per request.
+    """
+
+    listening = False
+
+    def __init__(self, app=None):
+        self.slow_request = 0.5
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config.get('SQL_TIMING'):
+            return
+        self.slow_request = app.config.get('SQL_SLOW_REQUEST', 0.5)
+        listen()
+        app.before_request(self.start_request)
+        app.after_request(self.end_request)
+
+    @staticmethod
+    def start_request():
+        g.sql_stats = new_stats()
+        g.request_start = time.perf_counter()
+
+    def end_request(self, response):
+        stats = g.get('sql_stats')
+        if stats is None:
+            return response
+        duration = time.perf_counter() - g.request_start
+        response.headers.add('Server-Timing', 'db;desc="{s} statements, {r} rows";dur={d:.2f}'
+                             .format(s=stats['statements'], r=stats['rows'], d=stats['time'] * 1000))
+        response.headers.add('Server-Timing', 'app;dur={d:.2f}'.format(d=duration * 1000))
+        if duration > self.slow_request:
+            logging.warning("Slow request {m} {p} ({e}): {t:.3f}s, {s} statements in {db:.3f}s, {r} rows. "
+                            "Slowest statement {st:.3f}s: {sql}"
+                            .format(m=request.method, p=request.full_path, e=request.endpoint, t=duration,
+                                    s=stats['statements'], db=stats['time'], r=stats['rows'],
+                                    st=stats['slowest_time'], sql=stats['slowest']))
+        return response
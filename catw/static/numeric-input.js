@@ -1,55 +1,111 @@
-/* global $ $UPDATE_URL */
+/* global $ $BATCH_URL navigator Blob */
 /* 
 This file is based on the numeric-input-example.js
 https://github.com/mindmup/editable-table/blob/master/numeric-input-example.js
 .on('validate') method is removed. This method allows to modify the first column
 on the table, which is not a requirement for this project.
+Changes are buffered and send to the server as one batch when no cell has been
+changed for FLUSH_DELAY milliseconds, or when the page is left.
+The totals are rendered by the server. After a change the day, project and week
+totals are updated in the page, and replaced by the totals of the batch response
+if no change has been made since, the local totals include those changes.
 */
 $.fn.numericInput = function () {
 	'use strict';
 	var element = $(this),
 		footer = element.find('tfoot tr'),
 		dataRows = element.find('tbody tr'),
-		initialTotal = function () {
-			var column, total;
-			for (column = 1; column < footer.children().size()-1; column++) {
-				total = 0;
+		FLUSH_DELAY = 1500,
+		pending = {},
+		// Number of batch requests that have been sent and not answered yet
+		sending = 0,
+		timer = null,
+		scheduleFlush = function () {
+			if (timer) {
+				window.clearTimeout(timer);
+			}
+			timer = window.setTimeout(flush, FLUSH_DELAY);
+		},
+		flush = function (unloading) {
+			var dbid, parts, changes = [], batch = pending;
+			timer = null;
+			pending = {};
+			for (dbid in batch) {
+				if (batch.hasOwnProperty(dbid)) {
+					parts = dbid.split('.');
+					changes.push({date: parts[0], project_id: parts[1], hours: batch[dbid]});
+				}
+			}
+			if (changes.length === 0) {
+				return;
+			}
+			if (unloading && navigator.sendBeacon) {
+				// An ajax request may be cancelled when the page is left
+				navigator.sendBeacon($BATCH_URL, new Blob([JSON.stringify(changes)], {type: 'application/json'}));
+				return;
+			}
+			sending += 1;
+			$.ajax({
+				url: $BATCH_URL,
+				type: 'POST',
+				contentType: 'application/json',
+				data: JSON.stringify(changes)
+			}).done(function (res) {
+				$.each(res.cells, function (index, cell) {
+					element.find('td[dbid="' + cell.date + '.' + cell.project_id + '"]')
+						.toggleClass('danger', cell.status === 'invalid');
+				});
+				// The totals of the response don't have the changes in pending or in a later batch.
+				if (sending > 1 || !$.isEmptyObject(pending)) {
+					return;
+				}
+				footer.children('[dbdate]').each(function () {
+					var th = $(this);
+					th.text(res.day_totals[th.attr('dbdate')] || 0);
+				});
 				dataRows.each(function () {
 					var row = $(this);
-					total += parseFloat(row.children().eq(column).text());
+					row.children('.row-total').text(res.project_totals[row.attr('project')] || 0);
 				});
-				footer.children().eq(column).text(total);
-			};
-			weektotal();
+				weektotal();
+			}).always(function () {
+				sending -= 1;
+			}).fail(function () {
+				// Keep the changes for the next batch, unless the cell has been changed again.
+				for (dbid in batch) {
+					if (batch.hasOwnProperty(dbid) && !pending.hasOwnProperty(dbid)) {
+						pending[dbid] = batch[dbid];
+					}
+				}
+				scheduleFlush();
+			});
 		},
-		weektotal = function() {
-			var column, total = 0;
-			for (column = 1; column < footer.children().size()-1; column++) {
-				total += parseFloat(footer.children().eq(column).text());
-			}
-			footer.children().eq(8).text(total);
+		sum = function (cells) {
+			var total = 0;
+			cells.each(function () {
+				total += parseFloat($(this).text()) || 0;
+			});
+			return total;
+		},
+		weektotal = function () {
+			footer.children('.week-total').text(sum(footer.children('[dbdate]')));
 		};
 	element.find('td').on('change', function () {
 		var cell = $(this),
-			column = cell.index(),
-			total = 0;
+			column = cell.index();
 		if (column === 0) {
 			return;
 		}
-		// This will be send to the server
-		var dtstr = "dbid=" + cell.attr('dbid') + "&ts=" + cell.text();
-		$.ajax({
-			url: $UPDATE_URL,
-			data: dtstr
-		});
-		element.find('tbody tr').each(function () {
-			var row = $(this);
-			total += parseFloat(row.children().eq(column).text());
-		});
-		footer.children().eq(column).text(total);
+		// Buffer the change, it will be send to the server in the next batch
+		pending[cell.attr('dbid')] = cell.text();
+		scheduleFlush();
+		footer.children().eq(column).text(sum(dataRows.children(':nth-child(' + (column + 1) + ')')));
+		cell.siblings('.row-total').text(sum(cell.parent().children('td')));
 		weektotal();
 	});
+	$(window).on('beforeunload', function () {
+		flush(true);
+	});
 	/* I can't validate for numeric, so accept it but refuse it on Server side */
-	initialTotal();
 	return this;
 };
\ No newline at end of file
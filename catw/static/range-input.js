@@ -0,0 +1,71 @@
+/* global $ window IntersectionObserver */
+/*
+The range entry page has a table per week, with empty bodies. The hours of a week are
+fetched as a JSON chunk when the table scrolls into view, then the project rows are
+copied into the table with the hours and the totals of the chunk, and the table is
+made editable with numericInput.
+The chunks of the weeks before and after a visible week are prefetched, so they are
+available when these weeks are scrolled into view.
+*/
+$.fn.rangeInput = function () {
+	'use strict';
+	var sections = $(this),
+		rows = $($.parseHTML($('#projectRows').html())).filter('tr'),
+		chunks = {},
+		fetchChunk = function (url) {
+			if (!chunks.hasOwnProperty(url)) {
+				chunks[url] = $.getJSON(url).fail(function () {
+					delete chunks[url];
+				});
+			}
+			return chunks[url];
+		},
+		showWeek = function (section) {
+			if (section.data('loaded')) {
+				return;
+			}
+			section.data('loaded', true);
+			fetchChunk(section.data('chunk')).done(function (chunk) {
+				var table = section.find('table'),
+					tbody = table.find('tbody');
+				rows.each(function () {
+					var row = $(this).clone(),
+						pid = row.attr('project'),
+						hours = chunk.hours[pid],
+						total = row.children('.row-total');
+					$.each(chunk.days, function (index, day) {
+						$('<td>').attr('dbid', day + '.' + pid).text(hours ? hours[index] : 0).insertBefore(total);
+					});
+					total.text(chunk.project_totals[pid] || 0);
+					tbody.append(row);
+				});
+				table.find('tfoot th[dbdate]').each(function (index) {
+					$(this).text(chunk.totals[index]);
+				});
+				table.find('tfoot .week-total').text(chunk.total);
+				table.editableTableWidget().numericInput();
+			}).fail(function () {
+				section.data('loaded', false);
+			});
+			fetchChunk(section.data('prev'));
+			fetchChunk(section.data('next'));
+		};
+	if ('IntersectionObserver' in window) {
+		var observer = new IntersectionObserver(function (entries) {
+			$.each(entries, function (index, entry) {
+				if (entry.isIntersecting) {
+					observer.unobserve(entry.target);
+					showWeek($(entry.target));
+				}
+			});
+		}, {rootMargin: '200px'});
+		sections.each(function () {
+			observer.observe(this);
+		});
+	} else {
+		sections.each(function () {
+			showWeek($(this));
+		});
+	}
+	return this;
+};
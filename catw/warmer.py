@@ -0,0 +1,164 @@
+"""
+This module has the report warmer: a background thread that renders the report pages into the report cache after
+time has been entered, so that the next visitor of a report doesn't wait for the aggregation queries.
+The warmer checks the database for writes of other processes every second, and waits until there has been no write
+for REPORT_WARM_DELAY seconds. Then it renders the overview pages, the year reports and the month report of the
+projects that changed, for anonymous and for logged in visitors. The memoized aggregates are calculated on the way.
+REPORT_WARM_PROJECTS limits the number of project pages per run.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from flask import url_for
+from flask_login import login_user
+from .cache import data_version
+
+
+class ReportWarmer:
+    """
+    Flask extension for the report warmer. Set REPORT_WARM_DELAY to 0 to switch it off. The warmer is off if the
+    report cache is off.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.thread = None
+        self.stopping = threading.Event()
+        self.delay = 0
+        self.max_projects = 20
+        self.warmed_version = 0
+        self.last_run = None
+        self.last_duration = None
+        self.last_pages = 0
+        self.runs = 0
+        self.failures = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.delay = app.config.get('REPORT_WARM_DELAY', 0)
+        if not self.delay or app.config.get('REPORT_CACHE_TYPE') == 'null' or self.thread is not None:
+            return
+        self.app = app
+        self.max_projects = app.config.get('REPORT_WARM_PROJECTS', 20)
+        self.warmed_version = data_version.value
+        app.extensions['report_warmer'] = self
+        self.start()
+        atexit.register(self.stop)
+
+    def start(self):
+        """
+        Start the warmer thread. Threads don't survive a fork, a forked worker process calls this to have its own
+        warmer.
+
+        :return:
+        """
+        if self.app is None:
+            return
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name='report-warmer')
+        self.thread.daemon = True
+        self.thread.start()
+        return
+
+    def stop(self, timeout=10):
+        """
+        Stop the warmer thread, a run that is busy stops after the current page.
+
+        :param timeout: Seconds to wait for the thread.
+
+        :return:
+        """
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+        return
+
+    def status(self):
+        """
+        :return: Dictionary with the time of the last run (timestamp), its duration in seconds, the number of pages
+        rendered, the number of runs and failed runs, and the data version that has been warmed.
+        """
+        return dict(enabled=self.thread is not None, last_run=self.last_run, last_duration=self.last_duration,
+                    last_pages=self.last_pages, runs=self.runs, failures=self.failures,
+                    warmed_version=self.warmed_version)
+
+    def run(self):
+        import catw.db_model as dbm
+        while not self.stopping.wait(1):
+            try:
+                with self.app.app_context():
+                    dbm.data_version_sync()
+            except Exception:
+                logging.exception("Report warmer failed to read the data version")
+            version = data_version.value
+            if version == self.warmed_version or time.time() - data_version.modified < self.delay:
+                continue
+            projects = self.changed_projects()
+            # Remember the version before the run, a write during the run triggers the next run.
+            self.warmed_version = version
+            try:
+                self.warm(projects)
+            except Exception:
+                self.failures += 1
+                logging.exception("Report warmer failed")
+
+    def changed_projects(self):
+        """
+        :return: List with the IDs of the projects that have been written since the last run, most recent first.
+        """
+        import catw.db_model as dbm
+        with self.app.app_context():
+            project_ids = [project.project_id for project in dbm.projects_all()]
+        changed = []
+        for project_id in project_ids:
+            project_version, _ = data_version.project(project_id)
+            if project_version > self.warmed_version:
+                changed.append((project_version, project_id))
+        return [project_id for _, project_id in sorted(changed, reverse=True)][:self.max_projects]
+
+    def urls(self, projects):
+        # Import here, db_model imports the catw package.
+        import catw.db_model as dbm
+        with self.app.app_context():
+            years = dbm.years_available()
+        with self.app.test_request_context():
+            urls = [url_for('main.report_all'), url_for('main.report_billable'), url_for('main.report_year')]
+            urls += [url_for('main.report_year', year=year) for year in years]
+            urls += [url_for('main.report_project_month', project_id=project_id) for project_id in projects]
+        return urls
+
+    def warm(self, projects):
+        """
+        Render the report pages into the report cache.
+
+        :param projects: List of project IDs for the month reports.
+
+        :return:
+        """
+        import catw.db_model as dbm
+        start = time.perf_counter()
+        with self.app.app_context():
+            user = dbm.User.query.first()
+            user_id = user.get_id() if user else None
+        pages = 0
+        for url in self.urls(projects):
+            # The cached page depends on the visitor being logged in or not.
+            for logged_in in (False, True) if user_id else (False,):
+                if self.stopping.is_set():
+                    return
+                # The marker keeps warmer requests out of the request metrics.
+                with self.app.test_request_context(url, environ_overrides={'catw.warmer': True}):
+                    if logged_in:
+                        login_user(dbm.load_user(user_id))
+                    self.app.full_dispatch_request()
+                pages += 1
+        self.runs += 1
+        self.last_run = time.time()
+        self.last_duration = time.perf_counter() - start
+        self.last_pages = pages
+        logging.info("Report warmer: {p} pages in {d:.3f}s".format(p=pages, d=self.last_duration))
+        return
@@ -1,4 +1,5 @@
 import os
+import tempfile
 # basedir = os.path.abspath(os.path.dirname(__file__))
 # print('Basedir: {b}'.format(b=basedir))
 
@@ -16,6 +17,71 @@ class Config:
     # errors in the log: https://help.pythonanywhere.com/pages/UsingSQLAlchemywithMySQL (from: PythonAnywhere -
     # some tips for specific web frameworks: Flask
     SQLALCHEMY_POOL_RECYCLE = 280
+    # Database for the report queries, for example a replica. If not set, a SQLite database file is opened read-only
+    # with a pool of SQLALCHEMY_READ_POOL_SIZE connections.
+    SQLALCHEMY_READ_URI = None
+    SQLALCHEMY_READ_POOL_SIZE = 5
+
+    # Report cache: simple (in-process LRU cache) or null (no caching). Size in entries, time to live in seconds.
+    REPORT_CACHE_TYPE = 'simple'
+    REPORT_CACHE_SIZE = 256
+    REPORT_CACHE_TTL = 3600
+    # Report warmer: render the report pages into the cache when there has been no write for REPORT_WARM_DELAY seconds,
+    # 0 to switch it off. At most REPORT_WARM_PROJECTS project month reports are rendered per run.
+    REPORT_WARM_DELAY = 5
+    REPORT_WARM_PROJECTS = 20
+
+    # SQL statistics per request in the Server-Timing header. Requests slower than SQL_SLOW_REQUEST seconds are logged
+    # with the slowest statement.
+    SQL_TIMING = False
+    SQL_SLOW_REQUEST = 0.5
+    # Request metrics on /metrics in the Prometheus text format. The page is only shown for requests with the header
+    # Authorization: Bearer METRICS_TOKEN, the client address is the reverse proxy for every request.
+    METRICS = False
+    METRICS_TOKEN = None
+
+    # Change feed on /api/changes: at most CHANGE_FEED_BATCH changes per response. The change log is compacted every
+    # CHANGE_LOG_COMPACT_INTERVAL seconds (0 to switch it off), changes older than CHANGE_LOG_RETENTION_DAYS are
+    # removed.
+    CHANGE_FEED_BATCH = 500
+    CHANGE_LOG_RETENTION_DAYS = 30
+    CHANGE_LOG_COMPACT_INTERVAL = 3600
+
+    # Report engine: sql calculates the reports in the database, numpy from a snapshot of the timesheet table in NumPy
+    # arrays (NumPy required).
+    ANALYTICS_ENGINE = 'sql'
+
+    # Bootstrap and jQuery from the Flask-Bootstrap package instead of a CDN. Build the JavaScript and CSS bundles with
+    # build_assets.py, without a build the source files are served.
+    BOOTSTRAP_SERVE_LOCAL = True
+
+    # Response compression: gzip or deflate, as accepted by the client, for responses of at least COMPRESS_MIN_SIZE
+    # bytes. COMPRESS_LEVEL is the zlib level from 1 (fast) to 9 (small), 0 to switch compression off.
+    COMPRESS_LEVEL = 6
+    COMPRESS_MIN_SIZE = 1024
+
+    # Compiled templates are stored in the Jinja bytecode cache, so that a new worker process loads them instead of
+    # compiling them again. The cache is in a directory of the user that only the user can access.
+    JINJA_BYTECODE_CACHE = True
+
+    # Number of days per page in the per day project report.
+    REPORT_PAGE_SIZE = 100
+
+    # SQLite performance profile, set on every new connection. WAL lets readers and the writer work at the same time.
+    # cache_size is negative for KiB, mmap_size in bytes, busy_timeout in milliseconds. Set to None to keep the SQLite
+    # defaults. PRAGMA optimize runs every SQLITE_OPTIMIZE_INTERVAL seconds, 0 to switch it off.
+    SQLITE_PRAGMAS = dict(journal_mode='WAL', synchronous='NORMAL', cache_size=-16000, mmap_size=268435456,
+                          temp_store='MEMORY', busy_timeout=5000)
+    SQLITE_OPTIMIZE_INTERVAL = 3600
+
+    # waitress server for cats.py, environment variables CATW_<NAME> override SERVER_<NAME>. More than 1 worker forks
+    # worker processes that share the listening socket.
+    SERVER_LISTEN = '127.0.0.1:8001'
+    SERVER_THREADS = 4
+    SERVER_CONNECTION_LIMIT = 100
+    SERVER_CHANNEL_TIMEOUT = 120
+    SERVER_BACKLOG = 1024
+    SERVER_WORKERS = 1
 
     @staticmethod
     def init_app(app):
@@ -38,11 +104,22 @@ class TestingConfig(Config):
     TESTING = True
     SECRET_KEY = 'The Secret Test Key!'
     WTF_CSRF_ENABLED = False
+    REPORT_WARM_DELAY = 0
     SERVER_NAME = 'localhost:5999'
     SQLALCHEMY_DATABASE_URI = "sqlite:///C:\\Development\\python\\catw\\catw\\data\\catw.db"
     LOGDIR = "C:\\Temp\\Log"
 
 
+class BenchmarkConfig(TestingConfig):
+    # The benchmark package sets the database URI for every dataset.
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    LOGDIR = tempfile.gettempdir()
+    # Measure the queries, not the report cache.
+    REPORT_CACHE_TYPE = 'null'
+    METRICS = True
+    METRICS_TOKEN = 'benchmark'
+
+
 class ProductionConfig(Config):
     ADMINS = ['dirk@vermeylen.net']
     LOGLEVEL = "warning"
@@ -54,6 +131,7 @@ class ProductionConfig(Config):
 config = {
     'development': DevelopmentConfig,
     'testing': TestingConfig,
+    'benchmark': BenchmarkConfig,
     'production': ProductionConfig,
 
     'default': DevelopmentConfig
@@ -0,0 +1,41 @@
+"""
+This script will export the timesheet records with their project as CSV or NDJSON, for all bookings or for a date range
+or a project. Rows are fetched in batches and written while they are fetched, so memory use doesn't depend on the
+number of records.
+"""
+import argparse
+import platform
+import sys
+from catw import create_app, export
+import catw.db_model as dbm
+from lib import my_env
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the timesheet as CSV or NDJSON.")
+    parser.add_argument('--format', choices=sorted(export.FORMATS), default='csv', help="Export format, default csv.")
+    parser.add_argument('--from', dest='from_date', type=my_env.datestr2date, help="First day, YYYY-MM-DD.")
+    parser.add_argument('--to', dest='to_date', type=my_env.datestr2date, help="Last day (inclusive), YYYY-MM-DD.")
+    parser.add_argument('--project', type=int, help="Only export this project ID.")
+    parser.add_argument('--gzip', action='store_true', help="Compress the export.")
+    parser.add_argument('--output', help="Output file, default standard output.")
+    args = parser.parse_args()
+    if platform.node() == "zeegeus":
+        app = create_app('production')
+    else:
+        app = create_app('development')
+
+    with app.app_context():
+        rows = dbm.timesheet_export(from_date=args.from_date, to_date=args.to_date, project_id=args.project)
+        stream = export.export_stream(rows, args.format)
+        if args.gzip:
+            stream = export.gzip_stream(stream)
+            fh = open(args.output, 'wb') if args.output else sys.stdout.buffer
+        else:
+            fh = open(args.output, 'w', newline='', encoding='utf-8') if args.output else sys.stdout
+        try:
+            for chunk in stream:
+                fh.write(chunk)
+        finally:
+            if args.output:
+                fh.close()
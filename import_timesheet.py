@@ -0,0 +1,155 @@
+"""
+This script will load timesheet files in CSV or NDJSON format, as written by export_timesheet.py, into the timesheet
+table. The files need the fields date (YYYY-MM-DD), hours and wbs and/or name of the project. A project is matched on
+WBS and name, then on WBS, then on name. Projects that are not found are added with Project.add, with billable and
+status from the file if available. A project without billable in the file is not billable.
+Bookings are written in chunks with executemany upserts (db_model.timesheet_bulk), one transaction per chunk. Hours 0
+removes a booking. With --dry-run the files are validated only, nothing is written and the database is not migrated.
+"""
+import argparse
+import csv
+import gzip
+import io
+import json
+import platform
+import sys
+from catw import create_app, db
+import catw.db_model as dbm
+from lib import my_env
+
+
+def read_file(filename, fmt=None):
+    """
+    This method will read the records from a CSV or NDJSON file. Files with extension .gz are decompressed.
+
+    :param filename: Name of the file.
+
+    :param fmt: 'csv' or 'ndjson', or None to take the format from the file extension.
+
+    :return: Iterator over tuples (line number, record). A CSV record is a dictionary with the fields, an NDJSON
+    record is the line, it is decoded in parse() so that an invalid line is reported as an error of the record.
+    """
+    name = filename[:-3] if filename.endswith('.gz') else filename
+    if fmt is None:
+        fmt = 'ndjson' if name.endswith(('.ndjson', '.jsonl', '.json')) else 'csv'
+    if filename.endswith('.gz'):
+        fh = io.TextIOWrapper(gzip.open(filename), encoding='utf-8', newline='')
+    else:
+        fh = open(filename, encoding='utf-8', newline='')
+    with fh:
+        if fmt == 'csv':
+            # Line 1 is the header line.
+            for lineno, rec in enumerate(csv.DictReader(fh), start=2):
+                yield lineno, rec
+        else:
+            for lineno, line in enumerate(fh, start=1):
+                if line.strip():
+                    yield lineno, line
+
+
+class ProjectMatcher:
+    """
+    This class finds the project ID for the WBS and name of a record. Projects that are not found are added, or get a
+    temporary negative project ID for a dry run.
+    """
+
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.by_wbs_name = {}
+        self.by_wbs = {}
+        self.by_name = {}
+        self.added = 0
+        for project in dbm.projects_all():
+            self.remember(project.project_id, project.wbs, project.name)
+        # A WBS that is used for more than one project can't identify a project.
+        self.by_wbs = dict((wbs, pid) for wbs, pid in self.by_wbs.items() if pid is not None)
+
+    def remember(self, project_id, wbs, name):
+        self.by_wbs_name[(wbs, name)] = project_id
+        self.by_wbs[wbs] = None if wbs in self.by_wbs and self.by_wbs[wbs] != project_id else project_id
+        self.by_name.setdefault(name, project_id)
+
+    def project_id(self, rec, first_day):
+        """
+        :param rec: Dictionary with the fields of the record.
+
+        :param first_day: Date of the booking, used as start date for a new project.
+
+        :return: Project ID for the record.
+        """
+        wbs = rec.get('wbs') or None
+        name = rec.get('name') or None
+        if wbs is None and name is None:
+            raise ValueError("wbs or name is required")
+        for key, index in (((wbs, name), self.by_wbs_name), (wbs, self.by_wbs), (name, self.by_name)):
+            if key in index:
+                return index[key]
+        if self.dry_run:
+            project_id = -1 - self.added
+        else:
+            project_id = dbm.Project.add(wbs=wbs or name, name=name or wbs, start=first_day,
+                                         billable=rec.get('billable') or 'not', status=rec.get('status') or 'open')
+        self.added += 1
+        self.remember(project_id, wbs or name, name or wbs)
+        return project_id
+
+
+def parse(rec, matcher):
+    """
+    :param rec: Dictionary with the fields of the record, or an NDJSON line.
+
+    :param matcher: ProjectMatcher
+
+    :return: Tuple (date, project_id, hours) for timesheet_bulk.
+    """
+    if isinstance(rec, str):
+        rec = json.loads(rec)
+        if not isinstance(rec, dict):
+            raise ValueError("record is not a JSON object")
+    dt = my_env.datestr2date(str(rec.get('date')))
+    hours = int(rec.get('hours'))
+    if hours < 0:
+        raise ValueError("hours must not be negative")
+    return dt, matcher.project_id(rec, dt), hours
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load timesheet files in CSV or NDJSON format.")
+    parser.add_argument('files', nargs='+', help="CSV or NDJSON files, optionally gzipped.")
+    parser.add_argument('--format', choices=['csv', 'ndjson'], help="File format, default from the file extension.")
+    parser.add_argument('--chunk', type=int, default=5000, help="Number of bookings per transaction, default 5000.")
+    parser.add_argument('--dry-run', action='store_true', help="Validate the files, don't write to the database.")
+    args = parser.parse_args()
+    if platform.node() == "zeegeus":
+        app = create_app('production')
+    else:
+        app = create_app('development')
+
+    with app.app_context():
+        if not args.dry_run:
+            dbm.migrate()
+        matcher = ProjectMatcher(dry_run=args.dry_run)
+        li = my_env.LoopInfo('bookings', args.chunk)
+        errors = 0
+        chunk = []
+        for filename in args.files:
+            for lineno, rec in read_file(filename, args.format):
+                try:
+                    chunk.append(parse(rec, matcher))
+                except (AttributeError, TypeError, ValueError) as e:
+                    errors += 1
+                    print("{f}:{l}: {e}".format(f=filename, l=lineno, e=e), file=sys.stderr)
+                    continue
+                li.info_loop()
+                if len(chunk) >= args.chunk:
+                    if not args.dry_run:
+                        dbm.timesheet_bulk(chunk)
+                        db.session.commit()
+                    chunk = []
+        if chunk and not args.dry_run:
+            dbm.timesheet_bulk(chunk)
+            db.session.commit()
+        li.end_loop()
+        print("{b} bookings, {p} new projects, {e} errors{d}.".format(b=li.rec_cnt, p=matcher.added, e=errors,
+                                                                     d=" (dry run)" if args.dry_run else ""))
+        sys.exit(1 if errors else 0)
@@ -78,6 +78,37 @@ def datestr2date(datestr):
     return date_obj
 
 
+def year_range(year):
+    """
+    This method will return the half-open date interval for a year. Use it as filter datestring >= start and
+    datestring < end, so that the database can use the index on datestring. A filter on strftime('%Y', datestring)
+    needs to read all rows.
+
+    :param year: Year as string or integer.
+
+    :return: Tuple (first day of the year, first day of the next year) as datetime.date objects.
+    """
+    year = int(year)
+    return datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1)
+
+
+def month_range(year, month):
+    """
+    This method will return the half-open date interval for a month, see year_range.
+
+    :param year: Year as string or integer.
+
+    :param month: Month number as string or integer.
+
+    :return: Tuple (first day of the month, first day of the next month) as datetime.date objects.
+    """
+    year = int(year)
+    month = int(month)
+    if month == 12:
+        return datetime.date(year, 12, 1), datetime.date(year + 1, 1, 1)
+    return datetime.date(year, month, 1), datetime.date(year, month + 1, 1)
+
+
 def get_pids_from_period(kl):
     """
     This method will get the project IDs from a list of datestring.pid keys.
@@ -88,9 +119,11 @@ def get_pids_from_period(kl):
     """
     logging.info("Kl: {kl}".format(kl=kl))
     pids = []
+    seen = set()
     for v in kl:
-        pid = v.split(".")[3]
-        if pid not in pids:
+        pid = v.rsplit(".", 1)[1]
+        if pid not in seen:
+            seen.add(pid)
             pids.append(pid)
     logging.info("Result: {r}".format(r=pids))
     return pids
@@ -124,6 +157,56 @@ def date2week(dt):
     return res
 
 
+def period_weeks(dt, span):
+    """
+    This method will return the weeks for a period. Span 'week' is the week of the date, '4weeks' is the week of the
+    date and the 3 following weeks, 'month' are all weeks with a day in the calendar month of the date.
+
+    :param dt: datetime.date object with the date in the period.
+
+    :param span: 'week', '4weeks' or 'month'.
+
+    :return: List of weeks, every week is a list of datetime day objects from Monday to Sunday.
+    """
+    if span == 'week':
+        return [date2week(dt)]
+    elif span == '4weeks':
+        return [date2week(dt + datetime.timedelta(weeks=cnt)) for cnt in range(4)]
+    elif span == 'month':
+        first_day, next_month = month_range(dt.year, dt.month)
+        weeks = []
+        day = first_day
+        while day < next_month:
+            weeks.append(date2week(day))
+            day = weeks[-1][6] + datetime.timedelta(days=1)
+        return weeks
+    raise ValueError("Unknown period span {span}".format(span=span))
+
+
+def period_shift(dt, span, step):
+    """
+    This method will return a date in the previous or next period.
+
+    :param dt: datetime.date object with the date in the period.
+
+    :param span: 'week', '4weeks' or 'month'.
+
+    :param step: -1 for the previous period, 1 for the next period.
+
+    :return: datetime.date object in the period before or after the period of dt.
+    """
+    if span == 'week':
+        return dt + datetime.timedelta(weeks=step)
+    elif span == '4weeks':
+        return dt + datetime.timedelta(weeks=4 * step)
+    elif span == 'month':
+        first_day, next_month = month_range(dt.year, dt.month)
+        if step < 0:
+            return (first_day - datetime.timedelta(days=1)).replace(day=1)
+        return next_month
+    raise ValueError("Unknown period span {span}".format(span=span))
+
+
 class LoopInfo:
     """
     This class handles a FOR loop information handling.
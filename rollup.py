@@ -0,0 +1,31 @@
+"""
+This script will verify the rollup tables (project_month, project_year and year_total) against the timesheet table and
+report the drift. With --rebuild the rollup tables are recalculated from scratch. The database is only migrated for a
+rebuild: a migration can populate the rollup tables, the drift would not be reported.
+"""
+import argparse
+import platform
+from catw import create_app
+import catw.db_model as dbm
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify or rebuild the timesheet rollup tables.")
+    parser.add_argument('--rebuild', action='store_true', help="Recalculate the rollup tables from the timesheet.")
+    parser.add_argument('--year', help="Only verify or rebuild this year.")
+    args = parser.parse_args()
+    if platform.node() == "zeegeus":
+        app = create_app('production')
+    else:
+        app = create_app('development')
+
+    with app.app_context():
+        if args.rebuild:
+            dbm.migrate()
+        drift = dbm.rollup_verify(args.year)
+        for line in drift:
+            print(line)
+        print("{cnt} rollup records with drift.".format(cnt=len(drift)))
+        if args.rebuild:
+            dbm.rollup_rebuild(args.year)
+            print("Rollup tables rebuilt, {cnt} records with drift.".format(cnt=len(dbm.rollup_verify(args.year))))